@@ -0,0 +1,163 @@
+"""
+The follow graph as cached adjacency sets, so follow checks don't query
+PostgreSQL.
+
+    follow:out:<user_id>   ids the user follows       sorted int64 array, as bytes
+                                                      (8 bytes per edge)
+
+A missing key is loaded from Follow with one index-only scan. Sets larger
+than ADJACENCY_LIMIT are not cached. Their key holds a marker instead, and
+questions about them fall back to the database. Follower and following
+counts come from the denormalized counters on User, not from here.
+
+The follow views call on_follow/on_unfollow after the change has
+committed. These insert or remove the id in place while holding a
+short-lived cache lock (cache.add). Every change also bumps a generation
+counter next to the key. A writer that can't get the lock only drops the
+key. The lock holder, and a reader rebuilding the key from the database,
+check the generation again after writing. If another change came in
+meanwhile, they drop the key, so a copy that misses a follow is never
+kept.
+"""
+from array import array
+from bisect import bisect_left, insort
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Follow
+
+TIMEOUT = getattr(settings, 'FOLLOW_GRAPH_TIMEOUT', 10 * 60)
+ADJACENCY_LIMIT = getattr(settings, 'FOLLOW_GRAPH_ADJACENCY_LIMIT', 100000)
+LOCK_TIMEOUT = 5
+TOO_BIG = b'!'  # Marker: the set is over ADJACENCY_LIMIT
+
+# direction: (key prefix, Follow column matched, Follow column collected)
+OUT = ('out', 'follower_id', 'following_id')
+
+
+def _key(direction, user_id):
+    return f'follow:{direction[0]}:{user_id}'
+
+
+class IdSet:
+    """ A sorted id array with set-style membership (usable with `in` in templates) """
+
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __contains__(self, user_id):
+        i = bisect_left(self.ids, user_id)
+        return i < len(self.ids) and self.ids[i] == user_id
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def intersect(self, user_ids):
+        return {user_id for user_id in user_ids if user_id in self}
+
+
+def _generation(key):
+    return cache.get(f'{key}:gen')
+
+
+def _bump(key):
+    """ Count a change to `key`; returns the new generation """
+    gen_key = f'{key}:gen'
+    cache.add(gen_key, 0, TIMEOUT * 2)
+    try:
+        return cache.incr(gen_key)
+    except ValueError:  # Evicted in between
+        cache.set(gen_key, 1, TIMEOUT * 2)
+        return 1
+
+
+def _decode(data):
+    ids = array('q')
+    ids.frombytes(data)
+    return ids
+
+
+def _fetch(direction, user_id):
+    """ Cached bytes (or TOO_BIG), loading them on a miss """
+    key = _key(direction, user_id)
+    data = cache.get(key)
+    if data is None:
+        _, match, collect = direction
+        generation = _generation(key)
+        ids = list(Follow.objects.filter(**{match: user_id})
+                                 .order_by(collect)
+                                 .values_list(collect, flat=True)[:ADJACENCY_LIMIT + 1])
+        data = TOO_BIG if len(ids) > ADJACENCY_LIMIT else array('q', ids).tobytes()
+        cache.add(key, data, TIMEOUT)  # A writer that got there first wins
+        if _generation(key) != generation:
+            cache.delete(key)  # A follow changed while we read; this copy may miss it
+    return data
+
+
+def _load(direction, user_id):
+    """ IdSet, or None when the set is too big to cache """
+    data = _fetch(direction, user_id)
+    return None if data == TOO_BIG else IdSet(_decode(data))
+
+
+# --- Read side ---
+
+def following(user_id):
+    """ Ids `user_id` follows. Following lists are small, so this is always cached """
+    ids = _load(OUT, user_id)
+    if ids is None:
+        return IdSet(array('q', Follow.objects.filter(follower_id=user_id)
+                                              .order_by('following_id')
+                                              .values_list('following_id', flat=True)))
+    return ids
+
+
+def follows(follower_id, following_id):
+    return following_id in following(follower_id)
+
+
+def intersect(user_id, user_ids):
+    """ The subset of `user_ids` that `user_id` follows, in one cache read """
+    return following(user_id).intersect(user_ids)
+
+
+# --- Write side ---
+
+def _update(direction, user_id, member, add):
+    key = _key(direction, user_id)
+    lock = f'{key}:lock'
+    generation = _bump(key)
+    if not cache.add(lock, 1, LOCK_TIMEOUT):
+        cache.delete(key)  # Someone else is editing it (and will see our bump); reload on the next read
+        return
+    try:
+        data = cache.get(key)
+        if data is None or data == TOO_BIG:
+            return  # Loaded on demand / not cached
+        ids = _decode(data)
+        i = bisect_left(ids, member)
+        present = i < len(ids) and ids[i] == member
+        if add and not present:
+            if len(ids) >= ADJACENCY_LIMIT:
+                cache.set(key, TOO_BIG, TIMEOUT)
+                return
+            insort(ids, member)
+        elif not add and present:
+            del ids[i]
+        cache.set(key, ids.tobytes(), TIMEOUT)
+        if _generation(key) != generation:
+            cache.delete(key)  # Another change came in while we held the lock
+    finally:
+        cache.delete(lock)
+
+
+def on_follow(follower, following):
+    _update(OUT, follower.pk, following.pk, add=True)
+
+
+def on_unfollow(follower, following):
+    _update(OUT, follower.pk, following.pk, add=False)
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from accounts import suggestions
+from accounts.models import User
+
+
+class Command(BaseCommand):
+    help = "Recompute friends-of-friends follow suggestions (run periodically, e.g. nightly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Only rebuild these users (default: everyone active)")
+
+    def handle(self, *args, **options):
+        users = User.objects.filter(is_active=True).order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        count = 0
+        for user_id in users.values_list('pk', flat=True).iterator():
+            suggestions.rebuild_for_user(user_id)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt suggestions for {count} user(s)."))
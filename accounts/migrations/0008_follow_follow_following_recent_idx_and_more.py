@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 00:31
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, and avoids
+    # locking the tables for writes while the indexes build
+    atomic = False
+
+    dependencies = [
+        ("accounts", "0007_user_followers_count_user_following_count"),
+        ("auth", "0012_alter_user_first_name_max_length"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="follow",
+            index=models.Index(
+                fields=["following", "-created_at"], name="follow_following_recent_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="passwordresetotp",
+            index=models.Index(fields=["user", "otp_code"], name="otp_user_code_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(fields=["-created_at"], name="user_recent_idx"),
+        ),
+        AddIndexConcurrently(
+            model_name="user",
+            index=models.Index(
+                condition=models.Q(("is_active", False)),
+                fields=["created_at"],
+                name="user_banned_idx",
+            ),
+        ),
+    ]
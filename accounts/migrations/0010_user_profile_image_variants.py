@@ -0,0 +1,18 @@
+# Generated by Django 5.2.8 on 2026-10-18 01:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0009_user_user_username_trgm_idx_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="profile_image_variants",
+            field=models.JSONField(blank=True, default=dict),
+        ),
+    ]
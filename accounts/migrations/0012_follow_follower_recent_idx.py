@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 01:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("accounts", "0011_suggestion"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="follow",
+            index=models.Index(
+                fields=["follower", "-created_at"], name="follow_follower_recent_idx"
+            ),
+        ),
+    ]
@@ -1,23 +1,26 @@
-from datetime import datetime
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest, Upper
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.utils import timezone
+from django.utils.functional import cached_property
 from datetime import timedelta
 import os
 import random
 
+from posts import images
+
 
 def profile_image_path(instance, filename):
-    # Get the file extension (e.g., .jpg, .png)
+    # Only the extension is kept: the storage names the file after its
+    # content hash (posts/storage.py)
     ext = filename.split('.')[-1]
-    # Generate timestamp: profile_pic_20251023123059
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    new_filename = f"profile_pic_{timestamp}.{ext}"
-    # Return the full path: profiles/profile_pic_2025...
-    return os.path.join('profiles/', new_filename)
+    return os.path.join('profiles', f'profile_pic.{ext}')
 
 class User(AbstractUser):
     profile_image = models.ImageField(upload_to=profile_image_path, blank=True, null=True)
+    profile_image_variants = models.JSONField(default=dict, blank=True)  # Written by posts.images
     bio = models.TextField(null=True, blank=True)
     role = models.CharField(max_length=10, choices=[('user', 'User'), ('admin', 'Admin')], default='user')
     is_private = models.BooleanField(default=False) 
@@ -29,11 +32,40 @@ class User(AbstractUser):
     updated_at = models.DateTimeField(auto_now=True)
     admin_notes = models.TextField(blank=True, null=True, help_text="Admin remarks regarding bans or warnings")
 
+    # Denormalized Follow counts, kept in step with F() updates in the follow views
+    followers_count = models.PositiveIntegerField(default=0)
+    following_count = models.PositiveIntegerField(default=0)
+
     def __str__(self):
         return self.username
 
+    @property
+    def is_portal_admin(self):
+        """ May use the admin portal (custom_admin), which moderates every post """
+        return self.role == 'admin' or self.is_superuser
+
+    @cached_property
+    def avatars(self):
+        """ images.Variant per size (`user.avatars.thumb`, `.full`); no picture gives a generated one """
+        return images.variants(self.profile_image, self.profile_image_variants, images.AVATAR_VARIANTS,
+                               fallback=f"https://ui-avatars.com/api/?name={self.username}")
+
     class Meta:
         db_table = 'users'
+        indexes = [
+            # Admin "newest users" lists
+            models.Index(fields=['-created_at'], name='user_recent_idx'),
+            # Admin banned-users count/filter; banned accounts are a small minority
+            models.Index(fields=['created_at'], condition=models.Q(is_active=False), name='user_banned_idx'),
+            # Most-followed accounts, the fallback for users without friends-of-friends suggestions
+            models.Index(fields=['-followers_count'], condition=models.Q(is_active=True, is_staff=False),
+                         name='user_popular_idx'),
+            # Trigram indexes for posts.search; Django's icontains/istartswith compare UPPER(field)
+            GinIndex(OpClass(Upper('username'), name='gin_trgm_ops'), name='user_username_trgm_idx'),
+            GinIndex(OpClass(Upper('first_name'), name='gin_trgm_ops'), name='user_first_name_trgm_idx'),
+            GinIndex(OpClass(Upper('last_name'), name='gin_trgm_ops'), name='user_last_name_trgm_idx'),
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'), name='user_email_trgm_idx'),
+        ]
 
 class Follow(models.Model):
     # 'related_name' allows us to say: user.following.count()
@@ -46,15 +78,63 @@ class Follow(models.Model):
 
     class Meta:
         unique_together = ('follower', 'following')
+        indexes = [
+            # Followers / following modal pages, newest first
+            models.Index(fields=['following', '-created_at'], name='follow_following_recent_idx'),
+            models.Index(fields=['follower', '-created_at'], name='follow_follower_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.follower} follows {self.following}"
+
+    @classmethod
+    def add(cls, follower, following):
+        """ Create the follow and bump both users' counters in one transaction """
+        with transaction.atomic():
+            follow = cls.objects.create(follower=follower, following=following)
+            User.objects.filter(pk=following.pk).update(followers_count=F('followers_count') + 1)
+            User.objects.filter(pk=follower.pk).update(following_count=F('following_count') + 1)
+        return follow
+
+    @classmethod
+    def remove(cls, follower, following):
+        """ Delete the follow (if any) and decrement both counters; returns True if one existed """
+        with transaction.atomic():
+            deleted, _ = cls.objects.filter(follower=follower, following=following).delete()
+            if deleted:
+                User.objects.filter(pk=following.pk).update(followers_count=Greatest(F('followers_count') - 1, 0))
+                User.objects.filter(pk=follower.pk).update(following_count=Greatest(F('following_count') - 1, 0))
+        return bool(deleted)
     
+class Suggestion(models.Model):
+    """
+    "Who to follow" candidate for a user: someone followed by `score` of the
+    accounts they follow (friends-of-friends). Built by accounts.suggestions.
+    """
+    user = models.ForeignKey(User, related_name='suggestions', on_delete=models.CASCADE)
+    suggested = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    score = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('user', 'suggested')
+        indexes = [
+            # A user's best candidates
+            models.Index(fields=['user', '-score'], name='suggestion_user_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.suggested} for {self.user} ({self.score})"
+
 class PasswordResetOTP(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     otp_code = models.CharField(max_length=6)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'otp_code'], name='otp_user_code_idx'),
+        ]
+
     def is_valid(self):
         # OTP is valid for 10 minutes
         return self.created_at >= timezone.now() - timedelta(minutes=10)
\ No newline at end of file
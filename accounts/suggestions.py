@@ -0,0 +1,139 @@
+"""
+"Who to follow", from the follow graph instead of ORDER BY random().
+
+A user's candidates are friends-of-friends: accounts followed by people
+they follow, scored by how many of them do (mutuals). They are stored as
+Suggestion rows, at most PER_USER per user:
+
+    build_suggestions   recomputes them in a periodic batch
+    on_follow           adds one mutual to everyone the newly followed
+                        account follows (and drops it from the list);
+                        on_unfollow takes it away again
+
+The sidebar reads the top PER_USER (id, score) pairs from the cache and
+samples a few at random, so a page view costs one cache read and one
+primary-key lookup. Users without enough candidates (new accounts) are
+topped up from the most-followed accounts, also cached.
+"""
+import random
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, F
+
+from .models import User, Follow, Suggestion
+from . import follow_graph
+
+PER_USER = getattr(settings, 'SUGGESTIONS_PER_USER', 50)
+TIMEOUT = getattr(settings, 'SUGGESTIONS_CACHE_TIMEOUT', 3600)
+POPULAR_TIMEOUT = 600
+INCREMENT_LIMIT = 500  # Followed accounts of a new followee scored on the request; the batch sees the rest
+
+POPULAR_KEY = 'suggest:popular'
+
+
+def _key(user_id):
+    return f'suggest:user:{user_id}'
+
+
+def _candidates():
+    """ Accounts that may be suggested at all """
+    return User.objects.filter(is_active=True, is_staff=False, is_superuser=False)
+
+
+# --- Write side ---
+
+def rebuild_for_user(user_id):
+    """ Recompute one user's candidates from the follow graph (used by build_suggestions) """
+    followed = Follow.objects.filter(follower_id=user_id).values('following_id')
+    rows = Follow.objects.filter(follower_id__in=followed, following__in=_candidates())\
+                         .exclude(following_id__in=followed)\
+                         .exclude(following_id=user_id)\
+                         .values('following_id')\
+                         .annotate(score=Count('pk'))\
+                         .order_by('-score', 'following_id')[:PER_USER]
+    with transaction.atomic():
+        Suggestion.objects.filter(user_id=user_id).delete()
+        Suggestion.objects.bulk_create([
+            Suggestion(user_id=user_id, suggested_id=row['following_id'], score=row['score']) for row in rows
+        ])
+    cache.delete(_key(user_id))
+
+
+def _followed_by(follower, following):
+    """ Up to INCREMENT_LIMIT suggestable accounts `following` follows, minus ones `follower` already follows """
+    ids = list(Follow.objects.filter(follower=following, following__in=_candidates())
+                             .exclude(following_id=follower.pk)
+                             .order_by('-created_at')
+                             .values_list('following_id', flat=True)[:INCREMENT_LIMIT])
+    already = follow_graph.intersect(follower.pk, ids)
+    return [pk for pk in ids if pk not in already]
+
+
+def _trim(user):
+    """ Keep only the user's PER_USER best candidates """
+    best = Suggestion.objects.filter(user=user).order_by('-score', 'suggested_id').values('pk')[:PER_USER]
+    Suggestion.objects.filter(user=user).exclude(pk__in=best).delete()
+
+
+def on_follow(follower, following):
+    ids = _followed_by(follower, following)
+    with transaction.atomic():
+        Suggestion.objects.filter(user=follower, suggested=following).delete()
+        Suggestion.objects.filter(user=follower, suggested_id__in=ids).update(score=F('score') + 1)
+        Suggestion.objects.bulk_create([Suggestion(user=follower, suggested_id=pk, score=1) for pk in ids],
+                                       ignore_conflicts=True)  # Existing rows were bumped above
+        _trim(follower)
+    cache.delete(_key(follower.pk))
+
+
+def on_unfollow(follower, following):
+    ids = _followed_by(follower, following)
+    with transaction.atomic():
+        Suggestion.objects.filter(user=follower, suggested_id__in=ids, score__lte=1).delete()
+        Suggestion.objects.filter(user=follower, suggested_id__in=ids).update(score=F('score') - 1)
+    cache.delete(_key(follower.pk))
+
+
+# --- Read side ---
+
+def _pool(user):
+    """ [(user_id, score), ...], best first """
+    pool = cache.get(_key(user.pk))
+    if pool is None:
+        pool = list(Suggestion.objects.filter(user=user)
+                                      .order_by('-score')
+                                      .values_list('suggested_id', 'score')[:PER_USER])
+        cache.set(_key(user.pk), pool, TIMEOUT)
+    return pool
+
+
+def _popular():
+    ids = cache.get(POPULAR_KEY)
+    if ids is None:
+        ids = list(_candidates().order_by('-followers_count').values_list('pk', flat=True)[:PER_USER])
+        cache.set(POPULAR_KEY, ids, POPULAR_TIMEOUT)
+    return ids
+
+
+def for_user(user, count=5):
+    """
+    Up to `count` random picks from the user's candidates, each with a
+    `mutual` attribute (0 for popular-account fill-ins), most mutuals first
+    """
+    pool = _pool(user)
+    picked = dict(random.sample(pool, min(count, len(pool))))
+
+    if len(picked) < count:
+        # Top up from the most-followed accounts the user isn't following yet
+        extra = [pk for pk in _popular() if pk != user.pk and pk not in picked]
+        extra = random.sample(extra, min(len(extra), (count - len(picked)) * 3))
+        following = follow_graph.intersect(user.pk, extra)
+        picked.update((pk, 0) for pk in extra if pk not in following)
+        picked = dict(list(picked.items())[:count])
+
+    users = list(User.objects.filter(pk__in=picked, is_active=True))
+    for suggested in users:
+        suggested.mutual = picked[suggested.pk]
+    return sorted(users, key=lambda u: -u.mutual)
@@ -1,3 +1,188 @@
+from django.core.cache import cache
 from django.test import TestCase
+from django.urls import reverse
 
-# Create your tests here.
+from . import suggestions, follow_graph
+from .models import User, Follow, Suggestion
+
+
+class SuggestionTests(TestCase):
+    """ Friends-of-friends suggestions, kept up to date on follow/unfollow """
+
+    def setUp(self):
+        cache.clear()
+        self.me, self.a, self.b, self.x, self.y, self.popular = (
+            User.objects.create_user(name, f'{name}@example.com', 'pw')
+            for name in ('me', 'a', 'b', 'x', 'y', 'popular')
+        )
+        self.staff = User.objects.create_user('staff', 'staff@example.com', 'pw', is_staff=True)
+        for follower, following in [(self.me, self.a), (self.me, self.b), (self.a, self.x), (self.b, self.x),
+                                    (self.a, self.y), (self.a, self.staff), (self.x, self.popular),
+                                    (self.y, self.popular)]:
+            Follow.add(follower, following)
+
+    def follow(self, follower, following):
+        """ What the follow views do """
+        Follow.add(follower, following)
+        follow_graph.on_follow(follower, following)
+        suggestions.on_follow(follower, following)
+
+    def unfollow(self, follower, following):
+        Follow.remove(follower, following)
+        follow_graph.on_unfollow(follower, following)
+        suggestions.on_unfollow(follower, following)
+
+    def scores(self):
+        return dict(Suggestion.objects.filter(user=self.me).values_list('suggested__username', 'score'))
+
+    def test_rebuild_scores_mutuals(self):
+        suggestions.rebuild_for_user(self.me.pk)
+        self.assertEqual(self.scores(), {'x': 2, 'y': 1})
+
+        picked = suggestions.for_user(self.me, count=3)
+        self.assertEqual([(u.username, u.mutual) for u in picked], [('x', 2), ('y', 1), ('popular', 0)])
+
+    def test_follow_and_unfollow_update_incrementally(self):
+        suggestions.rebuild_for_user(self.me.pk)
+        suggestions.for_user(self.me)  # Cached
+
+        self.follow(self.me, self.x)
+        self.assertEqual(self.scores(), {'y': 1, 'popular': 1})
+
+        self.follow(self.me, self.y)
+        self.assertEqual(self.scores(), {'popular': 2})
+
+        self.unfollow(self.me, self.x)
+        self.assertEqual(self.scores(), {'popular': 1})
+        # x is no longer followed, so it comes back as a most-followed fill-in
+        self.assertEqual([(u.username, u.mutual) for u in suggestions.for_user(self.me)], [('popular', 1), ('x', 0)])
+
+    def test_follow_keeps_at_most_per_user_rows(self):
+        per_user, suggestions.PER_USER = suggestions.PER_USER, 2
+        self.addCleanup(setattr, suggestions, 'PER_USER', per_user)
+        hub = User.objects.create_user('hub', 'hub@example.com', 'pw')
+        for i in range(5):
+            Follow.add(hub, User.objects.create_user(f'c{i}', f'c{i}@example.com', 'pw'))
+        suggestions.rebuild_for_user(self.me.pk)
+
+        self.follow(self.me, hub)  # Five new candidates
+        self.assertEqual(self.scores(), {'x': 2, 'y': 1})  # The best ones are kept
+
+    def test_sidebar_is_served_from_cache(self):
+        suggestions.rebuild_for_user(self.me.pk)
+        self.client.force_login(self.me)
+        response = self.client.get(reverse('posts:home'))
+        self.assertContains(response, 'Followed by 2 you follow')
+
+        suggestions.for_user(self.me)
+        with self.assertNumQueries(1):  # Only the users' rows; the candidate list comes from the cache
+            suggestions.for_user(self.me, count=2)
+
+
+class FollowGraphTests(TestCase):
+    """ Cached adjacency sets answer follow questions without queries and track changes """
+
+    def setUp(self):
+        cache.clear()
+        self.users = [User.objects.create_user(f'u{i}', f'u{i}@example.com', 'pw') for i in range(5)]
+        self.me = self.users[0]
+        for other in self.users[1:4]:
+            Follow.add(self.me, other)
+
+    def test_answers_from_cache(self):
+        ids = [u.pk for u in self.users]
+        follow_graph.following(self.me.pk)  # Warm
+        with self.assertNumQueries(0):
+            self.assertTrue(follow_graph.follows(self.me.pk, self.users[1].pk))
+            self.assertFalse(follow_graph.follows(self.me.pk, self.users[4].pk))
+            self.assertEqual(follow_graph.intersect(self.me.pk, ids), set(ids[1:4]))
+
+    def test_follow_and_unfollow_update_in_place(self):
+        follow_graph.following(self.me.pk)  # Warm
+        Follow.add(self.me, self.users[4])
+        follow_graph.on_follow(self.me, self.users[4])
+        Follow.remove(self.me, self.users[1])
+        follow_graph.on_unfollow(self.me, self.users[1])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(list(follow_graph.following(self.me.pk)), sorted(u.pk for u in self.users[2:]))
+        cache.clear()
+        self.assertEqual(list(follow_graph.following(self.me.pk)), sorted(u.pk for u in self.users[2:]))
+
+    def test_concurrent_changes_are_not_lost(self):
+        key = f'follow:out:{self.me.pk}'
+        follow_graph.following(self.me.pk)  # Warm
+
+        # A writer that finds the key locked drops it instead of editing it
+        cache.add(f'{key}:lock', 1)
+        Follow.add(self.me, self.users[4])
+        follow_graph.on_follow(self.me, self.users[4])
+        self.assertIsNone(cache.get(key))
+        cache.delete(f'{key}:lock')
+        self.assertTrue(follow_graph.follows(self.me.pk, self.users[4].pk))
+
+        # The lock holder drops its copy when another change lands while it works
+        decode = follow_graph._decode
+        def racing(data):
+            follow_graph._bump(key)
+            return decode(data)
+        follow_graph._decode = racing
+        self.addCleanup(setattr, follow_graph, '_decode', decode)
+        Follow.remove(self.me, self.users[1])
+        follow_graph.on_unfollow(self.me, self.users[1])
+        self.assertIsNone(cache.get(key))
+        follow_graph._decode = decode
+        self.assertFalse(follow_graph.follows(self.me.pk, self.users[1].pk))
+
+    def test_oversized_sets_fall_back_to_the_database(self):
+        limit, follow_graph.ADJACENCY_LIMIT = follow_graph.ADJACENCY_LIMIT, 2
+        self.addCleanup(setattr, follow_graph, 'ADJACENCY_LIMIT', limit)
+        self.assertEqual(list(follow_graph.following(self.me.pk)), sorted(u.pk for u in self.users[1:4]))
+        self.assertEqual(cache.get(f'follow:out:{self.me.pk}'), follow_graph.TOO_BIG)
+        self.assertTrue(follow_graph.follows(self.me.pk, self.users[3].pk))
+
+
+class FollowListTests(TestCase):
+    """ Followers/following modals are keyset-paged JSON with per-row follow flags """
+
+    def setUp(self):
+        cache.clear()
+        self.star = User.objects.create_user('star', 'star@example.com', 'pw')
+        self.me = User.objects.create_user('me', 'me@example.com', 'pw')
+        self.fans = [User.objects.create_user(f'fan{i:02}', f'fan{i}@example.com', 'pw') for i in range(25)]
+        for fan in self.fans:
+            Follow.add(fan, self.star)
+        Follow.add(self.me, self.star)
+        Follow.add(self.me, self.fans[0])
+        self.client.force_login(self.me)
+
+    def test_pages_and_flags(self):
+        url = reverse('accounts:followers', args=['star'])
+        first = self.client.get(url).json()
+        self.assertEqual(len(first['users']), 20)
+        self.assertEqual(first['users'][0]['username'], 'me')  # Newest first
+        self.assertTrue(first['users'][0]['is_me'])
+
+        rest = self.client.get(url, {'cursor': first['next_cursor']}).json()
+        self.assertFalse(rest['has_next'])
+        usernames = [u['username'] for u in first['users'] + rest['users']]
+        self.assertEqual(sorted(usernames), sorted(['me'] + [fan.username for fan in self.fans]))
+        flags = {u['username']: u['is_following'] for u in first['users'] + rest['users']}
+        self.assertEqual({name for name, following in flags.items() if following}, {'fan00'})
+
+        following = self.client.get(reverse('accounts:following', args=['me'])).json()
+        self.assertEqual([u['username'] for u in following['users']], ['fan00', 'star'])
+
+    def test_follow_reply_counts(self):
+        url = reverse('accounts:follow_user', args=['star'])
+        reply = self.client.post(url, headers={'x-requested-with': 'XMLHttpRequest'}).json()
+        self.assertEqual((reply['status'], reply['new_count'], reply['new_following_count']), ('unfollowed', 25, 1))
+        reply = self.client.post(url, headers={'x-requested-with': 'XMLHttpRequest'}).json()
+        self.assertEqual((reply['status'], reply['new_count'], reply['new_following_count']), ('followed', 26, 2))
+
+    def test_search_and_lazy_profile(self):
+        matches = self.client.get(reverse('accounts:followers', args=['star']), {'q': 'FAN1'}).json()
+        self.assertEqual(sorted(u['username'] for u in matches['users']), [f'fan{i}' for i in range(10, 20)])
+
+        # The profile page itself no longer carries the lists
+        self.assertNotContains(self.client.get(reverse('accounts:profile', args=['star'])), 'fan07')
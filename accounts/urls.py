@@ -12,6 +12,8 @@ urlpatterns = [
     
     path('check-email/', views.check_email, name='check_email'),
     path('profile/<str:username>/', views.profile_view, name='profile'),
+    path('profile/<str:username>/followers/', views.follow_list_view, {'direction': 'followers'}, name='followers'),
+    path('profile/<str:username>/following/', views.follow_list_view, {'direction': 'following'}, name='following'),
 
     path('profile/', views.current_profile_redirect, name='current_profile'),
     path('follow/<str:username>/', views.follow_user_view, name='follow_user'),
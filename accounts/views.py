@@ -2,22 +2,28 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout as auth_logout
 from django.contrib.auth.decorators import login_required
 from django.http import JsonResponse
-from django.db.models import Q, Count
+from django.urls import reverse
+from django.db import transaction
 from .forms import SignUpForm, LoginForm, EditProfileForm, CustomPasswordChangeForm
 from .models import User, Follow
+from . import suggestions, follow_graph
 from posts.models import Post, Like, Comment, SavedPost
+from posts import timeline, images, media_queue, audience, fragments
+from posts.pagination import paginate
+from posts.search import search_users
 from django.views.decorators.cache import never_cache
 from django.contrib.auth.forms import PasswordChangeForm
 from django.contrib.auth import update_session_auth_hash
 from django.contrib import messages
 from django.conf import settings
-import os
 
 from django.core.mail import send_mail
 from .forms import ForgotPasswordForm, OTPVerifyForm, ResetPasswordForm
 from .models import PasswordResetOTP, User
 import random
 
+FOLLOW_LIST_PAGE_SIZE = 20  # Rows per Followers/Following modal page
+
 def check_username(request):
     username = request.GET.get('username', '').strip().lower()
     data = {'is_taken': False}
@@ -78,52 +84,81 @@ def logout_view(request):
 def profile_view(request, username):
     profile_user = get_object_or_404(User, username=username)
     
-    # 1. Get Posts
-    posts = Post.objects.filter(user=profile_user, is_active=True)\
-                .annotate(
-                    like_count_attr=Count('likes', distinct=True),
-                    comment_count_attr=Count('comments', distinct=True)
-                ).order_by('-created_at')
+    # 1. Get Posts (one keyset page; the grid loads the rest on scroll), only the ones this viewer may see
+    user_posts = Post.objects.live().filter(user=profile_user).visible_to(request.user)
+    posts = paginate(user_posts, request.GET.get('cursor'))
+
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        posts_data = fragments.tiles_data(posts)  # Cached per post, see posts/fragments.py
+        return JsonResponse({'posts': posts_data, 'has_next': posts.has_next, 'next_cursor': posts.next_cursor})
 
     # 2. Main Follow Button Logic (Top of profile)
     is_following = False
     if request.user.is_authenticated and request.user != profile_user:
-        is_following = Follow.objects.filter(follower=request.user, following=profile_user).exists()
+        is_following = follow_graph.follows(request.user.pk, profile_user.pk)
 
-    # 3. Get Counts
-    followers_count = Follow.objects.filter(following=profile_user).count()
-    following_count = Follow.objects.filter(follower=profile_user).count()
+    # 3. Get Counts (denormalized on User)
+    followers_count = profile_user.followers_count
+    following_count = profile_user.following_count
 
-    # 4. Get Actual Lists (User Objects) for the Modals
-    # We get the 'Follow' objects, then we can access .follower or .following in template
-    followers_relations = Follow.objects.filter(following=profile_user).select_related('follower')
-    following_relations = Follow.objects.filter(follower=profile_user).select_related('following')
+    # 4. The Followers/Following modals load their lists on open (follow_list_view)
 
-    # 5. List of User IDs that the *Logged-in User* is currently following
-    # This is needed to decide whether to show "Follow" or "Following" next to names in the lists
-    my_following_ids = Follow.objects.filter(follower=request.user).values_list('following_id', flat=True)
-    
-    # 6. SUGGESTIONS
-    suggestions = User.objects.exclude(id=request.user.id) \
-                              .exclude(id__in=my_following_ids) \
-                              .exclude(is_superuser=True) \
-                              .exclude(is_staff=True) \
-                              .order_by('?')[:5]
+    # 5. The parts every viewer sees the same (cached, see posts/fragments.py), post
+    #    counts included; the follow button and counts above stay per request
+    header = fragments.profile_header(profile_user)
+    sees_all = audience.sees_all_posts(request.user, profile_user)
 
+    # 6. SUGGESTIONS (cached friends-of-friends, see accounts/suggestions.py)
     context = {
         'profile_user': profile_user,
         'posts': posts,
+        'tiles': fragments.tiles(posts),
+        'header': header,
+        'posts_count': header['posts_count'] if sees_all else header['public_posts_count'],
+        'can_view_profile': sees_all or not profile_user.is_private,
         'is_following': is_following,
         'followers_count': followers_count,
         'following_count': following_count,
-        
-        'followers_relations': followers_relations, 
-        'following_relations': following_relations,
-        'my_following_ids': my_following_ids, 
-        'suggestions': suggestions,
+        'suggestions': suggestions.for_user(request.user),
     }
     return render(request, 'accounts/profile.html', context)
 
+@login_required
+def follow_list_view(request, username, direction):
+    """
+    One keyset page of a profile's followers or following (newest first),
+    for the profile modals. ?q= narrows it by username.
+    """
+    profile_user = get_object_or_404(User, username=username)
+    if not audience.can_view_profile(request.user, profile_user):
+        return JsonResponse({'users': [], 'has_next': False, 'next_cursor': None})
+
+    # 1. The relations, from the side of the modal that was opened
+    if direction == 'followers':
+        relations, other = Follow.objects.filter(following=profile_user), 'follower'
+    else:
+        relations, other = Follow.objects.filter(follower=profile_user), 'following'
+    query = request.GET.get('q', '').strip()
+    if query:
+        relations = relations.filter(**{f'{other}__username__istartswith': query})
+    page = paginate(relations.select_related(other), request.GET.get('cursor'), page_size=FOLLOW_LIST_PAGE_SIZE)
+
+    # 2. "Am I following them" for the whole page in one cached lookup
+    users = [getattr(rel, other) for rel in page]
+    my_following = follow_graph.intersect(request.user.pk, [user.pk for user in users])
+
+    results = []
+    for user in users:
+        results.append({
+            'username': user.username,
+            'full_name': f"{user.first_name} {user.last_name}".strip(),
+            'avatar_url': user.avatars.thumb.url,
+            'profile_url': reverse('accounts:profile', args=[user.username]),
+            'is_following': user.pk in my_following,
+            'is_me': user.pk == request.user.pk,
+        })
+    return JsonResponse({'users': results, 'has_next': page.has_next, 'next_cursor': page.next_cursor})
+
 @login_required
 def current_profile_redirect(request):
     # If a user goes to /accounts/profile/, redirect them to /accounts/profile/their_username/
@@ -146,10 +181,8 @@ def edit_profile_view(request):
                 try:
                     # Fetch fresh instance to get the current file path
                     current_db_user = User.objects.get(pk=request.user.pk)
-                    if current_db_user.profile_image:
-                        old_path = current_db_user.profile_image.path
-                        if os.path.exists(old_path):
-                            os.remove(old_path)
+                    # Drops these references; files shared with other uploads stay
+                    images.delete(current_db_user.profile_image, current_db_user.profile_image_variants)
                 except Exception as e:
                     print(f"Error deleting file: {e}")
 
@@ -160,8 +193,13 @@ def edit_profile_view(request):
             # If user clicked remove, and didn't immediately upload a replacement
             if delete_old_image and not new_image_uploaded:
                 user.profile_image = None 
-                
-            user.save()
+            if delete_old_image or new_image_uploaded:
+                user.profile_image_variants = {}
+
+            with transaction.atomic():
+                user.save()
+                if new_image_uploaded:
+                    media_queue.enqueue('avatar', user.pk)  # Variants are made by the media worker
             return redirect('accounts:profile', username=request.user.username)
     else:
         form = EditProfileForm(instance=request.user)
@@ -174,25 +212,28 @@ def follow_user_view(request, username):
     status = ''
     
     if request.user != user_to_toggle:
-        follow_record = Follow.objects.filter(follower=request.user, following=user_to_toggle).first()
-        if follow_record:
-            follow_record.delete()
+        if Follow.remove(request.user, user_to_toggle):
+            follow_graph.on_unfollow(request.user, user_to_toggle)
+            timeline.on_unfollow(request.user, user_to_toggle)
+            suggestions.on_unfollow(request.user, user_to_toggle)
             status = 'unfollowed'
         else:
-            Follow.objects.create(follower=request.user, following=user_to_toggle)
+            Follow.add(request.user, user_to_toggle)
+            follow_graph.on_follow(request.user, user_to_toggle)
+            timeline.on_follow(request.user, user_to_toggle)
+            suggestions.on_follow(request.user, user_to_toggle)
             status = 'followed'
 
     # --- AJAX RESPONSE ---
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        new_count = Follow.objects.filter(following=user_to_toggle).count()
-
-        new_following_count = Follow.objects.filter(follower=request.user).count()
+        # Kept exact by Follow.add/remove in the same transaction
+        user_to_toggle.refresh_from_db(fields=['followers_count'])
+        request.user.refresh_from_db(fields=['following_count'])
+        new_count, new_following_count = user_to_toggle.followers_count, request.user.following_count
         
         # Prepare data for Dynamic List Injection
-        avatar_url = "https://ui-avatars.com/api/?name=" + user_to_toggle.username
-        if user_to_toggle.profile_image:
-            avatar_url = user_to_toggle.profile_image.url
-            
+        avatar_url = user_to_toggle.avatars.thumb.url
+
         full_name = f"{user_to_toggle.first_name} {user_to_toggle.last_name}".strip()
         
         return JsonResponse({
@@ -222,10 +263,10 @@ def remove_follower_view(request, username):
     # Check if a follow record exists where:
     # Follower = user_to_remove
     # Following = request.user (Me)
-    follow_record = Follow.objects.filter(follower=user_to_remove, following=request.user).first()
-    
-    if follow_record:
-        follow_record.delete()
+    if Follow.remove(user_to_remove, request.user):
+        follow_graph.on_unfollow(user_to_remove, request.user)
+        timeline.on_unfollow(user_to_remove, request.user)
+        suggestions.on_unfollow(user_to_remove, request.user)
 
     next_url = request.GET.get('next')
     if next_url:
@@ -239,18 +280,14 @@ def search_users_ajax(request):
     if len(query) < 1:
         return JsonResponse({'users': []})
 
-    # Search users, exclude admins/staff and yourself
-    users = User.objects.filter(
-        Q(username__icontains=query) | 
-        Q(first_name__icontains=query) | 
-        Q(last_name__icontains=query)
-    ).exclude(is_staff=True).exclude(is_superuser=True).exclude(id=request.user.id)[:5]
+    # Ranked search (admins/staff are excluded by default), minus yourself
+    users = search_users(query).exclude(id=request.user.id)[:5]
 
     results = []
     for user in users:
         results.append({
             'username': user.username,
-            'avatar': user.profile_image.url if user.profile_image else f"https://ui-avatars.com/api/?name={user.username}",
+            'avatar': user.avatars.thumb.url,
             'profile_url': f"/accounts/profile/{user.username}/"
         })
     
@@ -296,6 +333,7 @@ def settings_view(request):
             if user.is_private != is_private:
                 user.is_private = is_private
                 user.save()
+                audience.sync_author(user)  # Re-derive Post.is_public for their posts
                 status_msg = "Private" if is_private else "Public"
                 messages.success(request, f'Your account is now {status_msg}.')
             
@@ -303,32 +341,35 @@ def settings_view(request):
 
     # --- FETCH DATA FOR TABS ---
     
+    # Each tab is one keyset page with its own cursor (?<tab>_cursor=...)
+    GET = request.GET
+
     # 1. My Active Posts
-    my_posts = Post.objects.filter(user=user, is_active=True, is_archived=False)\
-                           .order_by('-created_at')
+    my_posts = paginate(Post.objects.live().filter(user=user, is_archived=False),
+                        GET.get('posts_cursor'))
 
     # 2. Recycle Bin (Only user-deleted posts, not admin-deleted)
-    archived_posts = Post.objects.filter(user=user, is_archived=True, deleted_by__isnull=True)\
-                                 .order_by('-created_at')
+    archived_posts = paginate(Post.objects.filter(user=user, is_archived=True, deleted_by__isnull=True),
+                              GET.get('archived_cursor'))
     
     # 3. Admin-Deleted Posts (show but no restore option)
-    admin_deleted_posts = Post.objects.filter(user=user, is_archived=True, deleted_by__isnull=False)\
-                                      .order_by('-created_at')
+    admin_deleted_posts = paginate(Post.objects.filter(user=user, is_archived=True, deleted_by__isnull=False),
+                                   GET.get('admin_deleted_cursor'))
 
     # 3. Liked Posts
-    my_likes = Like.objects.filter(user=user, post__is_active=True)\
-                           .select_related('post', 'post__user')\
-                           .order_by('-created_at')
+    my_likes = paginate(Like.objects.filter(user=user, post__is_active=True)
+                                    .select_related('post', 'post__user'),
+                        GET.get('likes_cursor'))
 
     # 4. My Comments
-    my_comments = Comment.objects.filter(user=user, post__is_active=True)\
-                                 .select_related('post', 'post__user')\
-                                 .order_by('-created_at')
+    my_comments = paginate(Comment.objects.filter(user=user, post__is_active=True)
+                                          .select_related('post', 'post__user'),
+                           GET.get('comments_cursor'))
 
     # 5. Saved Posts
-    my_saved_posts = SavedPost.objects.filter(user=user)\
-                              .select_related('post', 'post__user')\
-                              .order_by('-created_at')
+    my_saved_posts = paginate(SavedPost.objects.filter(user=user)
+                                               .select_related('post', 'post__user'),
+                              GET.get('saved_cursor'))
     
     context = {
         'password_form': password_form,
@@ -1,85 +1,274 @@
-import json
+import asyncio
+import uuid
 from typing import Optional, Dict, Any, cast
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
+from django.db import transaction
 from .models import Thread, Message
+from .writer import get_writer
+from .typing_throttle import TypingThrottle, flush_stats as flush_typing_stats
+from . import unread, presence, wire
 from accounts.models import User
 
+SEEN_FLUSH_INTERVAL = settings.CHAT_SEEN_FLUSH_INTERVAL
+MAX_ROOMS = 20  # Subscriptions per connection
+
+
+def as_int(value) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@database_sync_to_async
+def user_exists(user_id: int) -> bool:
+    return User.objects.filter(pk=user_id).exists()
+
+
+@database_sync_to_async
+def get_thread_id(user_a_id: int, user_b_id: int, create: bool = False) -> Optional[int]:
+    u1, u2 = sorted([int(user_a_id), int(user_b_id)])
+    # Thread is ONLY created when a message is actually sent
+    if create:
+        thread, _ = Thread.objects.get_or_create(first_user_id=u1, second_user_id=u2)
+        return thread.pk
+    return Thread.objects.filter(first_user_id=u1, second_user_id=u2).values_list('pk', flat=True).first()
+
+
+class Room:
+    """ One conversation a connection is subscribed to, with its typing and read-receipt state """
+
+    def __init__(self, consumer: 'ChatConsumer', other_user_id: int, thread_id: Optional[int]):
+        self.consumer = consumer
+        self.me = consumer.me
+        self.other_user_id = other_user_id
+        self.thread_id = thread_id
+        self.name = Thread.room_name(self.me.pk, other_user_id)
+        self.typing = TypingThrottle(self.send_typing)
+        # Read receipts: highest message id the client has seen / already written
+        self.seen_mark = 0
+        self.seen_written = 0
+        self.seen_task: Optional[asyncio.Task] = None
+
+    async def group_send(self, event: Dict[str, Any]) -> None:
+        await self.consumer.channel_layer.group_send(self.name, {**event, "room": self.name})
+
+    async def send_message(self, data: Dict[str, Any]) -> None:
+        msg_text = data.get('message', '')
+        client_id = self.parse_client_id(data.get('client_id'))
+        # The first message creates the thread (once per subscription)
+        if self.thread_id is None:
+            self.thread_id = await get_thread_id(self.me.pk, self.other_user_id, create=True)
+
+        # Send to room right away; the row is written behind (chats/writer.py)
+        await self.group_send({
+            "type": "chat_message",
+            "message": msg_text,
+            "sender_id": self.me.pk,
+            "client_id": str(client_id),
+        })
+
+        # Notify Recipient's Inbox (For rapid count update)
+        await self.consumer.channel_layer.group_send(f"user_{self.other_user_id}", {
+            "type": "inbox_update",
+            "message": msg_text,
+            "sender_id": self.me.pk,
+        })
+
+        # The receiving page hides the typing indicator when the message arrives
+        self.typing.reset()
+
+        # Queue for the batched INSERT; waits here if the writer is backed up
+        await get_writer().put({
+            'thread_id': self.thread_id,
+            'sender_id': self.me.pk,
+            'recipient_id': self.other_user_id,
+            'client_id': client_id,
+            'text': msg_text,
+        })
+
+    @staticmethod
+    def parse_client_id(value) -> uuid.UUID:
+        """ The client's message id, or a fresh one if it sent none (or garbage) """
+        try:
+            return uuid.UUID(str(value))
+        except ValueError:
+            return uuid.uuid4()
+
+    async def send_typing(self, is_typing: bool) -> None:
+        await self.group_send({
+            "type": "typing_indicator",
+            "is_typing": is_typing,
+            "user_id": self.me.pk
+        })
+
+    async def send_status(self, status: str) -> None:
+        await self.group_send({
+            "type": "user_status",
+            "user_id": self.me.pk,
+            "status": status,
+        })
+
+    def queue_seen(self, up_to) -> None:
+        """ Raise the high-water mark; acks arriving within SEEN_FLUSH_INTERVAL share one UPDATE """
+        up_to = as_int(up_to)
+        if up_to is None or up_to <= self.seen_mark:
+            return
+        self.seen_mark = up_to
+        if self.seen_task is None:
+            self.seen_task = asyncio.ensure_future(self.flush_seen_later())
+
+    async def flush_seen_later(self) -> None:
+        await asyncio.sleep(SEEN_FLUSH_INTERVAL)
+        self.seen_task = None
+        await self.flush_seen()
+
+    async def flush_seen(self) -> None:
+        up_to = self.seen_mark
+        if up_to <= self.seen_written:
+            return
+        self.seen_written = up_to
+        # The other side may have started the thread after this room was subscribed
+        if self.thread_id is None:
+            self.thread_id = await get_thread_id(self.me.pk, self.other_user_id)
+            if self.thread_id is None:
+                return
+        await self.mark_read_up_to(up_to)
+        # Lets the sender show "Seen" on everything up to this id
+        await self.group_send({
+            "type": "seen_up_to",
+            "user_id": self.me.pk,
+            "up_to": up_to,
+        })
+
+    @database_sync_to_async
+    def mark_read_up_to(self, up_to: int) -> None:
+        """ One range UPDATE for every unread message from the other side up to the mark """
+        with transaction.atomic():
+            marked = Message.objects.filter(thread_id=self.thread_id, sender_id=self.other_user_id,
+                                            is_read=False, pk__lte=up_to).update(is_read=True)
+            transaction.on_commit(lambda: unread.on_messages_seen(self.me.pk, self.thread_id, marked))
+
+    async def close(self) -> None:
+        """ Leaving the room: switch typing off and write a pending read receipt now """
+        await self.typing.close()
+        if self.seen_task is not None:
+            self.seen_task.cancel()
+            self.seen_task = None
+            await self.flush_seen()
+
+
 class ChatConsumer(AsyncWebsocketConsumer):
+    """
+    One multiplexed socket per page (ws/). The connection joins the user's
+    personal group once (inbox updates, notifications) and subscribes to chat
+    rooms on demand. Client frames are {"action": ...}; room actions carry
+    "to" (the other user's id). Server frames are {"type": ...}; room frames
+    carry "room". Frames are JSON unless a binary subprotocol was negotiated
+    (chats/wire.py).
+    """
     me: User
-    other_user_id: int
-    room_name: str
     personal_group: str
+    rooms: Dict[int, Room]  # Other user's id -> subscription
+    codec: Any = wire.JSON  # Frame format agreed at connect (chats/wire.py)
+    connected: bool = False  # Counted in presence
 
     async def connect(self) -> None:
         user = self.scope.get('user')
         if user is None or isinstance(user, AnonymousUser) or not user.is_authenticated:
             await self.close()
             return
-        
+
         self.me = cast(User, user)
+        self.rooms = {}
         self.personal_group = f"user_{self.me.pk}"
         await self.channel_layer.group_add(self.personal_group, self.channel_name)
 
-        url_kwargs = self.scope.get('url_route', {}).get('kwargs', {})
-        target_id = url_kwargs.get('user_id')
-
-        if target_id and int(target_id) != 0:
-            self.other_user_id = int(target_id)
-            ids = sorted([int(self.me.pk), self.other_user_id])
-            self.room_name = f"chat_{ids[0]}_{ids[1]}"
-            await self.channel_layer.group_add(self.room_name, self.channel_name)
-
-        await self.accept()
+        self.codec = wire.negotiate(self.scope.get('subprotocols') or [])
+        await self.accept(subprotocol=self.codec.subprotocol)
+        await database_sync_to_async(presence.connected)(self.me.pk)
+        self.connected = True
 
     async def receive(self, text_data: Optional[str] = None, bytes_data: Optional[bytes] = None) -> None:
-        if not text_data: return
-        data = json.loads(text_data)
+        frame = bytes_data if self.codec.binary else text_data
+        if not frame: return
+        data = self.codec.decode(frame)
+        if not isinstance(data, dict): return
         action = data.get('action')
 
-        if action == 'message':
-            msg_text = data.get('message', '')
-            # Save message (and create thread if it's the first message)
-            await self.save_message(self.other_user_id, msg_text)
-            
-            # Send to room
-            await self.channel_layer.group_send(self.room_name, {
-                "type": "chat_message",
-                "message": msg_text,
-                "sender_id": self.me.pk,
-            })
-
-            # Notify Recipient's Inbox (For rapid count update)
-            recipient_group = f"user_{self.other_user_id}"
-            await self.channel_layer.group_send(recipient_group, {
-                "type": "inbox_update",
-                "message": msg_text,
-                "sender_id": self.me.pk,
-            })
-
-        elif action == 'typing':
-            if hasattr(self, 'room_name'):
-                await self.channel_layer.group_send(self.room_name, {
-                    "type": "typing_indicator",
-                    "is_typing": data.get('typing', False),
-                    "user_id": self.me.pk
-                })
-
-    async def chat_message(self, event): await self.send(text_data=json.dumps(event))
-    async def typing_indicator(self, event): await self.send(text_data=json.dumps(event))
-    async def inbox_update(self, event): await self.send(text_data=json.dumps(event))
+        if action == 'ping':
+            await database_sync_to_async(presence.heartbeat)(self.me.pk)
+        elif action == 'subscribe':
+            await self.subscribe(as_int(data.get('user_id')))
+        elif action == 'unsubscribe':
+            await self.unsubscribe(as_int(data.get('user_id')))
+        else:
+            # Everything else belongs to a subscribed room
+            room = self.rooms.get(as_int(data.get('to')))
+            if room is None:
+                return
+            if action == 'message':
+                await room.send_message(data)
+            elif action == 'seen':
+                room.queue_seen(data.get('up_to'))
+            elif action == 'typing':
+                # Debounced: only state changes reach the room (chats/typing_throttle.py)
+                await room.typing.feed(data.get('typing', False))
 
-    @database_sync_to_async
-    def save_message(self, other_user_id, text):
-        other_user = User.objects.get(pk=other_user_id)
-        u1, u2 = (self.me, other_user) if self.me.pk < other_user.pk else (other_user, self.me)
-        # Thread is ONLY created here when a message is actually sent
-        thread, _ = Thread.objects.get_or_create(first_user=u1, second_user=u2)
-        thread.save() 
-        return Message.objects.create(thread=thread, sender=self.me, text=text)
+    async def subscribe(self, other_user_id: Optional[int]) -> None:
+        if other_user_id is None or other_user_id == self.me.pk or other_user_id in self.rooms:
+            return
+        if len(self.rooms) >= MAX_ROOMS:
+            await self.send_frame({"type": "error", "error": "too_many_rooms"})
+            return
+        # Looked up once per subscription, not per message
+        if not await user_exists(other_user_id):
+            return
+
+        room = Room(self, other_user_id, await get_thread_id(self.me.pk, other_user_id))
+        self.rooms[other_user_id] = room
+        await self.channel_layer.group_add(room.name, self.channel_name)
+        await self.send_frame({"type": "subscribed", "user_id": other_user_id, "room": room.name})
+        await room.send_status('online')
+
+    async def unsubscribe(self, other_user_id: Optional[int]) -> None:
+        room = self.rooms.pop(other_user_id, None)
+        if room is None:
+            return
+        await room.close()
+        await self.channel_layer.group_discard(room.name, self.channel_name)
+
+    async def send_frame(self, frame: Dict[str, Any]) -> None:
+        payload = self.codec.encode(frame)
+        if self.codec.binary:
+            await self.send(bytes_data=payload)
+        else:
+            await self.send(text_data=payload)
+
+    async def chat_message(self, event): await self.send_frame(event)
+    async def typing_indicator(self, event): await self.send_frame(event)
+    async def inbox_update(self, event): await self.send_frame(event)
+    async def messages_saved(self, event): await self.send_frame(event)
+    async def seen_up_to(self, event): await self.send_frame(event)
+    async def user_status(self, event): await self.send_frame(event)
 
     async def disconnect(self, code):
+        if not self.connected:
+            return
+        rooms = list(self.rooms.values())
+        self.rooms = {}
+        for room in rooms:
+            await room.close()
+        await flush_typing_stats()
+
+        remaining = await database_sync_to_async(presence.disconnected)(self.me.pk)
+        for room in rooms:
+            if not remaining:
+                await room.send_status('offline')
+            await self.channel_layer.group_discard(room.name, self.channel_name)
+        if presence.flush_due():
+            await database_sync_to_async(presence.flush)()
         await self.channel_layer.group_discard(self.personal_group, self.channel_name)
-        if hasattr(self, 'room_name'):
-            await self.channel_layer.group_discard(self.room_name, self.channel_name)
\ No newline at end of file
@@ -1,19 +1,12 @@
-from .models import Message
-from django.db.models import Q
+from . import unread, presence
 
 def unread_messages_count(request):
     if request.user.is_authenticated:
-        # Count messages where:
-        # 1. Thread involves me
-        # 2. I am NOT the sender
-        # 3. is_read is False
-        count = Message.objects.filter(
-            thread__first_user=request.user, is_read=False
-        ).exclude(sender=request.user).count() + \
-        Message.objects.filter(
-            thread__second_user=request.user, is_read=False
-        ).exclude(sender=request.user).count()
-        
-        return {'global_unread_count': count}
+        # Messages in my threads, sent by the other side, not yet read
+        # (a cached counter, see chats/unread.py)
+        return {'global_unread_count': unread.user_total(request.user.pk)}
     return {'global_unread_count': 0}
 
+def presence_ping_interval(request):
+    # The page's heartbeat has to match the server's online timeout (chats/presence.py)
+    return {'presence_ping_ms': presence.PING_INTERVAL * 1000}
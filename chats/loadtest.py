@@ -0,0 +1,366 @@
+"""
+Load test for the chat socket: several Daphne workers sharing one channel
+layer, many simulated clients, delivery latency and throughput. Run it
+with `manage.py chat_loadtest`.
+
+- Every client logs in as its own throwaway user (lt_<run>_<n>; exactly
+  the users this run created are deleted afterwards). It connects to a worker round robin, the way a load
+  balancer spreads sockets, and subscribes to its partner's room. Clients
+  are paired, so most messages cross workers through the channel layer.
+- Each client sends `messages` chat messages at `rate` per second. The
+  partner's receive time is measured for chat_message (room group) and
+  inbox_update (user_<id> group). For messages_saved, the sender's receive
+  time is measured, which covers the write-behind INSERT. Every client runs
+  in this process, so all timestamps share one clock.
+- The fan-out phase opens 1..K sockets for one user and calls group_send on
+  user_<id>. It times the call itself (what the sending worker pays) and
+  the wait until the last socket has the frame.
+
+Without a Redis URL the workers use the pub/sub channel layer against
+chats/redis_standin.py, which is started here. Pass a URL to measure the
+core layer that production uses.
+"""
+import asyncio
+import base64
+import os
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY, BACKEND_SESSION_KEY
+from django.contrib.auth.hashers import make_password
+from django.contrib.sessions.backends.base import VALID_KEY_CHARS
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.utils import timezone
+from django.utils.crypto import get_random_string
+from django.utils.module_loading import import_string
+
+from accounts.models import User
+
+USERNAME_PREFIX = 'lt_'
+CONNECT_CONCURRENCY = 200  # Handshakes in flight at once
+STARTUP_TIMEOUT = 30  # Seconds for a worker to start listening
+
+
+def percentile(values, p):
+    """ Nearest-rank percentile of `values` (0 < p <= 100) """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, -(-len(ordered) * p // 100) - 1)]
+
+
+# --- Users and sessions ---
+
+def create_users(count):
+    """ `count` throwaway users with a logged-in session each; returns [(user, session_key)] """
+    # A fresh tag per run, so these can't collide with (or be mistaken for) anyone else's account
+    prefix = f'{USERNAME_PREFIX}{uuid.uuid4().hex[:8]}_'
+    users = User.objects.bulk_create([
+        User(username=f'{prefix}{n}', email=f'{prefix}{n}@example.com', password=make_password(None))
+        for n in range(count)
+    ])
+    backend = settings.AUTHENTICATION_BACKENDS[0]
+    expire = timezone.now() + timedelta(hours=1)
+    store = SessionStore()
+    sessions = []
+    for user in users:
+        key = get_random_string(32, VALID_KEY_CHARS)
+        data = store.encode({SESSION_KEY: str(user.pk), BACKEND_SESSION_KEY: backend,
+                                      HASH_SESSION_KEY: user.get_session_auth_hash()})
+        sessions.append(Session(session_key=key, session_data=data, expire_date=expire))
+    Session.objects.bulk_create(sessions)
+    return [(user, session.session_key) for user, session in zip(users, sessions)]
+
+
+def delete_users(users):
+    """ Remove what create_users() made: its users (threads and messages cascade) and their sessions """
+    Session.objects.filter(session_key__in=[key for _, key in users]).delete()
+    User.objects.filter(pk__in=[user.pk for user, _ in users]).delete()
+
+
+# --- Processes ---
+
+def _wait_for_port(port, process):
+    deadline = time.time() + STARTUP_TIMEOUT
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Process on port {port} exited with {process.returncode}")
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Nothing listening on port {port} after {STARTUP_TIMEOUT}s")
+
+
+def start_processes(workers, base_port, redis_url, standin_port):
+    """
+    Start the Redis stand-in (unless `redis_url` is given) and `workers`
+    Daphne processes on base_port, base_port + 1, ... Returns (worker
+    processes, stand-in process or None, worker ports, channel layer config).
+    """
+    standin = None
+    if redis_url:
+        layer = {"BACKEND": "channels_redis.core.RedisChannelLayer", "CONFIG": {"hosts": [redis_url]}}
+    else:
+        redis_url = f'redis://127.0.0.1:{standin_port}'
+        layer = {"BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer", "CONFIG": {"hosts": [redis_url]}}
+        standin = subprocess.Popen([sys.executable, '-m', 'chats.redis_standin', '--port', str(standin_port)],
+                                   cwd=settings.BASE_DIR)
+        _wait_for_port(standin_port, standin)
+
+    env = {**os.environ, 'CHANNEL_REDIS_URL': redis_url,
+           'CHANNEL_LAYER': 'pubsub' if layer["BACKEND"].endswith('RedisPubSubChannelLayer') else 'core'}
+    ports = [base_port + n for n in range(workers)]
+    processes = [
+        subprocess.Popen(
+            [sys.executable, '-m', 'daphne', '-v', '0', '-b', '127.0.0.1', '-p', str(port), 'qwik.asgi:application'],
+            cwd=settings.BASE_DIR, env=env,
+        )
+        for port in ports
+    ]
+    try:
+        for port, process in zip(ports, processes):
+            _wait_for_port(port, process)
+    except RuntimeError:
+        stop_processes(processes, standin)
+        raise
+    return processes, standin, ports, layer
+
+
+def stop_processes(processes, standin=None):
+    """ Stop the workers, then the stand-in, so no worker logs losing the channel layer on the way down """
+    for group in (processes, [standin] if standin else []):
+        for process in group:
+            process.terminate()
+        for process in group:
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+
+# --- Clients ---
+
+class Client:
+    """ A bare-bones WebSocket client for /ws/ (text or binary frames via chats/wire.py) """
+
+    def __init__(self, user, session_key, port, codec, on_frame):
+        self.user = user
+        self.session_key = session_key
+        self.port = port
+        self.codec = codec
+        self.on_frame = on_frame
+        self.reader = self.writer = self.task = None
+        self.partner = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+        key = base64.b64encode(os.urandom(16)).decode()
+        headers = [
+            "GET /ws/ HTTP/1.1",
+            f"Host: 127.0.0.1:{self.port}",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Key: {key}",
+            "Sec-WebSocket-Version: 13",
+            f"Cookie: {settings.SESSION_COOKIE_NAME}={self.session_key}",
+        ]
+        if self.codec.subprotocol:
+            headers.append(f"Sec-WebSocket-Protocol: {self.codec.subprotocol}")
+        self.writer.write(("\r\n".join(headers) + "\r\n\r\n").encode())
+        status = await self.reader.readline()
+        if b' 101 ' not in status:
+            raise ConnectionError(f"Handshake refused: {status!r}")
+        while await self.reader.readline() not in (b'\r\n', b''):
+            pass
+        self.task = asyncio.ensure_future(self.read_frames())
+
+    def send(self, frame):
+        payload = self.codec.encode(frame)
+        self.write_frame(0x2 if self.codec.binary else 0x1, payload if self.codec.binary else payload.encode())
+
+    def write_frame(self, opcode, payload):
+        size = len(payload)
+        if size < 126:
+            header = bytes([0x80 | opcode, 0x80 | size])
+        elif size < 1 << 16:
+            header = bytes([0x80 | opcode, 0x80 | 126]) + size.to_bytes(2, 'big')
+        else:
+            header = bytes([0x80 | opcode, 0x80 | 127]) + size.to_bytes(8, 'big')
+        # Client frames must be masked
+        mask = os.urandom(4)
+        masked = (int.from_bytes(payload, 'big') ^ int.from_bytes((mask * (size // 4 + 1))[:size], 'big'))
+        self.writer.write(header + mask + masked.to_bytes(size, 'big'))
+
+    async def read_frames(self):
+        try:
+            while True:
+                first, second = await self.reader.readexactly(2)
+                opcode, size = first & 0x0f, second & 0x7f
+                if size == 126:
+                    size = int.from_bytes(await self.reader.readexactly(2), 'big')
+                elif size == 127:
+                    size = int.from_bytes(await self.reader.readexactly(8), 'big')
+                payload = await self.reader.readexactly(size)
+                if opcode == 0x8:  # Close
+                    return
+                if opcode == 0x9:  # Daphne pings idle sockets
+                    self.write_frame(0xA, payload)
+                elif opcode in (0x1, 0x2):
+                    self.on_frame(self, self.codec.decode(payload if self.codec.binary else payload.decode()))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+
+    async def close(self):
+        if self.writer is None:
+            return
+        try:
+            self.write_frame(0x8, (1000).to_bytes(2, 'big'))
+            await self.writer.drain()
+        except ConnectionError:
+            pass
+        self.writer.close()
+        if self.task is not None:
+            self.task.cancel()
+
+
+async def connect_all(clients):
+    """ Connect every client, CONNECT_CONCURRENCY at a time; returns the ones that made it """
+    gate = asyncio.Semaphore(CONNECT_CONCURRENCY)
+
+    async def connect(client):
+        async with gate:
+            try:
+                await client.connect()
+                return True
+            except OSError:
+                await client.close()
+                return False
+    results = await asyncio.gather(*(connect(client) for client in clients))
+    return [client for client, ok in zip(clients, results) if ok]
+
+
+# --- Scenarios ---
+
+async def chat_phase(pairs, ports, codec, messages, rate, timeout):
+    """ Paired clients chatting; returns the latency samples and counts """
+    stats = {'room': [], 'inbox': [], 'saved': [], 'sent': 0}
+    sent_at = {}  # client_id -> send time, for messages_saved
+    subscribed = asyncio.Event()
+    pending_subscriptions = [len(pairs)]
+    expected = len(pairs) * messages  # Recounted once the sockets are up
+    delivered = asyncio.Event()
+
+    def on_frame(client, frame):
+        now = time.perf_counter()
+        kind = frame.get('type')
+        if kind == 'subscribed':
+            pending_subscriptions[0] -= 1
+            if not pending_subscriptions[0]:
+                subscribed.set()
+        elif kind in ('chat_message', 'inbox_update') and frame.get('sender_id') == client.partner.pk:
+            stats['room' if kind == 'chat_message' else 'inbox'].append(now - float(frame['message'].split()[1]))
+            stats['last_delivery'] = now
+            if len(stats['room']) >= expected and len(stats['inbox']) >= expected:
+                delivered.set()
+        elif kind == 'messages_saved':
+            for client_id in frame['ids']:
+                started = sent_at.pop(client_id, None)
+                if started is not None:
+                    stats['saved'].append(now - started)
+
+    clients = [Client(user, key, ports[n % len(ports)], codec, on_frame) for n, (user, key) in enumerate(pairs)]
+    for n, client in enumerate(clients):
+        client.partner = clients[n ^ 1].user
+    connected = await connect_all(clients)
+    failed = len(clients) - len(connected)
+    clients = connected
+    pending_subscriptions[0] = len(clients)
+    for client in clients:
+        client.send({'action': 'subscribe', 'user_id': client.partner.pk})
+    try:
+        await asyncio.wait_for(subscribed.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    # Messages to a partner whose socket failed have nobody to reach
+    online = {c.user.pk for c in clients}
+    expected = sum(messages for c in clients if c.partner.pk in online)
+
+    async def chat(client, offset):
+        await asyncio.sleep(offset)
+        for _ in range(messages):
+            client_id = str(uuid.uuid4())
+            now = time.perf_counter()
+            sent_at[client_id] = now
+            client.send({'action': 'message', 'to': client.partner.pk, 'message': f'lt {now}', 'client_id': client_id})
+            stats['sent'] += 1
+            await asyncio.sleep(1 / rate)
+
+    started = time.perf_counter()
+    # Spread the first sends over one interval so the clients don't fire in lockstep
+    await asyncio.gather(*(chat(c, n / len(clients) / rate) for n, c in enumerate(clients)))
+    try:
+        await asyncio.wait_for(delivered.wait(), timeout)
+    except asyncio.TimeoutError:
+        pass
+    # Give the write-behind a moment to report the last batch
+    deadline = time.perf_counter() + timeout
+    while sent_at and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    # Throughput counts until the last delivery, not the wait for write-behind acks
+    stats['elapsed'] = stats.get('last_delivery', started) - started
+    stats['clients'] = len(clients)
+    stats['failed'] = failed
+    stats['expected'] = expected
+    await asyncio.gather(*(c.close() for c in clients))
+    return stats
+
+
+async def fanout_phase(users, sizes, ports, codec, layer_config, rounds, timeout):
+    """
+    For each size, open that many sockets for one of `users` ([(user,
+    session_key)]) and time group_send to its user_<id> group. Returns
+    {size: (send_times, last_delivery_times)}.
+    """
+    layer = import_string(layer_config["BACKEND"])(**layer_config["CONFIG"])
+    results = {}
+    for (user, session_key), size in zip(users, sizes):
+        arrived = {}
+        done = asyncio.Event()
+
+        def on_frame(client, frame):
+            if frame.get('type') == 'inbox_update' and frame.get('message') in arrived:
+                times = arrived[frame['message']]
+                times.append(time.perf_counter())
+                if len(times) == len(clients):
+                    done.set()
+
+        clients = await connect_all([Client(user, session_key, ports[n % len(ports)], codec, on_frame)
+                                     for n in range(size)])
+        await asyncio.sleep(0.5)  # Let the workers finish group_add
+        send_times, delivery_times = [], []
+        for n in range(rounds):
+            marker = f'fanout {n}'
+            arrived[marker] = []
+            done.clear()
+            started = time.perf_counter()
+            await layer.group_send(f'user_{user.pk}', {'type': 'inbox_update', 'message': marker, 'sender_id': 0})
+            send_times.append(time.perf_counter() - started)
+            try:
+                await asyncio.wait_for(done.wait(), timeout)
+                delivery_times.append(arrived[marker][-1] - started)
+            except asyncio.TimeoutError:
+                pass
+        results[size] = (send_times, delivery_times)
+        await asyncio.gather(*(c.close() for c in clients))
+    # The core layer's flush() would delete everything under its prefix; only close its connections
+    close = getattr(layer, 'close_pools', None) or layer.flush
+    await close()
+    return results
@@ -0,0 +1,83 @@
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chats import loadtest, wire
+
+
+class Command(BaseCommand):
+    help = ("Run N Daphne workers against a shared channel layer, open many chat sockets and report "
+            "delivery latency, throughput and user_<id> group_send fan-out cost (chats/loadtest.py)")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=2, help="Daphne processes")
+        parser.add_argument('--clients', type=int, default=1000, help="Simulated sockets (rounded up to pairs)")
+        parser.add_argument('--messages', type=int, default=10, help="Messages each client sends")
+        parser.add_argument('--rate', type=float, default=1.0, help="Messages per second per client")
+        parser.add_argument('--fanout', default='1,2,5,10,25', help="Sockets per user for the fan-out phase")
+        parser.add_argument('--fanout-rounds', type=int, default=50, help="group_sends timed per fan-out size")
+        parser.add_argument('--format', choices=['json', *wire.CODECS], default='json', help="Client wire format")
+        parser.add_argument('--redis', help="Redis URL for the core channel layer (default: start the stand-in)")
+        parser.add_argument('--port', type=int, default=8100, help="First worker port")
+        parser.add_argument('--standin-port', type=int, default=6390)
+        parser.add_argument('--timeout', type=float, default=15.0, help="Seconds to wait for stragglers")
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['fanout'].split(',') if size]
+        except ValueError:
+            raise CommandError("--fanout takes comma-separated socket counts, e.g. 1,5,25")
+        clients = options['clients'] + options['clients'] % 2
+        codec = wire.CODECS.get(options['format'], wire.JSON)
+
+        users = loadtest.create_users(clients + len(sizes))
+        chatters, fanout_users = users[:clients], users[clients:]
+        processes, standin = [], None
+        try:
+            processes, standin, ports, layer = loadtest.start_processes(
+                options['workers'], options['port'], options['redis'], options['standin_port'])
+            self.stdout.write(f"{len(ports)} worker(s), {layer['BACKEND'].rsplit('.', 1)[-1]}"
+                              f"{'' if options['redis'] else ' on the Redis stand-in'}, {options['format']} frames")
+
+            chat = asyncio.run(loadtest.chat_phase(chatters, ports, codec, options['messages'],
+                                                   options['rate'], options['timeout']))
+            fanout = asyncio.run(loadtest.fanout_phase(fanout_users, sizes, ports, codec, layer,
+                                                       options['fanout_rounds'], options['timeout']))
+        finally:
+            loadtest.stop_processes(processes, standin)
+            loadtest.delete_users(users)
+
+        self.report_chat(chat)
+        self.report_fanout(fanout)
+
+    @staticmethod
+    def ms(seconds):
+        return '-' if seconds is None else f"{seconds * 1000:.1f} ms"
+
+    def latency(self, label, samples):
+        p50, p99 = loadtest.percentile(samples, 50), loadtest.percentile(samples, 99)
+        self.stdout.write(f"  {label:<28}p50 {self.ms(p50):>10}   p99 {self.ms(p99):>10}   ({len(samples)} samples)")
+
+    def report_chat(self, chat):
+        self.stdout.write("")
+        self.stdout.write(f"Clients: {chat['clients']} connected, {chat['failed']} failed")
+        delivered = len(chat['room'])
+        self.stdout.write(f"Messages: {chat['sent']} sent, {delivered}/{chat['expected']} delivered "
+                          f"in {chat['elapsed']:.1f}s")
+        rate = delivered / chat['elapsed'] if chat['elapsed'] else 0
+        self.stdout.write(self.style.SUCCESS(f"Throughput: {rate:.0f} messages/s delivered"))
+        self.stdout.write("Latency:")
+        self.latency("chat_message (room)", chat['room'])
+        self.latency("inbox_update (user group)", chat['inbox'])
+        self.latency("messages_saved (persisted)", chat['saved'])
+
+    def report_fanout(self, fanout):
+        self.stdout.write("")
+        self.stdout.write("group_send to user_<id>:")
+        self.stdout.write(f"  {'sockets':>7}  {'send p50':>10}  {'send p99':>10}  {'last p50':>10}  {'last p99':>10}")
+        for size, (send, delivered) in fanout.items():
+            self.stdout.write(
+                f"  {size:>7}  {self.ms(loadtest.percentile(send, 50)):>10}  {self.ms(loadtest.percentile(send, 99)):>10}"
+                f"  {self.ms(loadtest.percentile(delivered, 50)):>10}  {self.ms(loadtest.percentile(delivered, 99)):>10}"
+                + ("" if len(delivered) == len(send) else f"  ({len(send) - len(delivered)} incomplete)")
+            )
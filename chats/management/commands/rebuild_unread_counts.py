@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from chats import unread
+
+
+class Command(BaseCommand):
+    help = "Rebuild cached unread-message counters from Message.is_read"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Only rebuild these users (default: everyone)")
+
+    def handle(self, *args, **options):
+        user_ids = None
+        if options['usernames']:
+            user_ids = list(User.objects.filter(username__in=options['usernames']).values_list('pk', flat=True))
+
+        count = unread.rebuild(user_ids)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt unread counters for {count} user(s)."))
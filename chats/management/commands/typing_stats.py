@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from chats import typing_throttle
+
+
+class Command(BaseCommand):
+    help = "Show how many typing frames were received vs. sent through the channel layer"
+
+    def handle(self, *args, **options):
+        counts = typing_throttle.stats()
+        received = counts['received']
+        share = f" ({100 * counts['saved'] / received:.1f}%)" if received else ""
+        self.stdout.write(f"Typing frames received: {received}")
+        self.stdout.write(f"Group sends published:  {counts['published']}")
+        self.stdout.write(self.style.SUCCESS(f"Channel-layer sends saved: {counts['saved']}{share}"))
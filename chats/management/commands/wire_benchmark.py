@@ -0,0 +1,55 @@
+import timeit
+import uuid
+
+from django.core.management.base import BaseCommand
+
+from chats import wire
+
+ROOM = 'chat_1042_20817'
+SAMPLES = {
+    'chat_message': {"type": "chat_message", "message": "Are we still on for tonight? I can bring the camera",
+                     "sender_id": 1042, "client_id": str(uuid.uuid4()), "room": ROOM},
+    'typing_indicator': {"type": "typing_indicator", "is_typing": True, "user_id": 1042, "room": ROOM},
+    'inbox_update': {"type": "inbox_update", "message": "Are we still on for tonight? I can bring the camera",
+                     "sender_id": 1042},
+    'messages_saved': {"type": "messages_saved", "ids": {str(uuid.uuid4()): 981234 + i for i in range(3)},
+                       "room": ROOM},
+    'seen_up_to': {"type": "seen_up_to", "user_id": 20817, "up_to": 981236, "room": ROOM},
+    'user_status': {"type": "user_status", "user_id": 1042, "status": "online", "room": ROOM},
+}
+
+
+class Command(BaseCommand):
+    help = "Compare frame size and encode/decode cost of the chat socket wire formats (chats/wire.py)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=20000, help="Encodes/decodes timed per frame and format")
+
+    def handle(self, *args, **options):
+        number = options['number']
+        codecs = [('json', wire.JSON)] + [(name, codec) for name, codec in wire.CODECS.items()]
+
+        self.stdout.write(f"{'frame':<18}{'format':<14}{'bytes':>7}{'vs json':>9}{'encode us':>11}{'decode us':>11}")
+        totals = {}
+        for frame_name, frame in SAMPLES.items():
+            json_size = len(wire.JSON.encode(frame).encode())
+            for name, codec in codecs:
+                payload = codec.encode(frame)
+                assert codec.decode(payload) == frame, f"{name} does not round-trip {frame_name}"
+                size = len(payload) if codec.binary else len(payload.encode())
+                encode = timeit.timeit(lambda: codec.encode(frame), number=number) / number * 1e6
+                decode = timeit.timeit(lambda: codec.decode(payload), number=number) / number * 1e6
+                total = totals.setdefault(name, [0, 0.0, 0.0])
+                total[0] += size
+                total[1] += encode
+                total[2] += decode
+                self.stdout.write(f"{frame_name:<18}{name:<14}{size:>7}{size / json_size:>8.0%}"
+                                  f"{encode:>11.2f}{decode:>11.2f}")
+
+        self.stdout.write("")
+        json_total = totals['json'][0]
+        for name, (size, encode, decode) in totals.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"{name:<14}{size:>6} bytes for all frames ({size / json_total:.0%} of JSON), "
+                f"{encode:.2f} us encode, {decode:.2f} us decode"
+            ))
@@ -0,0 +1,19 @@
+from . import presence
+
+
+class PresenceMiddleware:
+    """ Records a (throttled) activity heartbeat for signed-in users; see chats/presence.py """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            presence.touch(user.pk)
+        # Piggyback the periodic bulk last_seen write on a request
+        if presence.flush_due():
+            presence.flush()
+        return response
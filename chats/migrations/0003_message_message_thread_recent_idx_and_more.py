@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 00:31
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, and avoids
+    # locking the tables for writes while the indexes build
+    atomic = False
+
+    dependencies = [
+        ("chats", "0002_alter_message_options_remove_message_shared_post"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(
+                fields=["thread", "-timestamp"], name="message_thread_recent_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="message",
+            index=models.Index(
+                condition=models.Q(("is_read", False)),
+                fields=["thread", "sender"],
+                name="message_unread_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="thread",
+            index=models.Index(
+                fields=["second_user", "first_user"], name="thread_second_first_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.8 on 2026-10-18 00:41
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("chats", "0003_message_message_thread_recent_idx_and_more"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="thread",
+            name="last_message",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to="chats.message",
+            ),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="last_message_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="last_message_text",
+            field=models.TextField(blank=True, default=""),
+        ),
+        migrations.AddField(
+            model_name="thread",
+            name="last_sender",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="+",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+        # Seed the snapshot from each thread's latest message
+        migrations.RunSQL(
+            """
+            UPDATE chats_thread SET
+                last_message_id = latest.id,
+                last_message_text = COALESCE(latest.text, ''),
+                last_sender_id = latest.sender_id,
+                last_message_at = latest.timestamp
+            FROM (
+                SELECT DISTINCT ON (thread_id) id, thread_id, text, sender_id, timestamp
+                FROM chats_message
+                ORDER BY thread_id, timestamp DESC, id DESC
+            ) AS latest
+            WHERE latest.thread_id = chats_thread.id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.AddIndex(
+            model_name="thread",
+            index=models.Index(
+                fields=["first_user", "-last_message_at", "-id"],
+                name="thread_first_recent_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="thread",
+            index=models.Index(
+                fields=["second_user", "-last_message_at", "-id"],
+                name="thread_second_recent_idx",
+            ),
+        ),
+    ]
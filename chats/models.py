@@ -8,6 +8,13 @@ class Thread(models.Model):
     second_user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='thread_second')
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Snapshot of the latest message, written with every insert (see chats/writer.persist)
+    # so the inbox can be listed and sorted without reading Message
+    last_message = models.ForeignKey('Message', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_text = models.TextField(blank=True, default='')
+    last_sender = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    last_message_at = models.DateTimeField(null=True, blank=True)
+
     # TYPE HINTS: This tells the linter these attributes exist
     pk: int
     first_user_id: int
@@ -16,10 +23,23 @@ class Thread(models.Model):
 
     class Meta:
         unique_together = ('first_user', 'second_user')
+        indexes = [
+            # Mirror of the unique (first_user, second_user) index for the other side of the OR
+            models.Index(fields=['second_user', 'first_user'], name='thread_second_first_idx'),
+            # Inbox: my threads (either side of the OR) newest conversation first
+            models.Index(fields=['first_user', '-last_message_at', '-id'], name='thread_first_recent_idx'),
+            models.Index(fields=['second_user', '-last_message_at', '-id'], name='thread_second_recent_idx'),
+        ]
 
     def __str__(self):
         return f"Thread {self.pk}"
 
+    @staticmethod
+    def room_name(user_a_id, user_b_id):
+        """ Channel-layer group shared by both participants' chat sockets """
+        low, high = sorted([int(user_a_id), int(user_b_id)])
+        return f"chat_{low}_{high}"
+
 class Message(models.Model):
     # The related_name='messages' is what creates the attribute on the Thread model
     thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='messages')
@@ -27,6 +47,19 @@ class Message(models.Model):
     text = models.TextField(blank=True, null=True)
     is_read = models.BooleanField(default=False)
     timestamp = models.DateTimeField(auto_now_add=True)
+    # Generated by the sending client; makes write-behind inserts idempotent (chats/writer.py)
+    client_id = models.UUIDField(null=True, blank=True, editable=False)
 
     pk: int
-    sender_id: int
\ No newline at end of file
+    sender_id: int
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['thread', '-timestamp'], name='message_thread_recent_idx'),
+            # Unread counts: filter on thread + sender, is_read=False rows only
+            models.Index(fields=['thread', 'sender'], condition=models.Q(is_read=False), name='message_unread_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['sender', 'client_id'], condition=models.Q(client_id__isnull=False),
+                                    name='message_sender_client_id_uniq'),
+        ]
\ No newline at end of file
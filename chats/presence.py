@@ -0,0 +1,141 @@
+"""
+Presence: who is online right now and when everyone was last seen.
+
+Nothing here writes to the database on the hot path:
+- ChatConsumer.connect/disconnect keep a count of each user's open sockets
+  in the cache, and every page's socket sends a `ping` each PING_INTERVAL.
+- PresenceMiddleware notes HTTP activity, at most once per HEARTBEAT_EVERY
+  seconds per user and process.
+- Each heartbeat is stored in the cache for readers and in a per-process
+  buffer. The buffer is written to User.last_seen in one bulk UPDATE at
+  most once per FLUSH_INTERVAL.
+
+A user is online while they have an open socket that pinged within
+ONLINE_TIMEOUT; the timeout covers sockets lost with a crashed worker.
+"""
+import threading
+import time
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import F, Value, DateTimeField
+from django.db.models.functions import Greatest
+
+from accounts.models import User
+
+PING_INTERVAL = settings.PRESENCE_PING_INTERVAL
+ONLINE_TIMEOUT = settings.PRESENCE_ONLINE_TIMEOUT
+FLUSH_INTERVAL = settings.PRESENCE_FLUSH_INTERVAL
+HEARTBEAT_EVERY = 30  # Seconds between recorded HTTP heartbeats for the same user
+KEY_TIMEOUT = 60 * 60 * 24  # Cached heartbeats outlive many flushes
+
+_lock = threading.Lock()
+_pending = {}  # user_id -> newest heartbeat (epoch seconds) not yet in the DB
+_recent = {}  # user_id -> last recorded HTTP heartbeat, for throttling
+_last_flush = time.time()
+
+
+def _conns_key(user_id):
+    return f'presence:conns:{user_id}'
+
+
+def _seen_key(user_id):
+    return f'presence:seen:{user_id}'
+
+
+def _as_datetime(epoch):
+    return datetime.fromtimestamp(epoch, tz=dt_timezone.utc)
+
+
+# --- Write side ---
+
+def heartbeat(user_id):
+    """ The user did something just now """
+    now = time.time()
+    cache.set(_seen_key(user_id), now, KEY_TIMEOUT)
+    with _lock:
+        _pending[user_id] = now
+
+
+def touch(user_id):
+    """ Throttled heartbeat for HTTP requests """
+    now = time.time()
+    if now - _recent.get(user_id, 0) < HEARTBEAT_EVERY:
+        return
+    _recent[user_id] = now
+    heartbeat(user_id)
+
+
+def connected(user_id):
+    """ A socket opened; returns how many the user now has """
+    heartbeat(user_id)
+    key = _conns_key(user_id)
+    if cache.add(key, 1, KEY_TIMEOUT):
+        return 1
+    return cache.incr(key)
+
+
+def disconnected(user_id):
+    """ A socket closed; returns how many the user still has """
+    heartbeat(user_id)
+    key = _conns_key(user_id)
+    try:
+        count = cache.decr(key)
+    except ValueError:
+        return 0
+    if count < 0:
+        cache.set(key, 0, KEY_TIMEOUT)
+        count = 0
+    return count
+
+
+def flush_due():
+    return time.time() - _last_flush >= FLUSH_INTERVAL
+
+
+def flush():
+    """ Write buffered heartbeats to User.last_seen in one UPDATE; returns how many users were written """
+    global _last_flush
+    with _lock:
+        batch = dict(_pending)
+        _pending.clear()
+        _last_flush = time.time()
+        # Forget throttle entries that can no longer suppress anything
+        for user_id, at in list(_recent.items()):
+            if _last_flush - at >= HEARTBEAT_EVERY:
+                del _recent[user_id]
+    if not batch:
+        return 0
+
+    # Another process may have written a newer value; never move last_seen backwards
+    User.objects.bulk_update([
+        User(pk=user_id, last_seen=Greatest(F('last_seen'), Value(_as_datetime(at), output_field=DateTimeField())))
+        for user_id, at in batch.items()
+    ], ['last_seen'])
+    return len(batch)
+
+
+# --- Read side ---
+
+def status_for(users):
+    """
+    {user.pk: {'online': bool, 'last_seen': datetime or None}} for many
+    users in one cache round trip. Users not in the cache fall back to the
+    last_seen already loaded on the instance.
+    """
+    keys = []
+    for user in users:
+        keys += [_conns_key(user.pk), _seen_key(user.pk)]
+    cached = cache.get_many(keys)
+
+    now = time.time()
+    status = {}
+    for user in users:
+        seen = cached.get(_seen_key(user.pk))
+        online = bool(cached.get(_conns_key(user.pk))) and seen is not None and now - seen < ONLINE_TIMEOUT
+        status[user.pk] = {
+            'online': online,
+            'last_seen': _as_datetime(seen) if seen is not None else user.last_seen,
+        }
+    return status
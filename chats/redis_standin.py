@@ -0,0 +1,114 @@
+"""
+A stand-in for Redis that speaks just enough RESP for
+channels_redis.pubsub.RedisPubSubChannelLayer: PUBLISH, SUBSCRIBE,
+UNSUBSCRIBE and PING, plus no-op replies for the connection handshake
+(CLIENT, SELECT). Nothing is stored, so the core channel layer (sorted
+sets and Lua scripts) won't run against it.
+
+It lets the chat load test (chats/loadtest.py) run several workers that
+share a channel layer where no Redis server is installed. Run it on its own:
+
+    python -m chats.redis_standin --port 6390
+"""
+import argparse
+import asyncio
+
+
+def _bulk(value):
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+def _array(*items):
+    out = b'*%d\r\n' % len(items)
+    for item in items:
+        out += b':%d\r\n' % item if isinstance(item, int) else _bulk(item)
+    return out
+
+
+class RedisStandin:
+    def __init__(self):
+        self.channels = {}  # channel -> set of subscribed StreamWriters
+
+    async def serve(self, host='127.0.0.1', port=6390):
+        return await asyncio.start_server(self.handle, host, port)
+
+    async def handle(self, reader, writer):
+        subscribed = set()
+        try:
+            while True:
+                command = await self.read_command(reader)
+                if command is None:
+                    break
+                writer.write(self.execute(command, writer, subscribed))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for channel in subscribed:
+                self.unsubscribe(channel, writer)
+            writer.close()
+
+    @staticmethod
+    async def read_command(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        if not line.startswith(b'*'):
+            return line.split()  # Inline command (e.g. typed into telnet)
+        args = []
+        for _ in range(int(line[1:])):
+            size = int((await reader.readline())[1:])
+            args.append((await reader.readexactly(size + 2))[:-2])
+        return args
+
+    def execute(self, command, writer, subscribed):
+        if not command:
+            return b''
+        name, args = command[0].upper(), command[1:]
+        if name == b'PUBLISH':
+            channel, message = args
+            receivers = self.channels.get(channel, ())
+            frame = _array(b'message', channel, message)
+            for receiver in receivers:
+                receiver.write(frame)
+            return b':%d\r\n' % len(receivers)
+        if name == b'SUBSCRIBE':
+            out = b''
+            for channel in args:
+                self.channels.setdefault(channel, set()).add(writer)
+                subscribed.add(channel)
+                out += _array(b'subscribe', channel, len(subscribed))
+            return out
+        if name == b'UNSUBSCRIBE':
+            out = b''
+            for channel in args or list(subscribed):
+                self.unsubscribe(channel, writer)
+                subscribed.discard(channel)
+                out += _array(b'unsubscribe', channel, len(subscribed))
+            return out
+        if name == b'PING':
+            return _array(b'pong', args[0] if args else b'') if subscribed else b'+PONG\r\n'
+        if name in (b'CLIENT', b'SELECT', b'FLUSHALL'):
+            return b'+OK\r\n'
+        return b'-ERR unknown command \'%s\' (redis_standin only does pub/sub)\r\n' % name
+
+    def unsubscribe(self, channel, writer):
+        receivers = self.channels.get(channel)
+        if receivers is not None:
+            receivers.discard(writer)
+            if not receivers:
+                del self.channels[channel]
+
+
+async def main(host, port):
+    server = await RedisStandin().serve(host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6390)
+    options = parser.parse_args()
+    asyncio.run(main(options.host, options.port))
@@ -4,5 +4,6 @@ from . import consumers
 # We use # type: ignore because the linter expects a standard Django view,
 # but Channels uses an ASGI application.
 websocket_urlpatterns = [
-    path('ws/chat/<int:user_id>/', consumers.ChatConsumer.as_asgi()), # type: ignore
+    # One multiplexed socket per page; chat rooms are subscribed over it
+    path('ws/', consumers.ChatConsumer.as_asgi()), # type: ignore
 ]
\ No newline at end of file
@@ -1,3 +1,747 @@
-from django.test import TestCase
+import asyncio
+import io
+import time
+import uuid
+from datetime import timedelta
+from types import SimpleNamespace
 
-# Create your tests here.
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from accounts.models import User
+from .models import Thread, Message
+from . import consumers, presence, typing_throttle, wire, writer, unread
+from . import views as chat_views
+from .loadtest import percentile
+from .redis_standin import RedisStandin
+
+
+def queued(thread, sender, recipient, text, client_id=None):
+    """ A message as ChatConsumer queues it for the writer """
+    return {'thread_id': thread.pk, 'sender_id': sender.pk, 'recipient_id': recipient.pk,
+            'client_id': client_id or uuid.uuid4(), 'text': text}
+
+
+class InboxQueryTests(TestCase):
+    """ The inbox must not issue queries per conversation """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.me = User.objects.create_user('me', 'me@example.com', 'pw')
+
+    def setUp(self):
+        cache.clear()
+        presence.flush()  # Restart the flush timer so no bulk last_seen write lands in a measured request
+        self.client.force_login(self.me)
+        self.client.get(reverse('chats:inbox'))  # Warm the session and unread counter cache
+
+    def add_threads(self, count):
+        """ `count` new conversations with three messages each; two of them unread for me """
+        start = User.objects.count()
+        for i in range(start, start + count):
+            other = User.objects.create_user(f'other{i}', f'other{i}@example.com', 'pw')
+            first, second = sorted([self.me, other], key=lambda u: u.pk)
+            thread = Thread.objects.create(first_user=first, second_user=second)
+            for sender, recipient, text in [(other, self.me, 'hello'), (self.me, other, 'hi'),
+                                            (other, self.me, 'how are you?')]:
+                writer.persist([queued(thread, sender, recipient, text)])
+        # Threads created behind the consumer's back: recount their unread counters once
+        self.client.get(reverse('chats:inbox'))
+
+    def test_query_count_does_not_grow_with_threads(self):
+        # session, user, threads page, suggestions; nothing from Message
+        self.add_threads(2)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('chats:inbox'))
+        self.assertEqual(len(response.context['threads']), 2)
+
+        self.add_threads(10)
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('chats:inbox'))
+        self.assertEqual(len(response.context['threads']), 12)
+
+    def test_rows(self):
+        self.add_threads(3)
+        response = self.client.get(reverse('chats:inbox'))
+        newest = response.context['threads'][0]
+        self.assertEqual(newest['other_user'].username, 'other3')
+        self.assertEqual(newest['last_msg_text'], 'how are you?')
+        self.assertEqual(newest['unread_count'], 2)
+
+    def test_heartbeat_uses_ping_interval(self):
+        interval, presence.PING_INTERVAL = presence.PING_INTERVAL, 5
+        self.addCleanup(setattr, presence, 'PING_INTERVAL', interval)
+        self.assertContains(self.client.get(reverse('chats:inbox')), "qwikSocket.send({'action': 'ping'}), 5000);")
+
+    def test_cursor_pagination(self):
+        self.add_threads(25)
+        response = self.client.get(reverse('chats:inbox'))
+        self.assertEqual(len(response.context['threads']), 20)
+
+        more = self.client.get(reverse('chats:inbox'), {'cursor': response.context['next_cursor']},
+                               headers={'x-requested-with': 'XMLHttpRequest'}).json()
+        self.assertEqual(len(more['threads']), 5)
+        self.assertFalse(more['has_next'])
+
+
+class ChatHistoryTests(TestCase):
+    """ Older messages for the chat room, as keyset-paginated JSON """
+
+    def setUp(self):
+        self.addCleanup(setattr, chat_views, 'CHAT_PAGE_SIZE', chat_views.CHAT_PAGE_SIZE)
+        chat_views.CHAT_PAGE_SIZE = 5
+        self.me = User.objects.create_user('me', 'me@example.com', 'pw')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pw')
+        thread = Thread.objects.create(first_user=self.me, second_user=self.other)
+        for n in range(13):
+            Message.objects.create(thread=thread, sender=(self.me, self.other)[n % 2], text=f'm{n}')
+        # A timestamp tie across the first page boundary (m8 | m7) is broken by id
+        tie = Message.objects.get(text='m7').timestamp
+        Message.objects.filter(text__in=['m8', 'm9']).update(timestamp=tie)
+        self.url = reverse('chats:chat_room', args=['other'])
+        self.client.force_login(self.me)
+
+    def older(self, cursor):
+        return self.client.get(self.url, {'cursor': cursor}, headers={'x-requested-with': 'XMLHttpRequest'})
+
+    def test_pages(self):
+        response = self.client.get(self.url)
+        seen = [m.pk for m in response.context['thread_messages']]
+        self.assertEqual(len(seen), 5)
+        cursor = response.context['next_cursor']
+
+        pages = []
+        while cursor:
+            data = self.older(cursor).json()
+            self.assertEqual(set(data), {'messages', 'has_next', 'next_cursor'})
+            self.assertEqual(set(data['messages'][0]), {'id', 'text', 'sender_id', 'client_id'})
+            self.assertLessEqual(len(data['messages']), 5)
+            self.assertEqual(data['has_next'], data['next_cursor'] is not None)
+            pages.append([m['id'] for m in data['messages']])
+            cursor = data['next_cursor']
+
+        self.assertEqual([len(page) for page in pages], [5, 3])
+        timestamps = dict(Message.objects.values_list('pk', 'timestamp'))
+        for page in pages:  # Oldest first within a page
+            self.assertEqual(page, sorted(page, key=lambda pk: (timestamps[pk], pk)))
+        everything = pages[1] + pages[0] + seen
+        self.assertEqual(len(set(everything)), 13)  # No overlap, nothing skipped
+        self.assertEqual([Message.objects.get(pk=pk).text for pk in everything], [f'm{n}' for n in range(13)])
+
+    def test_bad_cursor_gives_first_page(self):
+        for cursor in ('garbage', 'bm90IGEgZGF0ZXwx', '%%%'):
+            response = self.older(cursor)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([m['text'] for m in response.json()['messages']], ['m8', 'm9', 'm10', 'm11', 'm12'])
+
+
+class PersistTests(TestCase):
+    """ writer.persist: idempotent inserts, forward-only snapshots, unread counts after commit """
+
+    def setUp(self):
+        cache.clear()
+        self.a = User.objects.create_user('a', 'a@example.com', 'pw')
+        self.b = User.objects.create_user('b', 'b@example.com', 'pw')
+        self.thread = Thread.objects.create(first_user=self.a, second_user=self.b)
+
+    def test_duplicate_client_ids_are_saved_once(self):
+        client_id = uuid.uuid4()
+        message = queued(self.thread, self.a, self.b, 'hi', client_id)
+        saved = writer.persist([message, dict(message)])  # Resent within one batch
+        self.assertEqual(len(saved), 1)
+        self.assertEqual(writer.persist([message]), [])  # Retried batch / resent after a reconnect
+        self.assertEqual(Message.objects.filter(client_id=client_id).count(), 1)
+
+    def test_snapshot_only_moves_forward(self):
+        writer.persist([queued(self.thread, self.a, self.b, 'first')])
+        self.thread.refresh_from_db()
+        self.assertEqual((self.thread.last_message_text, self.thread.last_sender_id), ('first', self.a.pk))
+
+        # Another worker already recorded a newer message
+        ahead = timezone.now() + timedelta(hours=1)
+        Thread.objects.filter(pk=self.thread.pk).update(last_message_text='newer', last_message_at=ahead)
+        writer.persist([queued(self.thread, self.b, self.a, 'late')])
+        self.thread.refresh_from_db()
+        self.assertEqual((self.thread.last_message_text, self.thread.last_message_at), ('newer', ahead))
+
+    def test_unread_counted_after_commit(self):
+        self.assertEqual(unread.user_total(self.b.pk), 0)
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.persist([queued(self.thread, self.a, self.b, 'one'), queued(self.thread, self.a, self.b, 'two')])
+        self.assertEqual(unread.user_total(self.b.pk), 2)
+
+
+class PresenceTests(TestCase):
+    """ Online status from socket counts and heartbeats; last_seen written in bulk """
+
+    def setUp(self):
+        cache.clear()
+        presence._recent.clear()
+        presence.flush()  # Empties the buffer and restarts the flush timer
+        self.me, self.a, self.b = (User.objects.create_user(name, f'{name}@example.com', 'pw')
+                                   for name in ('me', 'a', 'b'))
+
+    def last_seen(self, user):
+        return User.objects.values_list('last_seen', flat=True).get(pk=user.pk)
+
+    def test_heartbeats_are_flushed_in_one_update(self):
+        presence.heartbeat(self.me.pk)
+        presence.heartbeat(self.a.pk)
+        presence.heartbeat(self.me.pk)
+        self.assertIsNone(self.last_seen(self.me))  # Buffered, not written
+        self.assertFalse(presence.flush_due())
+
+        presence._last_flush -= presence.FLUSH_INTERVAL
+        self.assertTrue(presence.flush_due())
+        with self.assertNumQueries(1) as ctx:
+            self.assertEqual(presence.flush(), 2)
+        self.assertTrue(ctx.captured_queries[0]['sql'].startswith('UPDATE'))
+        self.assertIsNotNone(self.last_seen(self.me))
+        self.assertIsNone(self.last_seen(self.b))
+        self.assertFalse(presence.flush_due())
+        with self.assertNumQueries(0):
+            self.assertEqual(presence.flush(), 0)
+
+    def test_last_seen_never_moves_backwards(self):
+        later = timezone.now() + timedelta(hours=1)  # Written by another process with a newer heartbeat
+        User.objects.filter(pk=self.me.pk).update(last_seen=later)
+        presence.heartbeat(self.me.pk)
+        presence.heartbeat(self.a.pk)
+        presence.flush()
+        self.assertEqual(self.last_seen(self.me), later)
+        self.assertLess(self.last_seen(self.a), later)
+
+    def test_online_needs_a_socket_and_a_recent_heartbeat(self):
+        def online(user):
+            return presence.status_for([user])[user.pk]['online']
+
+        presence.heartbeat(self.me.pk)  # HTTP activity alone
+        self.assertFalse(online(self.me))
+        self.assertEqual(presence.connected(self.me.pk), 1)
+        self.assertEqual(presence.connected(self.me.pk), 2)
+        self.assertTrue(online(self.me))
+
+        # A socket that stopped pinging (e.g. lost with a crashed worker)
+        cache.set(presence._seen_key(self.me.pk), time.time() - presence.ONLINE_TIMEOUT - 1)
+        self.assertFalse(online(self.me))
+        presence.heartbeat(self.me.pk)
+        self.assertTrue(online(self.me))
+
+        self.assertEqual(presence.disconnected(self.me.pk), 1)
+        self.assertTrue(online(self.me))
+        self.assertEqual(presence.disconnected(self.me.pk), 0)
+        self.assertFalse(online(self.me))
+        self.assertEqual(presence.disconnected(self.me.pk), 0)  # Never below zero
+
+    def test_status_for_many_users_is_one_cache_read(self):
+        presence.connected(self.a.pk)
+        User.objects.filter(pk=self.b.pk).update(last_seen=timezone.now() - timedelta(days=2))
+        users = list(User.objects.order_by('pk'))
+
+        class CountingCache:
+            calls = []
+
+            def __getattr__(self, name):
+                self.calls.append(name)
+                return getattr(cache, name)
+        self.addCleanup(setattr, presence, 'cache', presence.cache)
+        presence.cache = CountingCache()
+        with self.assertNumQueries(0):
+            status = presence.status_for(users)
+        self.assertEqual(CountingCache.calls, ['get_many'])
+        self.assertEqual([status[u.pk]['online'] for u in users], [False, True, False])
+        self.assertIsNone(status[self.me.pk]['last_seen'])
+        self.assertEqual(status[self.b.pk]['last_seen'], users[2].last_seen)  # Not cached: the loaded value
+
+    def test_middleware_throttles_heartbeats(self):
+        self.client.force_login(self.me)
+        self.client.get(reverse('chats:inbox'))
+        self.assertIn(self.me.pk, presence._pending)
+
+        presence._pending.clear()
+        self.client.get(reverse('chats:inbox'))
+        self.assertNotIn(self.me.pk, presence._pending)
+
+        presence._recent[self.me.pk] -= presence.HEARTBEAT_EVERY
+        self.client.get(reverse('chats:inbox'))
+        self.assertIn(self.me.pk, presence._pending)
+
+        # The bulk write rides on a request once it is due
+        presence._last_flush -= presence.FLUSH_INTERVAL
+        self.client.get(reverse('chats:inbox'))
+        self.assertEqual(presence._pending, {})
+        self.assertIsNotNone(self.last_seen(self.me))
+
+
+class UnreadCounterTests(TestCase):
+    """ Cached unread counters: recounts on a miss, drift repair and rebuilds """
+
+    def setUp(self):
+        cache.clear()
+        self.me, self.a, self.b = (User.objects.create_user(name, f'{name}@example.com', 'pw')
+                                   for name in ('me', 'a', 'b'))
+        self.with_a = Thread.objects.create(first_user=self.me, second_user=self.a)
+        self.with_b = Thread.objects.create(first_user=self.me, second_user=self.b)
+        # Written behind the counters' back, like rows from before they existed
+        for n in range(3):
+            Message.objects.create(thread=self.with_a, sender=self.a, text=f'a{n}')
+        Message.objects.create(thread=self.with_a, sender=self.me, text='mine')
+        Message.objects.create(thread=self.with_b, sender=self.b, text='b0', is_read=True)
+
+    def test_misses_are_recounted(self):
+        self.assertEqual(unread.user_total(self.me.pk), 3)
+        Message.objects.create(thread=self.with_a, sender=self.a, text='uncounted')
+        with self.assertNumQueries(0):
+            self.assertEqual(unread.user_total(self.me.pk), 3)
+        cache.delete(unread._user_key(self.me.pk))
+        self.assertEqual(unread.user_total(self.me.pk), 4)
+
+        with self.assertNumQueries(1):
+            counts = unread.thread_counts(self.me.pk, [self.with_a.pk, self.with_b.pk])
+        self.assertEqual(counts, {self.with_a.pk: 4, self.with_b.pk: 0})
+        with self.assertNumQueries(0):
+            unread.thread_counts(self.me.pk, [self.with_a.pk, self.with_b.pk])
+
+    def test_negative_counter_is_dropped(self):
+        unread.user_total(self.me.pk)
+        unread.thread_counts(self.me.pk, [self.with_a.pk])
+        unread.on_messages_seen(self.me.pk, self.with_a.pk, 2)
+        self.assertEqual(unread.user_total(self.me.pk), 1)
+
+        # Decremented below zero (counted elsewhere twice): dropped and recounted
+        unread.on_messages_seen(self.me.pk, self.with_a.pk, 5)
+        self.assertIsNone(cache.get(unread._user_key(self.me.pk)))
+        self.assertIsNone(cache.get(unread._thread_key(self.with_a.pk, self.me.pk)))
+        self.assertEqual(unread.user_total(self.me.pk), 3)
+
+    def drift(self):
+        cache.set_many({unread._user_key(self.me.pk): 9, unread._user_key(self.a.pk): 9,
+                        unread._thread_key(self.with_a.pk, self.me.pk): 9,
+                        unread._thread_key(self.with_b.pk, self.me.pk): 9})  # with_b is read up
+
+    def test_rebuild(self):
+        self.drift()
+        self.assertEqual(unread.rebuild(), 3)
+        self.assertEqual(unread.user_total(self.me.pk), 3)
+        self.assertEqual(unread.user_total(self.a.pk), 1)
+        self.assertEqual(unread.user_total(self.b.pk), 0)
+        self.assertEqual(unread.thread_counts(self.me.pk, [self.with_a.pk, self.with_b.pk]),
+                         {self.with_a.pk: 3, self.with_b.pk: 0})
+
+        # Only the given users are touched
+        self.drift()
+        self.assertEqual(unread.rebuild([self.me.pk]), 1)
+        self.assertEqual(unread.thread_counts(self.me.pk, [self.with_a.pk, self.with_b.pk]),
+                         {self.with_a.pk: 3, self.with_b.pk: 0})
+        self.assertEqual(unread.user_total(self.me.pk), 3)
+        self.assertEqual(unread.user_total(self.a.pk), 9)
+
+    def test_rebuild_command(self):
+        self.drift()
+        out = io.StringIO()
+        call_command('rebuild_unread_counts', 'me', stdout=out)
+        self.assertIn("Rebuilt unread counters for 1 user(s).", out.getvalue())
+        self.assertEqual(unread.user_total(self.me.pk), 3)
+        self.assertEqual(unread.user_total(self.a.pk), 9)
+
+        call_command('rebuild_unread_counts', stdout=out)
+        self.assertIn("Rebuilt unread counters for 3 user(s).", out.getvalue())
+        self.assertEqual(unread.user_total(self.a.pk), 1)
+
+
+class FakeChannelLayer:
+    """ Records group_sends """
+
+    def __init__(self):
+        self.sent = []
+
+    async def group_send(self, group, event):
+        self.sent.append((group, event))
+
+
+class SeenReceiptTests(TransactionTestCase):
+    """ `seen` acks: coalesced per room into one range UPDATE, then counters and the sender's "Seen" """
+
+    def setUp(self):
+        cache.clear()
+        self.me = User.objects.create_user('me', 'me@example.com', 'pw')
+        self.other = User.objects.create_user('other', 'other@example.com', 'pw')
+        self.thread = Thread.objects.create(first_user=self.me, second_user=self.other)
+        saved = writer.persist([queued(self.thread, self.other, self.me, f'm{n}') for n in range(5)])
+        writer.persist([queued(self.thread, self.me, self.other, 'mine')])
+        self.ids = sorted(message.pk for message, _ in saved)
+
+        self.addCleanup(setattr, consumers, 'SEEN_FLUSH_INTERVAL', consumers.SEEN_FLUSH_INTERVAL)
+        consumers.SEEN_FLUSH_INTERVAL = 0.05
+        self.layer = FakeChannelLayer()
+        self.room = consumers.Room(SimpleNamespace(me=self.me, channel_layer=self.layer),
+                                   self.other.pk, self.thread.pk)
+        self.updates = []
+        mark_read_up_to = self.room.mark_read_up_to
+
+        async def recording(up_to):
+            self.updates.append(up_to)
+            await mark_read_up_to(up_to)
+        self.room.mark_read_up_to = recording
+
+    def unread_ids(self):
+        return sorted(Message.objects.filter(thread=self.thread, is_read=False).values_list('pk', flat=True))
+
+    def seen_frames(self):
+        return [event['up_to'] for group, event in self.layer.sent if event['type'] == 'seen_up_to']
+
+    async def test_acks_within_interval_share_one_update(self):
+        for up_to in self.ids[:3]:
+            self.room.queue_seen(up_to)
+        self.room.queue_seen(self.ids[0])  # Lower than the mark: ignored
+        self.room.queue_seen('garbage')
+        await asyncio.sleep(consumers.SEEN_FLUSH_INTERVAL * 4)
+
+        self.assertEqual(self.updates, [self.ids[2]])
+        self.assertEqual(self.seen_frames(), [self.ids[2]])
+        self.assertEqual(self.layer.sent[0][0], self.thread.room_name(self.me.pk, self.other.pk))
+        unread_ids = await database_sync_to_async(self.unread_ids)()
+        mine = await Message.objects.filter(sender=self.me).values_list('pk', flat=True).aget()
+        self.assertEqual(unread_ids, sorted(self.ids[3:] + [mine]))
+
+        # A lower mark after the write changes nothing
+        self.room.queue_seen(self.ids[1])
+        await asyncio.sleep(consumers.SEEN_FLUSH_INTERVAL * 4)
+        self.assertEqual(self.updates, [self.ids[2]])
+
+    async def test_close_flushes_pending_mark(self):
+        self.room.queue_seen(self.ids[-1])
+        await self.room.close()
+        self.assertEqual(self.updates, [self.ids[-1]])
+        self.assertIsNone(self.room.seen_task)
+        self.assertEqual(self.seen_frames(), [self.ids[-1]])
+        unread_ids = await database_sync_to_async(self.unread_ids)()
+        self.assertEqual(len(unread_ids), 1)  # Only the message from me is left
+
+    async def test_counters_drop_by_rows_marked(self):
+        total = await database_sync_to_async(unread.user_total)(self.me.pk)
+        threads = await database_sync_to_async(unread.thread_counts)(self.me.pk, [self.thread.pk])
+        self.assertEqual((total, threads), (5, {self.thread.pk: 5}))
+
+        # Each ack takes off only the rows it flipped, not everything up to its mark
+        self.room.queue_seen(self.ids[1])
+        await self.room.close()
+        self.room.queue_seen(self.ids[3])
+        await self.room.close()
+        self.assertEqual(self.updates, [self.ids[1], self.ids[3]])
+        total = await database_sync_to_async(unread.user_total)(self.me.pk)
+        threads = await database_sync_to_async(unread.thread_counts)(self.me.pk, [self.thread.pk])
+        self.assertEqual((total, threads), (1, {self.thread.pk: 1}))
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class ChatConsumerTests(TransactionTestCase):
+    """ The per-page socket: subscriptions, per-room frames and cleanup on disconnect """
+
+    def setUp(self):
+        cache.clear()
+        self.me, self.a, self.b = (User.objects.create_user(name, f'{name}@example.com', 'pw')
+                                   for name in ('me', 'a', 'b'))
+        self.layer = get_channel_layer()
+
+    async def connect(self, user=None):
+        communicator = WebsocketCommunicator(consumers.ChatConsumer.as_asgi(), '/ws/')
+        communicator.scope['user'] = user or self.me
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def subscribe(self, communicator, user):
+        await communicator.send_json_to({'action': 'subscribe', 'user_id': user.pk})
+        frame = await communicator.receive_json_from()
+        self.assertEqual(frame, {'type': 'subscribed', 'user_id': user.pk,
+                                 'room': Thread.room_name(self.me.pk, user.pk)})
+        status = await communicator.receive_json_from()  # Our own 'online' reaches the room we just joined
+        self.assertEqual(status['type'], 'user_status')
+
+    def members(self, group):
+        return set(self.layer.groups.get(group, {}))
+
+    async def test_subscribe_rejects_self_unknown_and_duplicates(self):
+        communicator = await self.connect()
+        for user_id in (self.me.pk, 999999, 'x', None):
+            await communicator.send_json_to({'action': 'subscribe', 'user_id': user_id})
+        self.assertTrue(await communicator.receive_nothing())
+
+        await self.subscribe(communicator, self.a)
+        await communicator.send_json_to({'action': 'subscribe', 'user_id': self.a.pk})
+        self.assertTrue(await communicator.receive_nothing())
+        self.assertEqual(len(self.members(Thread.room_name(self.me.pk, self.a.pk))), 1)
+        await communicator.disconnect()
+
+    async def test_room_cap(self):
+        self.addCleanup(setattr, consumers, 'MAX_ROOMS', consumers.MAX_ROOMS)
+        consumers.MAX_ROOMS = 1
+        communicator = await self.connect()
+        await self.subscribe(communicator, self.a)
+        await communicator.send_json_to({'action': 'subscribe', 'user_id': self.b.pk})
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'error', 'error': 'too_many_rooms'})
+        self.assertEqual(self.members(Thread.room_name(self.me.pk, self.b.pk)), set())
+
+        # Unsubscribing frees the slot
+        await communicator.send_json_to({'action': 'unsubscribe', 'user_id': self.a.pk})
+        await self.subscribe(communicator, self.b)
+        self.assertEqual(self.members(Thread.room_name(self.me.pk, self.a.pk)), set())
+        await communicator.disconnect()
+
+    async def test_frames_for_unsubscribed_rooms_are_dropped(self):
+        room = Thread.room_name(self.me.pk, self.a.pk)
+        listener = await self.layer.new_channel()
+        await self.layer.group_add(room, listener)
+        communicator = await self.connect()
+        for frame in ({'action': 'message', 'to': self.a.pk, 'message': 'hi'},
+                      {'action': 'typing', 'to': self.a.pk, 'typing': True},
+                      {'action': 'seen', 'to': self.a.pk, 'up_to': 1},
+                      {'action': 'message', 'message': 'no room'}):
+            await communicator.send_json_to(frame)
+        self.assertTrue(await communicator.receive_nothing())
+        self.assertFalse(await Thread.objects.aexists())
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.layer.receive(listener), 0.1)
+
+        # Once subscribed, the same typing frame reaches the room
+        await self.subscribe(communicator, self.a)
+        self.assertEqual((await self.layer.receive(listener))['type'], 'user_status')
+        await communicator.send_json_to({'action': 'typing', 'to': self.a.pk, 'typing': True})
+        typing = await asyncio.wait_for(self.layer.receive(listener), 1)
+        self.assertEqual((typing['type'], typing['is_typing']), ('typing_indicator', True))
+        await communicator.disconnect()
+
+    async def test_disconnect_cleans_up(self):
+        closed = []
+        close = consumers.Room.close
+
+        async def recording(room):
+            closed.append(room.other_user_id)
+            await close(room)
+        self.addCleanup(setattr, consumers.Room, 'close', close)
+        consumers.Room.close = recording
+
+        communicator = await self.connect()
+        await self.subscribe(communicator, self.a)
+        await self.subscribe(communicator, self.b)
+        await communicator.disconnect()
+        self.assertEqual(sorted(closed), [self.a.pk, self.b.pk])
+        for group in (f'user_{self.me.pk}', Thread.room_name(self.me.pk, self.a.pk),
+                      Thread.room_name(self.me.pk, self.b.pk)):
+            self.assertEqual(self.members(group), set())
+        self.assertFalse(presence.status_for([self.me])[self.me.pk]['online'])
+
+    async def test_resubscribe_after_reconnect(self):
+        communicator = await self.connect()
+        await self.subscribe(communicator, self.a)
+        await communicator.disconnect()
+
+        # A new socket starts without subscriptions; the page subscribes again
+        communicator = await self.connect()
+        await communicator.send_json_to({'action': 'typing', 'to': self.a.pk, 'typing': True})
+        self.assertTrue(await communicator.receive_nothing())
+        await self.subscribe(communicator, self.a)
+        self.assertEqual(len(self.members(Thread.room_name(self.me.pk, self.a.pk))), 1)
+        await communicator.disconnect()
+
+
+@override_settings(CHANNEL_LAYERS={"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}})
+class MessageWriterTests(SimpleTestCase):
+    """ Batching, retries and announcements of the write-behind queue (persist itself is stubbed) """
+
+    def setUp(self):
+        self.batches, self.failures = [], 0
+        for name, value in [('persist', self.fake_persist), ('BATCH_SIZE', 3), ('FLUSH_INTERVAL', 0.05)]:
+            self.addCleanup(setattr, writer, name, getattr(writer, name))
+            setattr(writer, name, value)
+
+    def fake_persist(self, batch):
+        self.batches.append(list(batch))
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("database went away")
+        return [(Message(pk=100 + m['n'], sender_id=1, client_id=m['client_id']), 2) for m in batch]
+
+    def run_writer(self, count, listen=False):
+        """ Queue `count` messages, wait for the writer; returns (seconds taken, frames seen in room chat_1_2) """
+        async def scenario():
+            frames = []
+            if listen:
+                layer = get_channel_layer()
+                channel = await layer.new_channel()
+                await layer.group_add('chat_1_2', channel)
+            message_writer = writer.MessageWriter()
+            start = time.monotonic()
+            for n in range(count):
+                await message_writer.put({'n': n, 'client_id': uuid.UUID(int=n)})
+            await asyncio.wait_for(message_writer.join(), 5)
+            elapsed = time.monotonic() - start
+            message_writer.task.cancel()
+            if listen:
+                while True:
+                    try:
+                        frames.append(await asyncio.wait_for(layer.receive(channel), 0.1))
+                    except asyncio.TimeoutError:
+                        break
+            return elapsed, frames
+        return asyncio.run(scenario())
+
+    def test_full_batches_flush_at_once(self):
+        writer.FLUSH_INTERVAL = 5  # Only the size limit can end these batches in time
+        elapsed, _ = self.run_writer(6)
+        self.assertEqual([len(batch) for batch in self.batches], [3, 3])
+        self.assertLess(elapsed, 1)
+
+    def test_partial_batch_flushes_after_interval(self):
+        elapsed, _ = self.run_writer(2)
+        self.assertEqual([len(batch) for batch in self.batches], [2])
+        self.assertGreaterEqual(elapsed, writer.FLUSH_INTERVAL)
+
+    def test_failed_batch_is_retried_and_announced(self):
+        self.failures = 1
+        with self.assertLogs('chats.writer', 'WARNING'):
+            _, frames = self.run_writer(2, listen=True)
+        self.assertEqual(len(self.batches), 2)
+        self.assertEqual(self.batches[0], self.batches[1])
+        self.assertEqual(frames, [{'type': 'messages_saved', 'room': 'chat_1_2',
+                                   'ids': {str(uuid.UUID(int=0)): 100, str(uuid.UUID(int=1)): 101}}])
+
+
+class TypingThrottleTests(SimpleTestCase):
+    """ Debounce, rate limit, auto-expiry and the batched stats counters """
+
+    def setUp(self):
+        cache.clear()
+        for name, value in [('MIN_INTERVAL', 0.05), ('TIMEOUT', 0.2), ('STATS_BATCH', 1000)]:
+            self.addCleanup(setattr, typing_throttle, name, getattr(typing_throttle, name))
+            setattr(typing_throttle, name, value)
+        typing_throttle._local.update(dict.fromkeys(typing_throttle.STATS_KEYS, 0))
+        self.published = []
+
+    async def publish(self, is_typing):
+        self.published.append(is_typing)
+
+    async def test_only_changes_are_published(self):
+        throttle = typing_throttle.TypingThrottle(self.publish)
+        for _ in range(5):
+            await throttle.feed(True)
+        await asyncio.sleep(typing_throttle.MIN_INTERVAL * 2)
+        await throttle.feed(False)
+        await throttle.feed(False)
+        self.assertEqual(self.published, [True, False])
+
+    async def test_rate_limit_publishes_latest_state(self):
+        throttle = typing_throttle.TypingThrottle(self.publish)
+        await throttle.feed(True)
+        await throttle.feed(False)
+        await throttle.feed(True)
+        await throttle.feed(False)
+        self.assertEqual(self.published, [True])  # The rest waits for MIN_INTERVAL
+        await asyncio.sleep(typing_throttle.MIN_INTERVAL * 2)
+        self.assertEqual(self.published, [True, False])
+
+        # Flapping back to what the room already shows publishes nothing
+        throttle = typing_throttle.TypingThrottle(self.publish)
+        await throttle.feed(True)
+        await throttle.feed(False)
+        await throttle.feed(True)
+        await asyncio.sleep(typing_throttle.MIN_INTERVAL * 2)
+        self.assertEqual(self.published, [True, False, True])
+        await throttle.close()
+
+    async def test_unrefreshed_true_expires(self):
+        throttle = typing_throttle.TypingThrottle(self.publish)
+        await throttle.feed(True)
+        for _ in range(3):  # The page keeps re-sending while the user types
+            await asyncio.sleep(typing_throttle.TIMEOUT / 2)
+            await throttle.feed(True)
+        self.assertEqual(self.published, [True])
+        await asyncio.sleep(typing_throttle.TIMEOUT * 1.5)
+        self.assertEqual(self.published, [True, False])
+        self.assertIsNone(throttle.expiry)
+
+    async def test_close_and_message_clear_typing(self):
+        throttle = typing_throttle.TypingThrottle(self.publish)
+        await throttle.feed(True)
+        await throttle.close()
+        self.assertEqual(self.published, [True, False])
+        await throttle.close()  # Nothing showing: nothing to send
+        self.assertEqual(self.published, [True, False])
+
+        # Sending a message hides the indicator on the other page by itself: no publish, no expiry left
+        throttle = typing_throttle.TypingThrottle(self.publish)
+        await throttle.feed(True)
+        throttle.reset()
+        self.assertEqual((throttle.shown, throttle.expiry, throttle.pending), (False, None, None))
+        await asyncio.sleep(typing_throttle.TIMEOUT * 1.5)
+        self.assertEqual(self.published, [True, False, True])
+
+    async def test_stats_are_flushed_in_batches(self):
+        typing_throttle.STATS_BATCH = 3
+        throttle = typing_throttle.TypingThrottle(self.publish)
+        await throttle.feed(True)
+        await throttle.feed(True)
+        self.assertEqual(typing_throttle.stats()['received'], 0)  # Still counted locally
+        await throttle.feed(True)
+        self.assertEqual(typing_throttle.stats(), {'received': 3, 'published': 1, 'saved': 2})
+
+        await throttle.close()
+        await typing_throttle.flush_stats()  # As on disconnect
+        self.assertEqual(typing_throttle.stats(), {'received': 3, 'published': 2, 'saved': 1})
+        out = io.StringIO()
+        await database_sync_to_async(call_command)('typing_stats', stdout=out)
+        self.assertIn("Channel-layer sends saved: 1 (33.3%)", out.getvalue())
+
+
+class WireFormatTests(SimpleTestCase):
+    frame = {"type": "chat_message", "message": "hi", "sender_id": 7, "client_id": "c1", "room": "chat_7_9"}
+
+    def test_negotiate(self):
+        self.assertIs(wire.negotiate([]), wire.JSON)
+        self.assertIs(wire.negotiate(['graphql-ws']), wire.JSON)
+        self.assertEqual(wire.negotiate(['x', 'qwik.cbor', 'qwik.msgpack']).subprotocol, 'qwik.cbor')
+
+    def test_binary_round_trip(self):
+        for codec in wire.CODECS.values():
+            payload = codec.encode(self.frame)
+            self.assertIsInstance(payload, bytes)
+            self.assertLess(len(payload), len(wire.JSON.encode(self.frame)))
+            self.assertEqual(codec.decode(payload), self.frame)
+
+    def test_short_keys(self):
+        compact = wire.shorten({"action": "seen", "to": 9, "up_to": 120, "new_field": 1})
+        self.assertEqual(compact, {"a": wire.ACTIONS['seen'], "o": 9, "n": 120, "new_field": 1})
+        self.assertEqual(wire.expand(compact), {"action": "seen", "to": 9, "up_to": 120, "new_field": 1})
+
+
+class LoadTestToolsTests(SimpleTestCase):
+    def test_percentile(self):
+        samples = list(range(1, 101))
+        self.assertEqual(percentile(samples, 50), 50)
+        self.assertEqual(percentile(samples, 99), 99)
+        self.assertEqual(percentile([3], 99), 3)
+        self.assertIsNone(percentile([], 50))
+
+    async def test_standin_carries_the_pubsub_layer(self):
+        from channels_redis.pubsub import RedisPubSubChannelLayer
+
+        server = await RedisStandin().serve(port=0)
+        url = f"redis://127.0.0.1:{server.sockets[0].getsockname()[1]}"
+        sender, receiver = RedisPubSubChannelLayer(hosts=[url]), RedisPubSubChannelLayer(hosts=[url])
+        try:
+            channel = await receiver.new_channel()
+            await receiver.group_add('user_1', channel)
+            await sender.group_send('user_1', {'type': 'inbox_update', 'message': 'hi'})
+            self.assertEqual(await asyncio.wait_for(receiver.receive(channel), 5),
+                             {'type': 'inbox_update', 'message': 'hi'})
+        finally:
+            await sender.flush()
+            await receiver.flush()
+            server.close()
@@ -0,0 +1,126 @@
+"""
+Typing indicators without a channel-layer round trip per keystroke.
+
+Each room a socket subscribes to (consumers.Room) owns a TypingThrottle.
+Client `typing` frames only update the wanted state; the room is told (one
+group_send) when the state the other side sees actually changes, at most
+once per MIN_INTERVAL, with the latest state winning. A True that isn't refreshed within TIMEOUT (the
+page re-sends it while the user keeps typing) turns itself off, so a
+closed tab never leaves "is typing..." behind.
+
+Frames received vs. group_sends published are counted per process and
+added to cache counters in batches; `manage.py typing_stats` shows the
+traffic saved.
+"""
+import asyncio
+
+from django.conf import settings
+from django.core.cache import cache
+
+MIN_INTERVAL = settings.CHAT_TYPING_MIN_INTERVAL
+TIMEOUT = settings.CHAT_TYPING_TIMEOUT
+STATS_BATCH = 100  # Frames counted locally before they are added to the cache
+
+STATS_KEYS = ('typing:received', 'typing:published')
+_local = {'typing:received': 0, 'typing:published': 0}
+
+
+async def _count(key):
+    _local[key] += 1
+    if _local['typing:received'] >= STATS_BATCH:
+        await flush_stats()
+
+
+async def flush_stats():
+    """ Add this process's counts to the shared counters (async cache calls: this runs on the consumer's loop) """
+    counts = {key: _local[key] for key in STATS_KEYS}
+    _local.update(dict.fromkeys(STATS_KEYS, 0))  # Taken before awaiting, so concurrent frames start a new batch
+    for key, n in counts.items():
+        if n and not await cache.aadd(key, n, None):
+            try:
+                await cache.aincr(key, n)
+            except ValueError:
+                await cache.aset(key, n, None)
+
+
+def stats():
+    """ {'received': frames from clients, 'published': group_sends, 'saved': frames dropped} """
+    values = cache.get_many(STATS_KEYS)
+    received, published = values.get('typing:received', 0), values.get('typing:published', 0)
+    return {'received': received, 'published': published, 'saved': received - published}
+
+
+class TypingThrottle:
+    """ One connection's typing state; `publish(is_typing)` is the coroutine that tells the room """
+
+    def __init__(self, publish):
+        self.publish = publish
+        self.shown = False  # What the room last heard
+        self.wanted = False  # What the client last said
+        self.last_publish = 0.0
+        self.expires_at = 0.0
+        self.pending = None  # Deferred publish while rate limited
+        self.expiry = None  # Auto-off for a stale True
+
+    @staticmethod
+    def now():
+        return asyncio.get_running_loop().time()
+
+    async def feed(self, is_typing):
+        """ A `typing` frame from the client """
+        await _count('typing:received')
+        self.wanted = bool(is_typing)
+        if self.wanted:
+            self.expires_at = self.now() + TIMEOUT
+            if self.expiry is None:
+                self.expiry = asyncio.ensure_future(self._expire())
+        await self._maybe_publish()
+
+    def reset(self):
+        """ The user sent a message; the other page hides the indicator by itself """
+        self.wanted = self.shown = False
+        self._cancel()
+
+    async def close(self):
+        """ Connection is going away: turn a visible indicator off immediately """
+        self._cancel()
+        if self.shown:
+            self.wanted = False
+            await self._publish()
+
+    async def _maybe_publish(self):
+        if self.wanted == self.shown or self.pending is not None:
+            return  # No visible change, or a deferred publish will pick up the latest state
+        wait = self.last_publish + MIN_INTERVAL - self.now()
+        if wait > 0:
+            self.pending = asyncio.ensure_future(self._publish_later(wait))
+            return
+        await self._publish()
+
+    async def _publish_later(self, wait):
+        await asyncio.sleep(wait)
+        self.pending = None
+        await self._maybe_publish()
+
+    async def _publish(self):
+        self.shown = self.wanted
+        self.last_publish = self.now()
+        await _count('typing:published')
+        await self.publish(self.shown)
+
+    async def _expire(self):
+        while True:
+            wait = self.expires_at - self.now()
+            if wait <= 0:
+                break
+            await asyncio.sleep(wait)
+        self.expiry = None
+        if self.wanted:
+            self.wanted = False
+            await self._maybe_publish()
+
+    def _cancel(self):
+        for task in (self.pending, self.expiry):
+            if task is not None:
+                task.cancel()
+        self.pending = self.expiry = None
@@ -0,0 +1,138 @@
+"""
+Unread message counters, kept in the cache instead of counted per request.
+
+    unread:user:<user_id>                 messages waiting for the user overall
+    unread:thread:<thread_id>:<user_id>   messages waiting for the user in a thread
+
+chats/writer.persist increments both for the recipient once its batch
+commits. `seen` acks (Room.mark_read_up_to) decrement them by the
+messages they mark read. A missing key (evicted, flushed, or never seen)
+is recounted from Message.is_read on the next read, so the cache can be
+dropped at any time. Rebuild everything with
+`manage.py rebuild_unread_counts`.
+
+The increments only reach the process that made them unless the cache is
+shared (REDIS_URL). With the per-process LocMemCache, counters expire
+after CHAT_UNREAD_TIMEOUT seconds, so a miss recounts what other workers
+changed.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+from .models import Thread, Message
+
+TIMEOUT = getattr(settings, 'CHAT_UNREAD_TIMEOUT', None)  # None: counters live until evicted
+
+
+def _user_key(user_id):
+    return f'unread:user:{user_id}'
+
+
+def _thread_key(thread_id, user_id):
+    return f'unread:thread:{thread_id}:{user_id}'
+
+
+def _unread_for(user_id):
+    """ Unread messages addressed to `user_id` (in one of their threads, sent by the other side) """
+    return Message.objects.filter(
+        Q(thread__first_user_id=user_id) | Q(thread__second_user_id=user_id), is_read=False
+    ).exclude(sender_id=user_id)
+
+
+def _incr(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        pass  # Not cached yet; the next read counts it from the DB
+
+
+def _decr(key, delta):
+    try:
+        if cache.decr(key, delta) < 0:
+            cache.delete(key)  # Drifted; let the next read recount
+    except ValueError:
+        pass
+
+
+# --- Write side ---
+
+def on_message(message, recipient_id):
+    """ A new message in `message.thread` is waiting for `recipient_id` """
+    _incr(_user_key(recipient_id))
+    _incr(_thread_key(message.thread_id, recipient_id))
+
+
+def on_messages_seen(user_id, thread_id, marked):
+    """ `marked` messages in the thread were flipped to is_read by a `seen` ack (newer ones may remain) """
+    if marked:
+        _decr(_thread_key(thread_id, user_id), marked)
+        _decr(_user_key(user_id), marked)
+
+
+# --- Read side ---
+
+def user_total(user_id):
+    """ Unread messages across all of the user's threads """
+    key = _user_key(user_id)
+    count = cache.get(key)
+    if count is None:
+        count = _unread_for(user_id).count()
+        cache.add(key, count, TIMEOUT)
+    return count
+
+
+def thread_counts(user_id, thread_ids):
+    """ {thread_id: unread count} for the given threads, recounting cache misses in one query """
+    keys = {_thread_key(tid, user_id): tid for tid in thread_ids}
+    cached = cache.get_many(keys)
+    counts = {keys[key]: value for key, value in cached.items()}
+
+    missing = [tid for tid in thread_ids if tid not in counts]
+    if missing:
+        rows = _unread_for(user_id).filter(thread_id__in=missing)\
+                                   .values('thread_id').annotate(c=Count('pk'))\
+                                   .values_list('thread_id', 'c')
+        recounted = dict.fromkeys(missing, 0)
+        recounted.update(rows)
+        cache.set_many({_thread_key(tid, user_id): c for tid, c in recounted.items()}, TIMEOUT)
+        counts.update(recounted)
+    return counts
+
+
+# --- Repair ---
+
+def rebuild(user_ids=None):
+    """
+    Recompute counters from Message.is_read for `user_ids` (default: everyone
+    with a thread). Returns how many users were rebuilt.
+    """
+    threads = Thread.objects.all()
+    if user_ids is not None:
+        threads = threads.filter(Q(first_user_id__in=user_ids) | Q(second_user_id__in=user_ids))
+
+    # Every (thread, participant) pair starts at zero, so read-up threads are reset too
+    per_thread = {}
+    for thread_id, first_id, second_id in threads.values_list('id', 'first_user_id', 'second_user_id').iterator():
+        per_thread[(thread_id, first_id)] = 0
+        per_thread[(thread_id, second_id)] = 0
+
+    unread = Message.objects.filter(is_read=False, thread__in=threads)\
+                            .values('thread_id', 'thread__first_user_id', 'thread__second_user_id', 'sender_id')\
+                            .annotate(c=Count('pk'))
+    for row in unread:
+        recipient = row['thread__second_user_id'] if row['sender_id'] == row['thread__first_user_id'] \
+            else row['thread__first_user_id']
+        per_thread[(row['thread_id'], recipient)] += row['c']
+
+    if user_ids is not None:
+        wanted = set(user_ids)
+        per_thread = {(t, u): c for (t, u), c in per_thread.items() if u in wanted}
+
+    per_user = dict.fromkeys(user_ids or (), 0)
+    for (thread_id, user_id), count in per_thread.items():
+        per_user[user_id] = per_user.get(user_id, 0) + count
+
+    cache.set_many({_thread_key(t, u): c for (t, u), c in per_thread.items()}, TIMEOUT)
+    cache.set_many({_user_key(u): c for u, c in per_user.items()}, TIMEOUT)
+    return len(per_user)
@@ -1,53 +1,64 @@
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth.decorators import login_required
-from django.db.models import Q, Max
+from django.db.models import Q
 from django.http import JsonResponse
+from django.template.loader import render_to_string
 from accounts.models import User, Follow
-from .models import Thread
+from posts.search import search_users
+from posts.pagination import paginate
+from .models import Thread, Message
+from . import unread, presence
 from typing import List, Any
 from django.views.decorators.cache import never_cache
 
+INBOX_PAGE_SIZE = 20
+CHAT_PAGE_SIZE = 50  # Messages rendered with the room; older ones load on scroll
+
 @never_cache
 @login_required
 def inbox_view(request):
     my_pk = request.user.pk
 
-    # 1. Fetch threads where the user is a participant
-    # Annotate with the latest message timestamp to order the inbox
+    # 1. My threads by the last-message snapshot (thread_*_recent_idx), both
+    # participants in the same query; Message is not read at all
     threads_qs = Thread.objects.filter(
-        Q(first_user_id=my_pk) | Q(second_user_id=my_pk)
-    ).annotate(last_msg_time=Max('messages__timestamp')).order_by('-last_msg_time')
+        Q(first_user_id=my_pk) | Q(second_user_id=my_pk), last_message_at__isnull=False
+    ).select_related('first_user', 'second_user')
 
-    thread_list_data = []
-    messaged_pks = []
+    # 2. Keyset pagination on the last message time
+    page = paginate(threads_qs, request.GET.get('cursor'), page_size=INBOX_PAGE_SIZE, date_field='last_message_at')
 
-    for thread in threads_qs:
-        # Determine the person I am talking to
-        if thread.first_user_id == my_pk:
-            other_user = thread.second_user
-        else:
-            other_user = thread.first_user
-        
-        messaged_pks.append(other_user.pk)
+    # Unread counts from the OTHER user, read from the counter cache in one go
+    unread_counts = unread.thread_counts(my_pk, [thread.pk for thread in page])
 
-        # Get last message safely
-        last_msg = thread.messages.order_by('-timestamp').first()
-        # Count unread messages from the OTHER user
-        unread_count = thread.messages.filter(sender=other_user, is_read=False).count()
+    # Determine the person I am talking to in each thread
+    others = [thread.second_user if thread.first_user_id == my_pk else thread.first_user for thread in page]
+    # Online / last seen for the whole page in one cache lookup
+    statuses = presence.status_for(others)
 
+    thread_list_data = []
+    for thread, other_user in zip(page, others):
         thread_list_data.append({
             'other_user': other_user,
-            'last_msg': last_msg,
-            'unread_count': unread_count
+            'last_msg_text': thread.last_message_text,
+            'unread_count': unread_counts[thread.pk],
+            'status': statuses[other_user.pk],
         })
 
-    # 2. Suggestions logic (Followed users not yet messaged)
+    # 3. AJAX for older conversations
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        rows = [{'html': render_to_string('chats/includes/inbox_row.html', {'data': data}, request=request)}
+                for data in thread_list_data]
+        return JsonResponse({'threads': rows, 'has_next': page.has_next, 'next_cursor': page.next_cursor})
+
+    # 4. Suggestions logic (Followed users not yet messaged)
     suggestions = User.objects.filter(followers__follower=request.user)\
-        .exclude(pk__in=messaged_pks)\
+        .exclude(Q(thread_first__second_user_id=my_pk) | Q(thread_second__first_user_id=my_pk))\
         .exclude(is_staff=True).distinct()[:5]
 
     return render(request, 'chats/inbox.html', {
         'threads': thread_list_data,
+        'next_cursor': page.next_cursor,
         'suggestions': suggestions
     })
 
@@ -55,15 +66,13 @@ def inbox_view(request):
 @login_required
 def search_users_ajax(request):
     query = request.GET.get('q', '').strip()
-    users = User.objects.filter(
-        Q(username__icontains=query) | Q(first_name__icontains=query)
-    ).exclude(Q(is_staff=True) | Q(pk=request.user.pk))[:8]
+    users = search_users(query).exclude(pk=request.user.pk)[:8]
 
     results = []
     for u in users:
         results.append({
             'username': u.username,
-            'avatar': u.profile_image.url if u.profile_image else f"https://ui-avatars.com/api/?name={u.username}",
+            'avatar': u.avatars.thumb.url,
             'url': f"/chats/{u.username}/"
         })
     return JsonResponse({'users': results})
@@ -81,14 +90,27 @@ def chat_room_view(request, username: str):
         Q(first_user_id=other_pk, second_user_id=my_pk)
     ).first()
     
-    messages = []
-    if thread:
-        # Mark messages as read
-        thread.messages.filter(sender=other_user, is_read=False).update(is_read=True)
-        messages = thread.messages.all()
-    
+    # Only the latest page of history, keyset paginated on (timestamp, id)
+    page = paginate(thread.messages.all() if thread else Message.objects.none(),
+                    request.GET.get('cursor'), page_size=CHAT_PAGE_SIZE, date_field='timestamp')
+
+    # AJAX for older history (scrolling up); oldest first, like the page
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        messages_data = [{
+            'id': msg.pk,
+            'text': msg.text,
+            'sender_id': msg.sender_id,
+            'client_id': str(msg.client_id or ''),
+        } for msg in page.object_list[::-1]]
+        return JsonResponse({'messages': messages_data, 'has_next': page.has_next, 'next_cursor': page.next_cursor})
+
+    # Nothing is marked read here: the page sends a `seen` ack for the newest
+    # message it shows once its room is subscribed (Room.mark_read_up_to)
     return render(request, 'chats/chat_room.html', {
         'other_user': other_user,
-        'thread_messages': messages,
+        'thread_messages': page.object_list[::-1],  # Oldest at the top
+        'other_status': presence.status_for([other_user])[other_user.pk],
+        'room_name': Thread.room_name(my_pk, other_pk),
+        'next_cursor': page.next_cursor,
         'thread': thread # Might be None
     })
\ No newline at end of file
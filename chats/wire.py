@@ -0,0 +1,134 @@
+"""
+Wire formats for the chat socket (ws/).
+
+The client lists the subprotocols it understands and ChatConsumer.connect
+accepts the first one it knows:
+
+    qwik.msgpack   binary MessagePack frames with short keys
+    qwik.cbor      binary CBOR frames with short keys
+    (none)         JSON text frames with the full keys, as before
+
+Binary frames rename the top-level keys via KEYS and send `type` (server
+frames) and `action` (client frames) as small integers. Keys and names
+not listed pass through unchanged, so a new field works before it gets a
+short key. Nested values (e.g. the `ids` map of messages_saved) are not
+touched. The browser's copy of these tables is in
+templates/includes/wire_codec.html and must be kept in step.
+
+`manage.py wire_benchmark` compares payload size and encode/decode cost.
+"""
+import json
+
+import cbor2
+import msgpack
+
+KEYS = {
+    'type': 't',
+    'action': 'a',
+    'message': 'm',
+    'sender_id': 's',
+    'client_id': 'c',
+    'room': 'r',
+    'user_id': 'u',
+    'to': 'o',
+    'is_typing': 'y',
+    'typing': 'g',
+    'up_to': 'n',
+    'ids': 'i',
+    'status': 'x',
+    'error': 'e',
+}
+
+# Server -> client frame types
+TYPES = {
+    'chat_message': 1,
+    'typing_indicator': 2,
+    'inbox_update': 3,
+    'messages_saved': 4,
+    'seen_up_to': 5,
+    'user_status': 6,
+    'subscribed': 7,
+    'error': 8,
+}
+
+# Client -> server actions
+ACTIONS = {
+    'ping': 1,
+    'subscribe': 2,
+    'unsubscribe': 3,
+    'message': 4,
+    'seen': 5,
+    'typing': 6,
+}
+
+_LONG_KEYS = {short: key for key, short in KEYS.items()}
+_TYPE_NAMES = {code: name for name, code in TYPES.items()}
+_ACTION_NAMES = {code: name for name, code in ACTIONS.items()}
+
+
+def shorten(frame):
+    """ Full-key frame -> compact frame """
+    compact = {KEYS.get(key, key): value for key, value in frame.items()}
+    if 'type' in frame:
+        compact['t'] = TYPES.get(frame['type'], frame['type'])
+    if 'action' in frame:
+        compact['a'] = ACTIONS.get(frame['action'], frame['action'])
+    return compact
+
+
+def expand(compact):
+    """ Compact frame -> full-key frame """
+    frame = {_LONG_KEYS.get(key, key): value for key, value in compact.items()}
+    if 'type' in frame:
+        frame['type'] = _TYPE_NAMES.get(frame['type'], frame['type'])
+    if 'action' in frame:
+        frame['action'] = _ACTION_NAMES.get(frame['action'], frame['action'])
+    return frame
+
+
+class JsonCodec:
+    """ Text frames, full keys (no subprotocol) """
+    subprotocol = None
+    binary = False
+
+    def encode(self, frame):
+        return json.dumps(frame)
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class MsgpackCodec:
+    subprotocol = 'qwik.msgpack'
+    binary = True
+
+    def encode(self, frame):
+        return msgpack.packb(shorten(frame))
+
+    def decode(self, data):
+        compact = msgpack.unpackb(data)
+        return expand(compact) if isinstance(compact, dict) else compact
+
+
+class CborCodec:
+    subprotocol = 'qwik.cbor'
+    binary = True
+
+    def encode(self, frame):
+        return cbor2.dumps(shorten(frame))
+
+    def decode(self, data):
+        compact = cbor2.loads(data)
+        return expand(compact) if isinstance(compact, dict) else compact
+
+
+JSON = JsonCodec()
+CODECS = {codec.subprotocol: codec for codec in (MsgpackCodec(), CborCodec())}
+
+
+def negotiate(offered):
+    """ The codec for the first subprotocol the client offered that we speak; JSON if none """
+    for name in offered:
+        if name in CODECS:
+            return CODECS[name]
+    return JSON
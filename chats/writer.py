@@ -0,0 +1,158 @@
+"""
+Write-behind persistence for chat messages.
+
+ChatConsumer broadcasts a message as soon as it arrives and queues it here.
+A background task per event loop drains the queue in batches: one bulk
+INSERT plus one snapshot UPDATE per thread touched, in a single transaction.
+Afterwards each room gets a `messages_saved` event mapping client ids to
+database ids, which is what read receipts (`seen`) are keyed on.
+
+- Every message carries a client-generated UUID and (sender, client_id) is
+  unique, so a batch that is retried or a message resent after a reconnect
+  never creates a second row.
+- The queue is bounded. When the database falls behind, `put()` waits,
+  which stalls the sending socket instead of buffering without limit.
+- Messages still queued when a worker process dies are lost; that is the
+  price of taking the INSERT off the hot path.
+"""
+import asyncio
+import logging
+import weakref
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+
+from .models import Thread, Message
+from . import unread
+
+BATCH_SIZE = settings.CHAT_WRITE_BATCH_SIZE
+FLUSH_INTERVAL = settings.CHAT_WRITE_FLUSH_INTERVAL
+QUEUE_SIZE = settings.CHAT_WRITE_QUEUE_SIZE
+MAX_ATTEMPTS = 5  # Per batch, before it is logged and dropped
+
+logger = logging.getLogger(__name__)
+
+
+def persist(batch):
+    """
+    Save queued messages (dicts with thread_id, sender_id, recipient_id,
+    client_id and text). Already-saved ones are skipped. Returns
+    [(message, recipient_id)] for the new rows.
+    """
+    # Drop repeats within the batch and messages an earlier flush already saved
+    pending = {}
+    for m in batch:
+        pending.setdefault((m['sender_id'], m['client_id']), m)  # First copy wins
+    saved = Message.objects.filter(sender_id__in={s for s, _ in pending},
+                                   client_id__in={c for _, c in pending})\
+                           .values_list('sender_id', 'client_id')
+    for key in saved:
+        pending.pop(key, None)
+    if not pending:
+        return []
+
+    with transaction.atomic():
+        # ON CONFLICT DO NOTHING covers a concurrent flush of the same message
+        Message.objects.bulk_create([
+            Message(thread_id=m['thread_id'], sender_id=m['sender_id'], client_id=m['client_id'], text=m['text'])
+            for m in pending.values()
+        ], ignore_conflicts=True)
+
+        # bulk_create can't return ids when ignoring conflicts; read the new rows back
+        candidates = Message.objects.filter(sender_id__in={s for s, _ in pending},
+                                            client_id__in={c for _, c in pending})\
+                                    .order_by('timestamp', 'pk')
+        created = [m for m in candidates if (m.sender_id, m.client_id) in pending]
+        latest = {}
+        for message in created:
+            latest[message.thread_id] = message
+
+        # Move each thread's snapshot forward (never backwards, another worker may be ahead)
+        for thread_id, message in latest.items():
+            Thread.objects.filter(pk=thread_id)\
+                          .filter(Q(last_message_at__isnull=True) | Q(last_message_at__lte=message.timestamp))\
+                          .update(last_message=message,
+                                  last_message_text=message.text or '',
+                                  last_sender_id=message.sender_id,
+                                  last_message_at=message.timestamp,
+                                  updated_at=message.timestamp)
+
+        def count_unread():
+            for message in created:
+                unread.on_message(message, recipient_id=pending[(message.sender_id, message.client_id)]['recipient_id'])
+        transaction.on_commit(count_unread)
+
+    return [(m, pending[(m.sender_id, m.client_id)]['recipient_id']) for m in created]
+
+
+class MessageWriter:
+    """ Bounded queue plus the task that flushes it, bound to one event loop """
+
+    def __init__(self):
+        self.queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def put(self, message):
+        await self.queue.put(message)  # Waits while the queue is full (backpressure)
+
+    async def join(self):
+        """ Wait until everything queued so far has been flushed """
+        await self.queue.join()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # Block for the first message, then give the batch FLUSH_INTERVAL to fill up
+            batch = [await self.queue.get()]
+            deadline = loop.time() + FLUSH_INTERVAL
+            while len(batch) < BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self.flush(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    async def flush(self, batch):
+        delay = FLUSH_INTERVAL
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                saved = await database_sync_to_async(persist)(batch)
+            except Exception:
+                if attempt == MAX_ATTEMPTS:
+                    logger.exception("Dropping %d chat message(s) after %d failed attempts", len(batch), attempt)
+                    return
+                logger.warning("Saving %d chat message(s) failed, retrying", len(batch), exc_info=True)
+                await asyncio.sleep(delay)
+                delay *= 2
+            else:
+                await self.announce(saved)
+                return
+
+    async def announce(self, saved):
+        """ Tell each room the database ids of its newly saved messages (clients track reads by id) """
+        rooms = {}
+        for message, recipient_id in saved:
+            rooms.setdefault(Thread.room_name(message.sender_id, recipient_id), {})[str(message.client_id)] = message.pk
+        layer = get_channel_layer()
+        for room, ids in rooms.items():
+            await layer.group_send(room, {"type": "messages_saved", "ids": ids, "room": room})
+
+
+_writers = weakref.WeakKeyDictionary()
+
+
+def get_writer():
+    """ The MessageWriter of the running event loop (one per worker process under Daphne) """
+    loop = asyncio.get_running_loop()
+    if loop not in _writers:
+        _writers[loop] = MessageWriter()
+    return _writers[loop]
@@ -9,7 +9,7 @@ def admin_required(view_func):
             return redirect('accounts:login')
         
         # Check if user role is admin OR superuser
-        if request.user.role == 'admin' or request.user.is_superuser:
+        if request.user.is_portal_admin:
             return view_func(request, *args, **kwargs)
         
         messages.error(request, "Access Denied: Admins only.")
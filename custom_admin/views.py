@@ -1,5 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
-from django.db.models import Q
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.contrib import messages
 from django.template.loader import render_to_string
 from django.http import HttpResponse
@@ -7,6 +9,8 @@ from django.utils import timezone
 from .decorators import admin_required
 from accounts.models import User
 from posts.models import Post, Comment
+from posts import timeline
+from posts.search import search_users, search_posts
 from django.views.decorators.cache import never_cache
 
 # --- Helper for AJAX ---
@@ -51,10 +55,7 @@ def users_list(request):
 
     # Search
     if query:
-        users = users.filter(
-            Q(username__icontains=query) | 
-            Q(email__icontains=query)
-        )
+        users = search_users(query, users=users, fields=('username', 'email'))
 
     # AJAX Response for Realtime Search
     if is_ajax(request):
@@ -103,10 +104,7 @@ def posts_list(request):
         posts = posts.filter(is_flagged=True) # NSFW
 
     if query:
-        posts = posts.filter(
-            Q(caption__icontains=query) | 
-            Q(user__username__icontains=query)
-        )
+        posts = search_posts(posts, query, substring_fallback=True).order_by('-rank', '-created_at')
 
     if is_ajax(request):
         html = render_to_string('custom_admin/partials/post_rows.html', {'posts': posts}, request=request)
@@ -150,6 +148,11 @@ def delete_post(request, post_id):
         post.deletion_reason = 'admin_deleted'
         messages.success(request, "Post Moved to Archive.")
     post.save()
+
+    if post.is_active:
+        timeline.fan_out_post(post)
+    else:
+        timeline.remove_post(post)
     return redirect('custom_admin:posts_list')
 
 @never_cache
@@ -172,7 +175,9 @@ def comments_list(request):
 def delete_comment(request, comment_id):
     """Delete/Remove inappropriate comments"""
     comment = get_object_or_404(Comment, pk=comment_id)
-    comment.delete()
+    with transaction.atomic():
+        comment.delete()
+        Post.objects.filter(pk=comment.post_id).update(comment_count=Greatest(F('comment_count') - 1, 0))
     messages.success(request, "Comment deleted successfully.")
     return redirect('custom_admin:comments_list')
 
@@ -0,0 +1,67 @@
+"""
+Who may see what.
+
+A post is visible to a viewer when
+
+    the viewer wrote it, or follows its author, or
+    it is public: visibility 'public' and the author's account isn't private
+
+The last condition is precomputed as Post.is_public. Post.save() sets it,
+and sync_author() rewrites it for all of an author's posts when they
+switch their account's privacy. That makes "posts V can see" a single
+predicate, with no per-post check in Python:
+
+    is_public OR user_id = V OR EXISTS (V follows user_id)
+
+That is Post.objects.visible_to(V). The EXISTS probes the unique
+(follower, following) index. Following is read from the Follow table
+and never from the follow-graph cache, because the cache can lag behind
+an unfollow and this decides access. Explore uses is_public alone
+(post_explore_idx). Home, profile, post detail, likes and comments go
+through visible_to(). Single objects use the checks below.
+
+Admin portal users (User.is_portal_admin) see every post, because they
+open any of them from the moderation pages.
+"""
+from django.shortcuts import get_object_or_404
+
+from accounts.models import Follow
+
+from .models import Post
+from . import fragments
+
+
+def _follows(viewer, user_id):
+    return Follow.objects.filter(follower_id=viewer.pk, following_id=user_id).exists()
+
+
+def can_view(viewer, post):
+    """ Post-level check, for a post that is already loaded """
+    return post.is_public or (viewer.is_authenticated and (
+        viewer.is_portal_admin or post.user_id == viewer.pk or _follows(viewer, post.user_id)))
+
+
+def sees_all_posts(viewer, user):
+    """ True for the author, their followers and portal admins, who see friends-only posts too """
+    return viewer.is_authenticated and (
+        viewer.is_portal_admin or user.pk == viewer.pk or _follows(viewer, user.pk))
+
+
+def can_view_profile(viewer, user):
+    """ Private accounts show their posts and follow lists to their followers only """
+    return not user.is_private or sees_all_posts(viewer, user)
+
+
+def visible_post_or_404(viewer, post_id):
+    """ get_object_or_404 limited to what `viewer` may see; hidden posts 404 like missing ones """
+    return get_object_or_404(Post.objects.visible_to(viewer), pk=post_id)
+
+
+def sync_author(user):
+    """ Recompute is_public on all of `user`'s posts after their account privacy changed """
+    posts = Post.objects.filter(user=user)
+    if user.is_private:
+        posts.update(is_public=False)
+    else:
+        posts.filter(visibility='public').update(is_public=True)
+    fragments.touch('user', user.pk)  # The profile header's public post count changed
@@ -0,0 +1,69 @@
+"""
+BlurHash encoder (https://blurha.sh): a ~30 character string that decodes
+to a blurred preview of an image. posts.images stores one per post image;
+the page paints it (templates/includes/media.html) until the real image
+has loaded.
+"""
+import math
+
+from PIL import Image
+
+CHARACTERS = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz#$%*+,-.:;=?@[]^_{|}~"
+SAMPLE_SIZE = 32  # The hash only holds a few cosine components; a tiny copy is plenty
+
+
+def _encode83(value, length):
+    return ''.join(CHARACTERS[(value // 83 ** (length - i)) % 83] for i in range(1, length + 1))
+
+
+def _to_linear(value):
+    v = value / 255
+    return v / 12.92 if v <= 0.04045 else ((v + 0.055) / 1.055) ** 2.4
+
+
+def _to_srgb(value):
+    v = max(0.0, min(1.0, value))
+    return int(v * 12.92 * 255 + 0.5) if v <= 0.0031308 else int((1.055 * v ** (1 / 2.4) - 0.055) * 255 + 0.5)
+
+
+def _sign_pow(value, exp):
+    return math.copysign(abs(value) ** exp, value)
+
+
+def encode(image, x_components=4, y_components=3):
+    """ BlurHash of a PIL image """
+    small = image.convert('RGB')
+    small.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE))
+    width, height = small.size
+    pixels = [tuple(_to_linear(c) for c in pixel) for pixel in small.getdata()]
+
+    factors = []
+    for j in range(y_components):
+        cos_y = [math.cos(math.pi * j * y / height) for y in range(height)]
+        for i in range(x_components):
+            cos_x = [math.cos(math.pi * i * x / width) for x in range(width)]
+            r = g = b = 0.0
+            for y in range(height):
+                row = y * width
+                for x in range(width):
+                    basis = cos_x[x] * cos_y[y]
+                    pr, pg, pb = pixels[row + x]
+                    r += basis * pr
+                    g += basis * pg
+                    b += basis * pb
+            scale = (1 if i == 0 and j == 0 else 2) / (width * height)
+            factors.append((r * scale, g * scale, b * scale))
+
+    dc, ac = factors[0], factors[1:]
+    result = _encode83((x_components - 1) + (y_components - 1) * 9, 1)
+    if ac:
+        quantised_max = max(0, min(82, int(max(abs(v) for f in ac for v in f) * 166 - 0.5)))
+        maximum = (quantised_max + 1) / 166
+    else:
+        quantised_max, maximum = 0, 1
+    result += _encode83(quantised_max, 1)
+    result += _encode83((_to_srgb(dc[0]) << 16) + (_to_srgb(dc[1]) << 8) + _to_srgb(dc[2]), 4)
+    for f in ac:
+        r, g, b = (max(0, min(18, int(_sign_pow(v / maximum, 0.5) * 9 + 9.5))) for v in f)
+        result += _encode83(r * 19 * 19 + g * 19 + b, 2)
+    return result
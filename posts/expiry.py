@@ -0,0 +1,38 @@
+"""
+Expiry engine for temporary posts.
+
+Post.save() only deactivates a post that happens to be saved after it
+expired. This module sweeps every due post in batched UPDATEs (driven by the
+partial index on expires_at) and drops them from the home timelines.
+Run it with `manage.py expire_posts`, either from cron or with --loop.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Post, TimelineEntry
+from . import fragments
+
+BATCH_SIZE = 500
+
+
+def expire_due_posts(batch_size=BATCH_SIZE, now=None):
+    """ Deactivate every post whose expires_at has passed; returns how many were expired """
+    now = now or timezone.now()
+    total = 0
+    while True:
+        with transaction.atomic():
+            # SKIP LOCKED lets several sweepers run without blocking each other
+            due = list(
+                Post.objects.filter(is_active=True, expires_at__lte=now)
+                            .order_by('expires_at')
+                            .select_for_update(skip_locked=True)
+                            .values_list('pk', 'user_id')[:batch_size]
+            )
+            if not due:
+                break
+            due_ids = [pk for pk, _ in due]
+            Post.objects.filter(pk__in=due_ids).update(is_active=False)
+            TimelineEntry.objects.filter(post_id__in=due_ids).delete()
+            fragments.touch('user', *{user_id for _, user_id in due})  # Their profile post counts
+        total += len(due_ids)
+    return total
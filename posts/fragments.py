@@ -0,0 +1,209 @@
+"""
+Rendered fragments that look the same to every viewer, cached in two levels:
+
+    L1  a per-process LRU (FRAGMENT_LRU_SIZE entries)
+    L2  the shared cache (Redis when REDIS_URL is set)
+
+    grid tile       explore and profile grids, as HTML and as infinite-scroll JSON
+    profile header  avatar and name/bio block of a profile, and its post counts
+
+Each key carries the version of the object it was rendered from:
+
+    frag:v:post:<id>                version token of a post (or user)
+    frag:tile:<id>:<version>        the fragment
+
+Invalidating is bumping the version (touch). Old entries are never read
+again and age out of both levels. Versions live in L2 only, so a page costs
+one get_many for the versions of everything on it. Then each fragment
+comes from L1, or from L2, or is rendered and stored.
+
+The signal receivers below bump versions when posts, likes, comments or
+users are saved or deleted, once the transaction commits. A post also
+bumps its author, for the header's counts. So do the expiry sweep and
+a change of account privacy, which write with update(). Between sweeps,
+a post that just expired can stay counted. Anything that
+differs per viewer (liked, saved, following, the follow button) stays in
+the templates and comes from the small per-viewer sets the views already
+load. Posts whose image is still being processed, and users whose avatar
+is, are rendered fresh. The media worker finishes them with update(),
+which sends no signal.
+
+Views load the objects before the versions are read. So a page rendered
+while a change is committing can store the old fragment under the new
+version. It is then served until the next change or TIMEOUT.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+
+from accounts.models import User
+from .models import Post, Like, Comment
+
+TIMEOUT = getattr(settings, 'FRAGMENT_CACHE_TIMEOUT', 3600)
+LRU_SIZE = getattr(settings, 'FRAGMENT_LRU_SIZE', 2000)
+
+
+class LRU:
+    """ A small thread-safe least-recently-used dict """
+
+    def __init__(self, size):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local = LRU(LRU_SIZE)
+
+
+def _version_key(kind, pk):
+    return f'frag:v:{kind}:{pk}'
+
+
+def _new_version():
+    # Tokens never repeat, so a version key that was evicted can't bring back old fragments
+    return time.time_ns()
+
+
+def touch(kind, *pks):
+    """ Invalidate every fragment of these objects ('post' or 'user'), after the current transaction """
+    versions = {_version_key(kind, pk): _new_version() for pk in pks}
+    transaction.on_commit(lambda: cache.set_many(versions, TIMEOUT))
+
+
+def _versions(kind, pks):
+    keys = {pk: _version_key(kind, pk) for pk in pks}
+    found = cache.get_many(keys.values())
+    missing = {key: _new_version() for key in keys.values() if key not in found}
+    if missing:
+        cache.set_many(missing, TIMEOUT)
+        found.update(missing)
+    return {pk: found[key] for pk, key in keys.items()}
+
+
+def get_many(name, kind, objects, render):
+    """ {pk: fragment} for `objects`, rendering (and storing) the ones neither level has """
+    versions = _versions(kind, [obj.pk for obj in objects])
+    keys = {obj.pk: f'frag:{name}:{obj.pk}:{versions[obj.pk]}' for obj in objects}
+
+    # 1. This process
+    fragments = {}
+    for pk, key in keys.items():
+        value = local.get(key)
+        if value is not None:
+            fragments[pk] = value
+
+    # 2. The shared cache, for the rest
+    wanted = {keys[pk]: pk for pk in keys if pk not in fragments}
+    if wanted:
+        for key, value in cache.get_many(wanted).items():
+            fragments[wanted[key]] = value
+            local.set(key, value)
+
+    # 3. Render what neither had
+    rendered = {}
+    for obj in objects:
+        if obj.pk not in fragments:
+            fragments[obj.pk] = rendered[keys[obj.pk]] = render(obj)
+            local.set(keys[obj.pk], fragments[obj.pk])
+    if rendered:
+        cache.set_many(rendered, TIMEOUT)
+    return fragments
+
+
+def _cached(name, kind, objects, render, cacheable):
+    objects = list(objects)
+    fragments = get_many(name, kind, [obj for obj in objects if cacheable(obj)], render)
+    return [fragments[obj.pk] if obj.pk in fragments else render(obj) for obj in objects]
+
+
+# --- Fragments ---
+
+def _post_ready(post):
+    return not post.media_pending
+
+
+def _tile_data(post):
+    return {
+        'id': post.id,
+        'image_url': post.images.grid.url,
+        'image_avif_url': post.images.grid.avif,
+        'pending': post.media_pending,
+        'blurhash': post.blurhash,
+        'like_count': post.like_count,
+        'comment_count': post.comment_count,
+    }
+
+
+def tiles(posts):
+    """ Grid tile HTML per post, in order """
+    return _cached('tile', 'post', posts, lambda post: render_to_string('posts/includes/grid_tile.html', {'post': post}),
+                   _post_ready)
+
+
+def tiles_data(posts):
+    """ Grid tile JSON per post (infinite scroll), in order """
+    return _cached('tile_data', 'post', posts, _tile_data, _post_ready)
+
+
+def profile_header(user):
+    """
+    {'avatar': html, 'bio': html, 'posts_count': n, 'public_posts_count': n}
+    for a profile page. The author and followers see posts_count, everyone
+    else public_posts_count (posts/audience.py).
+    """
+    def render(user):
+        counts = Post.objects.live().filter(user=user).aggregate(
+            posts_count=Count('pk'), public_posts_count=Count('pk', filter=Q(is_public=True)))
+        return {
+            'avatar': render_to_string('accounts/includes/profile_avatar.html', {'profile_user': user}),
+            'bio': render_to_string('accounts/includes/profile_bio.html', {'profile_user': user}),
+            **counts,
+        }
+    # An avatar still being processed changes without a save()
+    return _cached('profile_header', 'user', [user], render,
+                   lambda user: user.profile_image_variants or not user.profile_image)[0]
+
+
+# --- Invalidation ---
+
+@receiver([post_save, post_delete], sender=Post)
+def _post_changed(sender, instance, **kwargs):
+    touch('post', instance.pk)
+    touch('user', instance.user_id)
+
+
+@receiver([post_save, post_delete], sender=Like)
+@receiver([post_save, post_delete], sender=Comment)
+def _counts_changed(sender, instance, **kwargs):
+    touch('post', instance.post_id)
+
+
+@receiver([post_save, post_delete], sender=User)
+def _user_changed(sender, instance, **kwargs):
+    touch('user', instance.pk)
@@ -0,0 +1,190 @@
+"""
+Resized, metadata-free variants of uploaded images.
+
+Every post image and avatar is decoded once on upload and written out at a
+few sizes, each as WebP plus AVIF when this Pillow build can encode it:
+
+    posts     thumb 160px   grid 640px   full 1080px   (longest edge)
+    avatars   thumb 96px    full 320px
+
+Pillow only writes EXIF/XMP to WebP and AVIF when asked, so the variants
+carry no camera or GPS metadata. The upload itself is replaced by the full
+WebP, so the stored `image` never has metadata either. What was written is
+recorded on the model as
+{variant: {'webp': name, 'avif': name or '', 'width': w, 'height': h}}.
+
+Post images also get a BlurHash placeholder (posts/blurhash.py).
+
+This runs in the media worker (posts/media_queue.py), not in the request;
+until then a post is `pending` and pages show a placeholder sized from
+`probe()`. Templates read `post.images.<variant>` / `user.avatars.<variant>`
+(see `variants()`), which fall back to the original file for rows that
+haven't been processed. `manage.py process_images` queues those.
+
+Deleting a post or user (directly, in the admin, or by cascade) releases
+its image and variants once the transaction commits, so the storage's
+reference counts drop and unshared files are removed.
+"""
+import io
+import os
+from types import SimpleNamespace
+from typing import NamedTuple
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import transaction
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+from PIL import ExifTags, Image, ImageOps, features
+
+from . import blurhash
+
+POST_VARIANTS = {'thumb': 160, 'grid': 640, 'full': 1080}
+AVATAR_VARIANTS = {'thumb': 96, 'full': 320}
+
+WEBP_QUALITY = 80
+AVIF_QUALITY = 55  # AVIF holds up at lower settings; ~same visual quality as WebP 80
+AVIF = features.check('avif')
+
+
+class Variant(NamedTuple):
+    url: str
+    avif: str  # '' when there is no AVIF copy
+    width: int = None
+    height: int = None
+
+
+def _encode(image, fmt, quality):
+    buffer = io.BytesIO()
+    image.save(buffer, fmt, quality=quality)
+    return buffer.getvalue()
+
+
+def probe(field):
+    """
+    (width, height) as displayed, read from the header of an upload that
+    hasn't been saved yet, without decoding the pixels. The upload is left
+    open and rewound so the model can still save it.
+    """
+    image = Image.open(field)
+    try:
+        width, height = image.size
+        # Orientations 5-8 are stored sideways
+        if image.getexif().get(ExifTags.Base.Orientation, 1) in (5, 6, 7, 8):
+            width, height = height, width
+    finally:
+        field.seek(0)
+    return width, height
+
+
+def _open(field):
+    """ Decode the upload once, upright (EXIF orientation applied) and in a mode WebP/AVIF can take """
+    field.open('rb')
+    try:
+        image = Image.open(field)
+        image = ImageOps.exif_transpose(image)
+        image.load()
+    finally:
+        field.close()
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    return image
+
+
+def generate(field, image, sizes):
+    """
+    Write the variants of `image` (decoded from `field`) and point the field
+    at the full WebP. Returns the variants dict to store on the model.
+    """
+    base, _ = os.path.splitext(field.name)
+    variants = {}
+    for name, size in sizes.items():
+        resized = image.copy()
+        resized.thumbnail((size, size), Image.Resampling.LANCZOS)  # Only ever shrinks
+        entry = {'width': resized.width, 'height': resized.height, 'avif': ''}
+        entry['webp'] = default_storage.save(f'{base}_{name}.webp',
+                                             ContentFile(_encode(resized, 'WEBP', WEBP_QUALITY)))
+        if AVIF:
+            entry['avif'] = default_storage.save(f'{base}_{name}.avif',
+                                                 ContentFile(_encode(resized, 'AVIF', AVIF_QUALITY)))
+        variants[name] = entry
+
+    # The original (with its metadata) is not kept; the largest variant takes its place
+    original = field.name
+    field.name = variants['full']['webp']
+    default_storage.delete(original)
+    return variants
+
+
+def delete(field, variants):
+    """
+    Release an image that is being replaced or removed: its variants, and
+    the field's own file unless it is the full variant (which generate()
+    points it at, sharing that file's single storage reference).
+    """
+    names = {name for entry in variants.values() for name in (entry.get('webp'), entry.get('avif')) if name}
+    if field and field.name not in names:
+        names.add(field.name)
+    for name in names:
+        default_storage.delete(name)
+
+
+def variants(field, data, names, fallback=''):
+    """
+    The Variant for each name as attributes (`.thumb`, `.grid`, ...), for
+    templates and views. Unprocessed images serve the original file for
+    every variant; missing images serve `fallback`.
+    """
+    if data:
+        return SimpleNamespace(**{
+            name: Variant(default_storage.url(entry['webp']),
+                          default_storage.url(entry['avif']) if entry.get('avif') else '',
+                          entry.get('width'), entry.get('height'))
+            for name, entry in data.items()
+        })
+    url = field.url if field else fallback
+    return SimpleNamespace(**{name: Variant(url, '') for name in names})
+
+
+# --- Models ---
+
+def process_post(post):
+    """ Generate a post's image variants and placeholder, save them with its dimensions and mark it ready """
+    if not post.image:
+        return
+    image = _open(post.image)
+    post.blurhash = blurhash.encode(image)
+    post.image_variants = generate(post.image, image, POST_VARIANTS)
+    full = post.image_variants['full']
+    post.image_width, post.image_height = full['width'], full['height']
+    post.media_state = 'ready'
+    type(post).objects.filter(pk=post.pk).update(image=post.image.name, image_variants=post.image_variants,
+                                                 image_width=post.image_width, image_height=post.image_height,
+                                                 blurhash=post.blurhash, media_state=post.media_state)
+
+
+def process_avatar(user):
+    """ Generate a user's avatar variants """
+    if not user.profile_image:
+        return
+    user.profile_image_variants = generate(user.profile_image, _open(user.profile_image), AVATAR_VARIANTS)
+    type(user).objects.filter(pk=user.pk).update(profile_image=user.profile_image.name,
+                                                 profile_image_variants=user.profile_image_variants)
+
+
+# --- Cleanup ---
+
+def _release(field, variants):
+    if field or variants:
+        transaction.on_commit(lambda: delete(field, variants))
+
+
+# Lazy senders: accounts.models imports this module
+@receiver(post_delete, sender='posts.Post')
+def _post_deleted(sender, instance, **kwargs):
+    _release(instance.image, instance.image_variants)
+
+
+@receiver(post_delete, sender='accounts.User')
+def _user_deleted(sender, instance, **kwargs):
+    _release(instance.profile_image, instance.profile_image_variants)
@@ -0,0 +1,50 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from accounts.models import User
+from posts.models import Post
+from posts.storage import is_content_addressed
+
+
+def readdress(name, stats):
+    """ Re-save a file stored before posts.storage under its content hash; returns the new name """
+    if name in stats['moved']:  # A processed image's field and its full variant are the same file
+        return stats['moved'][name]
+    if not name or is_content_addressed(name) or not default_storage.exists(name):
+        return name
+    with default_storage.open(name) as f:
+        new_name = default_storage.save(name, f)
+    stats['bytes'] += default_storage.size(name)
+    default_storage.delete(name)
+    stats['moved'][name] = new_name
+    return new_name
+
+
+def readdress_variants(variants, stats):
+    return {
+        variant: {**entry, 'webp': readdress(entry.get('webp'), stats), 'avif': readdress(entry.get('avif'), stats)}
+        for variant, entry in variants.items()
+    }
+
+
+class Command(BaseCommand):
+    help = "Move media saved under timestamp/uuid names to content-hash names, merging duplicate files"
+
+    def handle(self, *args, **options):
+        stats = {'moved': {}, 'bytes': 0}
+
+        for post in Post.objects.exclude(Q(image='') | Q(image__isnull=True)).iterator():
+            image, variants = readdress(post.image.name, stats), readdress_variants(post.image_variants, stats)
+            if image != post.image.name or variants != post.image_variants:
+                Post.objects.filter(pk=post.pk).update(image=image, image_variants=variants)
+
+        for user in User.objects.exclude(Q(profile_image='') | Q(profile_image__isnull=True)).iterator():
+            image = readdress(user.profile_image.name, stats)
+            variants = readdress_variants(user.profile_image_variants, stats)
+            if image != user.profile_image.name or variants != user.profile_image_variants:
+                User.objects.filter(pk=user.pk).update(profile_image=image, profile_image_variants=variants)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Moved {len(stats['moved'])} file(s) ({stats['bytes'] / 1024 / 1024:.1f} MB before deduplication)"
+        ))
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from posts import expiry
+
+
+class Command(BaseCommand):
+    help = "Deactivate temporary posts whose expires_at has passed"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=expiry.BATCH_SIZE, help="Posts per UPDATE")
+        parser.add_argument('--loop', action='store_true', help="Keep running and sweep every --interval seconds")
+        parser.add_argument('--interval', type=int, default=60, help="Seconds between sweeps with --loop")
+
+    def handle(self, *args, **options):
+        while True:
+            count = expiry.expire_due_posts(batch_size=options['batch_size'])
+            if count or not options['loop']:
+                self.stdout.write(f"Expired {count} post(s).")
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
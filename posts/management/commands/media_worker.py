@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts import media_queue
+
+
+class Command(BaseCommand):
+    help = "Process queued post images and avatars (resize, transcode, blurhash) in a process pool"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=None,
+                            help="Pool size (default: one per CPU core; 0 runs jobs in this process)")
+        parser.add_argument('--once', action='store_true', help="Exit when the queue is empty")
+
+    def handle(self, *args, **options):
+        handled = media_queue.work(options['processes'], once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f"Handled {handled} media job(s)"))
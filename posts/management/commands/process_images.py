@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Q
+
+from accounts.models import User
+from posts import media_queue
+from posts.models import Post, MediaJob
+
+
+class Command(BaseCommand):
+    help = "Queue resized WebP/AVIF variants for post images and avatars uploaded before the pipeline"
+
+    def handle(self, *args, **options):
+        queued = set(MediaJob.objects.values_list('kind', 'object_id'))
+        posts = Post.objects.exclude(Q(image='') | Q(image__isnull=True)).filter(image_variants={})
+        avatars = User.objects.exclude(Q(profile_image='') | Q(profile_image__isnull=True))\
+                              .filter(profile_image_variants={})
+
+        with transaction.atomic():
+            post_ids = [pk for pk in posts.values_list('pk', flat=True) if ('post', pk) not in queued]
+            Post.objects.filter(pk__in=post_ids).update(media_state='pending')
+            MediaJob.objects.bulk_create([MediaJob(kind='post', object_id=pk) for pk in post_ids])
+            user_ids = [pk for pk in avatars.values_list('pk', flat=True) if ('avatar', pk) not in queued]
+            MediaJob.objects.bulk_create([MediaJob(kind='avatar', object_id=pk) for pk in user_ids])
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Queued {len(post_ids)} post image(s) and {len(user_ids)} avatar(s); run `manage.py media_worker`"
+        ))
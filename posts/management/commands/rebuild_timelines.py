@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import User
+from posts import timeline
+
+
+class Command(BaseCommand):
+    help = "Rebuild materialized home timelines from the follow graph"
+
+    def add_arguments(self, parser):
+        parser.add_argument('usernames', nargs='*', help="Only rebuild these users (default: everyone)")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['usernames']:
+            users = users.filter(username__in=options['usernames'])
+
+        count = 0
+        for user in users.iterator():
+            timeline.rebuild_for_user(user)
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {count} timeline(s)."))
@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from accounts.models import User, Follow
+from posts.models import Post, Like, Comment, SavedPost
+
+
+def _count_of(model, fk):
+    """ Correlated COUNT(*) of `model` rows pointing at the outer row through `fk` """
+    rows = model.objects.filter(**{fk: OuterRef('pk')}).order_by().values(fk)
+    return Coalesce(Subquery(rows.annotate(c=Count('pk')).values('c'), output_field=IntegerField()), 0)
+
+
+# (model, counter field, source model, fk on source pointing at model)
+COUNTERS = [
+    (Post, 'like_count', Like, 'post'),
+    (Post, 'comment_count', Comment, 'post'),
+    (Post, 'save_count', SavedPost, 'post'),
+    (User, 'followers_count', Follow, 'following'),
+    (User, 'following_count', Follow, 'follower'),
+]
+
+
+class Command(BaseCommand):
+    help = "Recompute denormalized like/comment/save/follow counters and fix any drift"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000, help="Rows per UPDATE (by primary key range)")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+
+        for model, field, source, fk in COUNTERS:
+            fixed = 0
+            last_pk = model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0
+            for start in range(0, last_pk + 1, batch_size):
+                actual = _count_of(source, fk)
+                with transaction.atomic():
+                    # Only rows whose stored value differs are rewritten
+                    fixed += model.objects.filter(pk__gte=start, pk__lt=start + batch_size)\
+                                          .annotate(actual=actual)\
+                                          .exclude(**{field: F('actual')})\
+                                          .update(**{field: _count_of(source, fk)})
+            self.stdout.write(f"{model.__name__}.{field}: {fixed} row(s) corrected")
+
+        self.stdout.write(self.style.SUCCESS("Counters reconciled."))
@@ -0,0 +1,27 @@
+"""
+Entry points for the media worker's pool processes (posts/media_queue.py).
+
+Pool processes are spawned, and a spawned process unpickles the function it
+is given before anything has called django.setup(), so this module must not
+import models at load time.
+"""
+import os
+import traceback
+
+import django
+
+
+def setup():
+    """ Pool initializer """
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'qwik.settings')
+    django.setup()
+
+
+def run_safely(kind, object_id):
+    """ media_queue.run(); errors come back as text, since not every exception pickles """
+    from .media_queue import run
+    try:
+        run(kind, object_id)
+    except Exception:
+        return traceback.format_exc()
+    return None
@@ -0,0 +1,123 @@
+"""
+Background image processing, so no request waits on a decode/encode.
+
+    create_post_view    saves the upload, marks the post `pending` and
+                        queues a MediaJob in the same transaction
+    edit_profile_view   queues an avatar job the same way
+    media_worker        claims due jobs and runs posts.images on them in a
+                        process pool (one process per core by default)
+
+The queue is the posts_mediajob table. Workers claim a batch with SELECT
+... FOR UPDATE SKIP LOCKED, so any number of them, on any number of hosts,
+can share it without handing out a job twice. Claiming sets `available_at`
+to now + LEASE. A job whose worker died is picked up again when the lease
+runs out. A finished job is deleted. A job that fails is retried with
+backoff, and after MAX_ATTEMPTS it is kept as `failed` with its error and
+the post falls back to its original file.
+
+Pages poll `posts:media_status` for pending posts and swap the placeholder
+for the real image once it is ready (templates/includes/media.html).
+"""
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from multiprocessing import get_context
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from accounts.models import User
+from .models import Post, MediaJob
+from . import images, media_pool
+
+LEASE = settings.MEDIA_JOB_LEASE
+MAX_ATTEMPTS = settings.MEDIA_JOB_MAX_ATTEMPTS
+RETRY_DELAY = 30  # Seconds before the first retry; doubles per attempt
+POLL_INTERVAL = 1.0  # Seconds between claims while the queue is empty
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(kind, object_id):
+    """ Queue work for a post ('post') or a user's avatar ('avatar'); call inside the saving transaction """
+    MediaJob.objects.create(kind=kind, object_id=object_id)
+
+
+def claim(limit):
+    """ Lease up to `limit` due jobs to this worker """
+    now = timezone.now()
+    with transaction.atomic():
+        jobs = list(MediaJob.objects.select_for_update(skip_locked=True)
+                                    .filter(state__in=['queued', 'running'], available_at__lte=now)
+                                    .order_by('available_at')[:limit])
+        MediaJob.objects.filter(pk__in=[job.pk for job in jobs])\
+                        .update(state='running', attempts=F('attempts') + 1, available_at=now + timedelta(seconds=LEASE))
+    return jobs
+
+
+def run(kind, object_id):
+    """ Do one job (in a pool process). Objects deleted or already processed in the meantime are skipped """
+    if kind == 'post':
+        post = Post.objects.filter(pk=object_id).first()
+        if post is not None and post.media_pending:
+            images.process_post(post)
+    elif kind == 'avatar':
+        user = User.objects.filter(pk=object_id).first()
+        if user is not None and not user.profile_image_variants:
+            images.process_avatar(user)
+
+
+def finish(job, error=None):
+    """ Record the outcome of a claimed job """
+    if error is None:
+        MediaJob.objects.filter(pk=job.pk).delete()
+        return
+    attempts = job.attempts + 1  # claim() incremented the row, not this instance
+    if attempts >= MAX_ATTEMPTS:
+        logger.error("Media job %s failed for good: %s", job, error)
+        MediaJob.objects.filter(pk=job.pk).update(state='failed', error=error)
+        if job.kind == 'post':
+            Post.objects.filter(pk=job.object_id, media_state='pending').update(media_state='failed')
+    else:
+        logger.warning("Media job %s failed (attempt %d), retrying: %s", job, attempts, error)
+        retry_at = timezone.now() + timedelta(seconds=RETRY_DELAY * 2 ** (attempts - 1))
+        MediaJob.objects.filter(pk=job.pk).update(state='queued', available_at=retry_at, error=error)
+
+
+def work(processes=None, once=False):
+    """
+    Claim and process jobs until stopped (or, with `once`, until the queue
+    is empty). processes=0 runs jobs in this process. Returns jobs handled.
+    """
+    processes = os.cpu_count() if processes is None else processes
+    # Spawned, not forked: a forked child would share this process's database connection
+    pool = ProcessPoolExecutor(processes, mp_context=get_context('spawn'), initializer=media_pool.setup) \
+        if processes else None
+    handled = 0
+    try:
+        while True:
+            jobs = claim(max(processes, 1) * 2)
+            if not jobs:
+                if once:
+                    return handled
+                time.sleep(POLL_INTERVAL)
+                continue
+            if pool is None:
+                for job in jobs:
+                    finish(job, media_pool.run_safely(job.kind, job.object_id))
+            else:
+                futures = {pool.submit(media_pool.run_safely, job.kind, job.object_id): job for job in jobs}
+                for future in as_completed(futures):
+                    try:
+                        error = future.result()
+                    except Exception as e:  # The pool process itself died (e.g. killed by the OOM killer)
+                        error = repr(e)
+                    finish(futures[future], error)
+            handled += len(jobs)
+    finally:
+        if pool is not None:
+            pool.shutdown()
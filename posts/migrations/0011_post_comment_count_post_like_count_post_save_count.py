@@ -0,0 +1,42 @@
+# Generated by Django 5.2.8 on 2026-10-18 00:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0010_timelineentry"),
+        ("accounts", "0007_user_followers_count_user_following_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="post",
+            name="comment_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="like_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="save_count",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        # Seed the new counters from existing rows
+        migrations.RunSQL(
+            """
+            UPDATE posts SET
+                like_count = (SELECT COUNT(*) FROM posts_like WHERE post_id = posts.id),
+                comment_count = (SELECT COUNT(*) FROM posts_comment WHERE post_id = posts.id),
+                save_count = (SELECT COUNT(*) FROM posts_savedpost WHERE post_id = posts.id);
+            UPDATE users SET
+                followers_count = (SELECT COUNT(*) FROM accounts_follow WHERE following_id = users.id),
+                following_count = (SELECT COUNT(*) FROM accounts_follow WHERE follower_id = users.id);
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 00:30
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("posts", "0011_post_comment_count_post_like_count_post_save_count"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("expires_at__isnull", False), ("is_active", True)),
+                fields=["expires_at"],
+                name="post_pending_expiry_idx",
+            ),
+        ),
+    ]
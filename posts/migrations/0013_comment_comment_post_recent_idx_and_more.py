@@ -0,0 +1,79 @@
+# Generated by Django 5.2.8 on 2026-10-18 00:31
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction, and avoids
+    # locking the tables for writes while the indexes build
+    atomic = False
+
+    dependencies = [
+        ("posts", "0012_post_pending_expiry_idx"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="comment",
+            index=models.Index(
+                fields=["post", "-created_at"], name="comment_post_recent_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="comment",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="comment_user_recent_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="like",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="like_user_recent_idx"
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                fields=["is_active", "-created_at", "-id"],
+                name="post_active_recent_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                fields=["visibility", "is_active", "-created_at", "-id"],
+                name="post_explore_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                fields=["user", "is_active", "-created_at", "-id"],
+                name="post_user_recent_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                fields=["user", "is_archived", "-created_at", "-id"],
+                name="post_user_archived_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                condition=models.Q(("is_flagged", True)),
+                fields=["-created_at"],
+                name="post_flagged_idx",
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="savedpost",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="saved_user_recent_idx"
+            ),
+        ),
+    ]
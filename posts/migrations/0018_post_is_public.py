@@ -0,0 +1,46 @@
+# Generated by Django 5.2.8 on 2026-10-18 01:44
+
+from django.conf import settings
+from django.contrib.postgres.operations import (
+    AddIndexConcurrently,
+    RemoveIndexConcurrently,
+)
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # The explore index is swapped with (DROP|CREATE) INDEX CONCURRENTLY, which
+    # can't run inside a transaction, so posts stay writable while it builds
+    atomic = False
+
+    dependencies = [
+        ("posts", "0017_storedfile"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        RemoveIndexConcurrently(
+            model_name="post",
+            name="post_explore_idx",
+        ),
+        migrations.AddField(
+            model_name="post",
+            name="is_public",
+            field=models.BooleanField(default=True),
+        ),
+        # Seed from the post's visibility and its author's privacy
+        migrations.RunSQL(
+            """
+            UPDATE posts SET is_public = (posts.visibility = 'public' AND NOT users.is_private)
+            FROM users WHERE users.id = posts.user_id;
+            """,
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        AddIndexConcurrently(
+            model_name="post",
+            index=models.Index(
+                fields=["is_public", "is_active", "-created_at", "-id"],
+                name="post_explore_idx",
+            ),
+        ),
+    ]
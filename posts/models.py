@@ -1,45 +1,75 @@
 from typing import Any
 from django.db import models
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVector
 from django.utils import timezone
+from django.utils.functional import cached_property
 from datetime import timedelta
-from accounts.models import User
+from accounts.models import User, Follow
+from . import images
 import os
-import uuid
 
 def qwip_file_name(instance, filename):
-    # Get the file extension (e.g., .jpg, .png)
+    # Only the extension is kept: the storage names the file after its
+    # content hash (posts/storage.py), so identical uploads share one file
     ext = filename.split('.')[-1]
-    
-    # Generate a unique filename
-    # Format: qwip_YYYYMMDD_UUID(first 8 chars).ext
-    # Example: qwip_20231025_a1b2c3d4.jpg
-    current_time = timezone.now().strftime("%Y%m%d")
-    unique_id = uuid.uuid4().hex[:8]
-    new_filename = f"qwip_{current_time}_{unique_id}.{ext}"
-    
-    # Return the full path: qwips/new_filename.jpg
-    return os.path.join('qwips', new_filename)
+    return os.path.join('qwips', f'qwip.{ext}')
+
+class PostQuerySet(models.QuerySet):
+    def live(self):
+        """
+        Active posts that have not expired yet. The expires_at guard keeps
+        results correct between `expire_posts` sweeps.
+        """
+        return self.filter(is_active=True).filter(
+            models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now())
+        )
+
+    def visible_to(self, viewer):
+        """ Posts `viewer` may see, as one predicate (see posts/audience.py) """
+        if not viewer.is_authenticated:
+            return self.filter(is_public=True)
+        if viewer.is_portal_admin:
+            return self.all()
+        follows_author = Follow.objects.filter(follower_id=viewer.pk, following_id=models.OuterRef('user_id'))
+        return self.filter(models.Q(is_public=True) | models.Q(user_id=viewer.pk) | models.Exists(follows_author))
 
 class Post(models.Model):
     MEDIA_TYPE_CHOICES = [('image', 'Image'), ('video', 'Video'), ('text', 'Text')]
     POST_TYPE_CHOICES = [('temporary', 'Temporary'), ('permanent', 'Permanent')]
     
     VISIBILITY_CHOICES = [('public', 'Public'), ('private', 'Friends Only')]
+    MEDIA_STATE_CHOICES = [('pending', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')]
 
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     caption = models.TextField()
     image = models.ImageField(upload_to=qwip_file_name, null=True, blank=True)
+    # Resized WebP/AVIF copies written by posts.images; dimensions are the full variant's
+    image_variants = models.JSONField(default=dict, blank=True)
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    # Set by the media worker (posts.media_queue); pending posts show a placeholder
+    media_state = models.CharField(max_length=10, choices=MEDIA_STATE_CHOICES, default='ready')
+    blurhash = models.CharField(max_length=64, blank=True, default='')
     
     media_type = models.CharField(max_length=10, choices=MEDIA_TYPE_CHOICES, default='image')
     post_type = models.CharField(max_length=15, choices=POST_TYPE_CHOICES, default='temporary')
     
     visibility = models.CharField(max_length=10, choices=VISIBILITY_CHOICES, default='public')
+    # visibility == 'public' and the author's account isn't private; kept by save() and audience.sync_author()
+    is_public = models.BooleanField(default=True)
     is_archived = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     expires_at = models.DateTimeField(null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     is_flagged = models.BooleanField(default=False)
+
+    # Denormalized counters, kept in step with F() updates in posts.views
+    # (repair drift with `manage.py reconcile_counters`)
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+    save_count = models.PositiveIntegerField(default=0)
     
     # Deletion tracking: if deleted_by is None, user deleted it; if set, admin deleted it
     deleted_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='posts_deleted')
@@ -55,18 +85,49 @@ class Post(models.Model):
 
         if self.expires_at and self.expires_at < timezone.now():
             self.is_active = False
+
+        self.is_public = self.visibility == 'public' and not self.user.is_private
             
         super().save(*args, **kwargs)
 
+    objects = PostQuerySet.as_manager()
+
     likes: Any 
     comments: Any
 
+    @property
+    def media_pending(self):
+        return self.media_state == 'pending'
+
+    @cached_property
+    def images(self):
+        """ images.Variant per size: `post.images.thumb`, `.grid`, `.full` """
+        return images.variants(self.image, self.image_variants, images.POST_VARIANTS)
+
     def __str__(self):
         return f"{self.user.username}'s Qwip"
         # return f"{self.user.username}'s Qwip ({self.visibility})"
 
     class Meta:
         db_table = 'posts'
+        indexes = [
+            # Feed/grid reads: filters first, then the (created_at, id) keyset order
+            models.Index(fields=['is_active', '-created_at', '-id'], name='post_active_recent_idx'),
+            models.Index(fields=['is_public', 'is_active', '-created_at', '-id'], name='post_explore_idx'),
+            models.Index(fields=['user', 'is_active', '-created_at', '-id'], name='post_user_recent_idx'),
+            # Settings recycle bin / admin-removed tabs
+            models.Index(fields=['user', 'is_archived', '-created_at', '-id'], name='post_user_archived_idx'),
+            # Admin dashboard and "flagged" filter
+            models.Index(fields=['-created_at'], condition=models.Q(is_flagged=True), name='post_flagged_idx'),
+            # Full-text caption search (posts.search.CAPTION_VECTOR)
+            GinIndex(SearchVector('caption', config='simple'), name='post_caption_search_idx'),
+            # Only live temporary posts are waiting to expire, so the sweep index stays small
+            models.Index(
+                fields=['expires_at'],
+                condition=models.Q(is_active=True, expires_at__isnull=False),
+                name='post_pending_expiry_idx',
+            ),
+        ]
 
 class Like(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
@@ -76,6 +137,9 @@ class Like(models.Model):
     class Meta:
         # A user can only like a post once
         unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='like_user_recent_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} liked {self.post.pk}"
@@ -86,6 +150,12 @@ class Comment(models.Model):
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['post', '-created_at'], name='comment_post_recent_idx'),
+            models.Index(fields=['user', '-created_at', '-id'], name='comment_user_recent_idx'),
+        ]
+
     def __str__(self):
         return f"{self.user.username} on {self.post.pk}"
     
@@ -97,6 +167,72 @@ class SavedPost(models.Model):
     class Meta:
         # A user can only save a specific post once
         unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'], name='saved_user_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} saved {self.post.pk}"
+
+
+class TimelineEntry(models.Model):
+    """
+    One row per (reader, post) in a user's materialized home timeline.
+    Rows are pushed by posts.timeline when a post is created or a follow
+    starts, and removed when the post goes away or the follow ends.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='timeline_entries')
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='timeline_entries')
+    # Copy of post.created_at so the feed can be read from this table's index alone
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'post')
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-post'], name='timeline_user_recent_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} <- {self.post.pk}"
+
+
+class MediaJob(models.Model):
+    """
+    Queued image work for the media worker (posts.media_queue). A job is
+    claimed by pushing `available_at` out by the lease; a worker that dies
+    mid-job leaves it to be claimed again once the lease runs out.
+    """
+    KIND_CHOICES = [('post', 'Post image'), ('avatar', 'Avatar')]
+    STATE_CHOICES = [('queued', 'Queued'), ('running', 'Running'), ('failed', 'Failed')]
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.PositiveIntegerField()
+    state = models.CharField(max_length=10, choices=STATE_CHOICES, default='queued')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Claim query: due jobs, oldest first; failed jobs stay out of the index
+            models.Index(fields=['available_at'], condition=models.Q(state__in=['queued', 'running']),
+                         name='mediajob_due_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id} ({self.state})"
+
+
+class StoredFile(models.Model):
+    """
+    One content-addressed media file (posts.storage) and how many saved
+    names point at it. The file is removed when the count reaches zero.
+    """
+    name = models.CharField(max_length=255, primary_key=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
-        return f"{self.user.username} saved {self.post.pk}"
\ No newline at end of file
+        return f"{self.name} (x{self.refcount})"
@@ -0,0 +1,73 @@
+"""
+Keyset (cursor) pagination on (created_at, id).
+
+Each page is fetched with "WHERE (created_at, id) < cursor ORDER BY
+created_at DESC, id DESC LIMIT n + 1", so a page never counts the table or
+skips rows with OFFSET, and deep pages cost the same as the first one.
+Cursors are opaque url-safe tokens; clients just echo back next_cursor.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+PAGE_SIZE = 12
+
+
+def encode_cursor(created_at, pk):
+    raw = f"{created_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """ Returns (created_at, pk) or None if the token is missing or malformed """
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        created_at, pk = raw.split('|')
+        return datetime.fromisoformat(created_at), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def before(position, date_field='created_at', pk_field='id'):
+    """ Q object for rows that sort strictly after `position` in newest-first order """
+    created_at, pk = position
+    return Q(**{f'{date_field}__lt': created_at}) | Q(**{date_field: created_at, f'{pk_field}__lt': pk})
+
+
+class KeysetPage:
+    """ One page of results; iterates like a list and exposes has_next / next_cursor """
+
+    def __init__(self, items, next_cursor):
+        self.object_list = items
+        self.next_cursor = next_cursor
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __bool__(self):
+        return bool(self.object_list)
+
+
+def paginate(queryset, cursor=None, page_size=PAGE_SIZE, date_field='created_at'):
+    """ Newest-first page of `queryset` starting after `cursor` """
+    position = decode_cursor(cursor)
+    if position:
+        queryset = queryset.filter(before(position, date_field, 'pk'))
+
+    items = list(queryset.order_by(f'-{date_field}', '-pk')[:page_size + 1])
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor(getattr(last, date_field), last.pk)
+    return KeysetPage(items, next_cursor)
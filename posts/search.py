@@ -0,0 +1,96 @@
+"""
+Search for people and posts, shared by explore, the live user search boxes
+(accounts and chats) and the admin lists.
+
+- Users are matched with icontains against trigram GIN indexes (pg_trgm)
+  on UPPER(field), so substring search no longer scans the users table. Queries shorter than
+  three characters only match prefixes, which the same indexes serve.
+  Results are ranked: exact username, username prefix, name prefix, then
+  trigram similarity.
+- Post captions are matched with full-text search on a GIN-indexed
+  to_tsvector('simple', caption); every word is a prefix (`word:*`) so
+  type-ahead works. Posts by users whose username matches are included too.
+  A query without any word characters (only punctuation or emoji) has no
+  words to search for and matches nothing, unless the caller asks for the
+  unindexed caption substring match (the admin posts list does).
+"""
+import re
+
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector, TrigramSimilarity
+from django.db.models import Case, FloatField, IntegerField, Q, Value, When
+
+from accounts.models import User
+
+USER_FIELDS = ('username', 'first_name', 'last_name')
+MIN_SUBSTRING_LENGTH = 3  # Trigrams need 3 characters; shorter queries match prefixes only
+SEARCH_CONFIG = 'simple'
+MAX_AUTHORS = 100  # Username matches whose posts are pulled into a post search
+
+# Must match the expression of posts.Post's post_caption_search_idx
+CAPTION_VECTOR = SearchVector('caption', config=SEARCH_CONFIG)
+
+
+def _user_filter(query, fields):
+    lookup = 'icontains' if len(query) >= MIN_SUBSTRING_LENGTH else 'istartswith'
+    condition = Q()
+    for field in fields:
+        condition |= Q(**{f'{field}__{lookup}': query})
+    return condition
+
+
+def search_users(query, users=None, fields=USER_FIELDS):
+    """
+    Ranked users matching `query`. Defaults to regular (non-staff) accounts;
+    pass `users` to search a different base queryset.
+    """
+    query = query.strip()
+    if users is None:
+        users = User.objects.exclude(is_staff=True).exclude(is_superuser=True)
+    if not query:
+        return users.none()
+
+    name_prefix = Q()
+    for field in fields:
+        if field != 'username':
+            name_prefix |= Q(**{f'{field}__istartswith': query})
+
+    return users.filter(_user_filter(query, fields)).annotate(
+        match=Case(
+            When(username__iexact=query, then=Value(3)),
+            When(username__istartswith=query, then=Value(2)),
+            When(name_prefix, then=Value(1)),
+            default=Value(0),
+            output_field=IntegerField(),
+        ),
+        similarity=TrigramSimilarity('username', query),
+    ).order_by('-match', '-similarity', 'username')
+
+
+def _prefix_query(query):
+    """ 'sun set' -> to_tsquery('sun:* & set:*'), or None if there are no words """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return None
+    return SearchQuery(' & '.join(f'{w}:*' for w in words), search_type='raw', config=SEARCH_CONFIG)
+
+
+def search_posts(posts, query, substring_fallback=False):
+    """
+    Narrow the `posts` queryset to captions or poster usernames matching
+    `query`, annotated with a full-text `rank`. Ordering is left to the caller.
+    With `substring_fallback`, a query with no words matches captions that
+    contain it (rank 0); no index serves that, so keep it to small lists.
+    """
+    query = query.strip()
+    ts_query = _prefix_query(query)
+    if ts_query is None:
+        if substring_fallback and query:
+            return posts.filter(caption__icontains=query).annotate(rank=Value(0.0, output_field=FloatField()))
+        return posts.none()
+
+    # Resolved up front so the planner can BitmapOr the caption index with the author index
+    authors = list(User.objects.filter(_user_filter(query, ('username',)))
+                               .values_list('pk', flat=True)[:MAX_AUTHORS])
+    return posts.annotate(search=CAPTION_VECTOR)\
+                .filter(Q(search=ts_query) | Q(user_id__in=authors))\
+                .annotate(rank=SearchRank(CAPTION_VECTOR, ts_query))
@@ -0,0 +1,97 @@
+"""
+Content-addressed media storage (the default storage, see STORAGES).
+
+Every file is named after the SHA-256 of its bytes:
+
+    blobs/3f/a9/3fa9...e1.webp
+
+The upload is hashed while it streams to a temp file, which is then moved
+into place, or just dropped when the same bytes are already stored. So an
+identical re-upload costs no disk, and two saves can never pick the same
+name for different content.
+
+Several rows can point at one file (two posts of the same photo, identical
+variants), so each file has a StoredFile row counting its references:
+save() adds one, delete() removes one and only removes the file with the
+last. Names never change meaning, which is what lets media be served with
+`Cache-Control: immutable` (MEDIA_CACHE_MAX_AGE).
+
+Files saved before this storage (not under blobs/) are deleted directly;
+`manage.py content_address_media` moves them over.
+"""
+import hashlib
+import os
+import re
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from .models import StoredFile
+
+PREFIX = 'blobs'
+CHUNK_SIZE = 64 * 1024
+EXTENSION = re.compile(r'^\.[a-z0-9]{1,5}$')
+
+
+def is_content_addressed(name):
+    return bool(name) and name.startswith(PREFIX + '/')
+
+
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        return name  # _save() derives the real name from the content
+
+    def _save(self, name, content):
+        ext = os.path.splitext(name)[1].lower()
+        ext = ext if EXTENSION.match(ext) else ''
+
+        # 1. Stream to a temp file (on the same filesystem, so the move is a rename), hashing as we go
+        tmp_dir = self.path('tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        digest, size = hashlib.sha256(), 0
+        try:
+            with os.fdopen(fd, 'wb') as tmp:
+                for chunk in content.chunks(CHUNK_SIZE):
+                    if isinstance(chunk, str):
+                        chunk = chunk.encode()
+                    digest.update(chunk)
+                    tmp.write(chunk)
+                    size += len(chunk)
+
+            digest = digest.hexdigest()
+            name = f'{PREFIX}/{digest[:2]}/{digest[2:4]}/{digest}{ext}'
+
+            # 2. Take a reference. The row lock orders us against a delete() of the same file
+            with transaction.atomic():
+                StoredFile.objects.select_for_update().get_or_create(name=name, defaults={'size': size})
+                StoredFile.objects.filter(name=name).update(refcount=F('refcount') + 1)
+
+                # 3. First copy of these bytes: move it into place
+                full_path = self.path(name)
+                if not os.path.exists(full_path):
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(tmp_path, full_path)
+                    tmp_path = None
+                    # mkstemp() creates owner-only files; the web server has to read these
+                    os.chmod(full_path, self.file_permissions_mode or 0o644)
+        finally:
+            if tmp_path is not None:
+                os.unlink(tmp_path)
+        return name
+
+    def delete(self, name):
+        """ Drop one reference; the file goes with the last one """
+        if not is_content_addressed(name):
+            return super().delete(name)
+        with transaction.atomic():
+            stored = StoredFile.objects.select_for_update().filter(name=name).first()
+            if stored is not None and stored.refcount > 1:
+                StoredFile.objects.filter(name=name).update(refcount=F('refcount') - 1)
+                return
+            if stored is not None:
+                stored.delete()
+            super().delete(name)
@@ -1,3 +1,676 @@
-from django.test import TestCase
+import hashlib
+import io
+import json
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Q
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from accounts.models import User, Follow, PasswordResetOTP
+from accounts import follow_graph
+from chats.models import Thread, Message
+from .models import Post, Like, Comment, SavedPost, TimelineEntry, MediaJob, StoredFile
+from .search import search_users, search_posts
+from . import images, media_queue, audience, fragments, timeline, expiry
+from .views import media_file_view
+from .pagination import paginate, encode_cursor
+
+
+def _seq_scans(plan):
+    """ Names of relations read with a sequential scan anywhere in an EXPLAIN (FORMAT JSON) plan """
+    found = []
+    if plan.get('Node Type') == 'Seq Scan':
+        found.append(plan.get('Relation Name'))
+    for child in plan.get('Plans', []):
+        found += _seq_scans(child)
+    return found
+
+
+@skipUnless(connection.vendor == 'postgresql', "Query plans are PostgreSQL specific")
+class HotQueryPlanTests(TestCase):
+    """
+    Every hot query from posts, accounts, chats and custom_admin must be
+    answerable from an index. Seq scans are disabled for the planner, so a
+    query only ends up with one if no usable index exists.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f'user{i}', f'user{i}@example.com', 'pw') for i in range(20)]
+        me, other = cls.users[0], cls.users[1]
+        for author in cls.users:
+            for i in range(10):
+                post = Post.objects.create(user=author, caption=f'caption {i}', post_type='temporary')
+                TimelineEntry.objects.create(user=me, post=post, created_at=post.created_at)
+                Like.objects.create(user=me, post=post)
+                SavedPost.objects.create(user=me, post=post)
+                Comment.objects.create(user=me, post=post, text='nice')
+        for u in cls.users[1:]:
+            Follow.objects.create(follower=me, following=u)
+            Follow.objects.create(follower=u, following=me)
+        thread = Thread.objects.create(first_user=me, second_user=other)
+        for i in range(50):
+            Message.objects.create(thread=thread, sender=other if i % 2 else me, text='hi')
+        PasswordResetOTP.objects.create(user=me, otp_code='123456')
+
+        cls.me, cls.other, cls.thread = me, other, thread
+        cls.post = Post.objects.filter(user=other).first()
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        with connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+
+    def assertIndexed(self, queryset):
+        plan = json.loads(queryset.explain(format='json'))[0]['Plan']
+        self.assertEqual(_seq_scans(plan), [], f"Sequential scan in plan for:\n{queryset.query}")
+
+    def hot_queries(self):
+        me, other, thread, post = self.me, self.other, self.thread, self.post
+        now = timezone.now()
+        since = now - timedelta(hours=1)
+        return {
+            # posts.timeline / posts.views
+            'home timeline': TimelineEntry.objects.filter(user=me, post__is_active=True)
+                                                  .filter(Q(post__expires_at__isnull=True) | Q(post__expires_at__gt=now))
+                                                  .order_by('-created_at', '-post_id')[:11],
+            'home pulled authors': Post.objects.live().filter(user_id__in=[other.pk]).order_by('-created_at', '-id')[:11],
+            'explore': Post.objects.live().filter(is_public=True).order_by('-created_at', '-id')[:13],
+            'explore next page': Post.objects.live().filter(is_public=True)
+                                             .filter(Q(created_at__lt=since) | Q(created_at=since, id__lt=10 ** 6))
+                                             .order_by('-created_at', '-id')[:13],
+            'post comments': Comment.objects.filter(post=post).order_by('-created_at'),
+            # posts.search
+            'search users': search_users('ser1')[:8],
+            'search users prefix': search_users('us')[:8],
+            'search posts': search_posts(Post.objects.live().filter(is_public=True), 'capt')
+                                        .order_by('-created_at', '-id')[:13],
+            'admin search users': search_users('example', users=User.objects.all(), fields=('username', 'email')),
+            'expiry sweep': Post.objects.filter(is_active=True, expires_at__lte=now).order_by('expires_at')[:500],
+            # accounts.views
+            'profile grid': Post.objects.live().filter(user=other).visible_to(me).order_by('-created_at', '-id')[:13],
+            'is following': Follow.objects.filter(follower=me, following=other),
+            'followers list': Follow.objects.filter(following=other).order_by('-created_at'),
+            'settings my posts': Post.objects.live().filter(user=me, is_archived=False).order_by('-created_at', '-id')[:13],
+            'settings recycle bin': Post.objects.filter(user=me, is_archived=True, deleted_by__isnull=True)
+                                                .order_by('-created_at', '-id')[:13],
+            'settings likes': Like.objects.filter(user=me, post__is_active=True).order_by('-created_at', '-id')[:13],
+            'settings comments': Comment.objects.filter(user=me, post__is_active=True).order_by('-created_at', '-id')[:13],
+            'settings saved': SavedPost.objects.filter(user=me).order_by('-created_at', '-id')[:13],
+            'verify otp': PasswordResetOTP.objects.filter(user=me, otp_code='123456').order_by('-pk')[:1],
+            # chats.views
+            'inbox threads': Thread.objects.filter(Q(first_user=me) | Q(second_user=me), last_message_at__isnull=False)
+                                           .order_by('-last_message_at', '-id')[:21],
+            'chat room thread': Thread.objects.filter(Q(first_user=me, second_user=other) | Q(first_user=other, second_user=me)),
+            'last message': Message.objects.filter(thread=thread).order_by('-timestamp')[:1],
+            'unread count': Message.objects.filter(thread=thread, sender=other, is_read=False),
+            # custom_admin.views
+            'admin new users': User.objects.order_by('-created_at')[:5],
+            'admin banned users': User.objects.filter(is_active=False),
+            'admin live posts': Post.objects.filter(is_active=True, is_archived=False).order_by('-created_at')[:50],
+            'admin flagged posts': Post.objects.filter(is_flagged=True).order_by('-created_at'),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, queryset in self.hot_queries().items():
+            with self.subTest(name):
+                self.assertIndexed(queryset)
+
+
+class PaginationTests(TestCase):
+    """ Keyset pages on (created_at, id), directly and through the feeds' infinite scroll """
+
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'pw')
+        self.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        for n in range(13):
+            Post.objects.create(user=self.author, caption=f'p{n}')
+        # Most posts share one created_at, so the order within it comes from the id
+        tie = timezone.now() - timedelta(hours=1)
+        Post.objects.exclude(caption__in=['p0', 'p12']).update(created_at=tie)
+        self.newest_first = list(Post.objects.order_by('-created_at', '-pk').values_list('pk', flat=True))
+        self.client.force_login(self.reader)
+
+    def test_pages_follow_ties_without_overlap(self):
+        pages, cursor = [], None
+        while True:
+            page = paginate(Post.objects.all(), cursor, page_size=5)
+            pages.append([post.pk for post in page])
+            cursor = page.next_cursor
+            self.assertEqual(page.has_next, cursor is not None)
+            if cursor is None:
+                break
+        self.assertEqual([len(page) for page in pages], [5, 5, 3])
+        self.assertEqual(sum(pages, []), self.newest_first)
+
+    def test_malformed_cursor_gives_first_page(self):
+        first = [post.pk for post in paginate(Post.objects.all(), page_size=5)]
+        for cursor in ('garbage', '%%%', 'bm90IGEgZGF0ZXwx', encode_cursor(timezone.now(), 1)[:-3]):
+            self.assertEqual([post.pk for post in paginate(Post.objects.all(), cursor, page_size=5)], first)
+
+    def scroll(self, url):
+        """ Every page of `url`'s infinite scroll, checking the JSON contract """
+        ids, cursor = [], ''
+        while True:
+            data = self.client.get(url, {'cursor': cursor}, headers={'x-requested-with': 'XMLHttpRequest'}).json()
+            self.assertEqual(set(data), {'posts', 'has_next', 'next_cursor'})
+            self.assertEqual(data['has_next'], data['next_cursor'] is not None)
+            ids += [post['id'] for post in data['posts']]
+            cursor = data['next_cursor']
+            if cursor is None:
+                return ids
+
+    def test_home_scroll_matches_explore(self):
+        self.client.post(reverse('accounts:follow_user', args=['author']))  # Backfills the timeline
+        self.assertEqual(self.scroll(reverse('posts:home')), self.newest_first)
+        self.assertEqual(self.scroll(reverse('posts:explore')), self.newest_first)
+        data = self.client.get(reverse('posts:home'), {'cursor': 'garbage'},
+                               headers={'x-requested-with': 'XMLHttpRequest'}).json()
+        self.assertEqual([post['id'] for post in data['posts']], self.newest_first[:timeline.PAGE_SIZE])
+        self.assertIn('p12', data['posts'][0]['html'])
+
+
+class SearchTests(TestCase):
+    """ Ranking and matching rules of posts.search """
+
+    def setUp(self):
+        people = [('isamu', ''), ('samantha', ''), ('xyz', 'Sammy'), ('sam', ''), ('lisa', 'Elisa')]
+        self.users = {name: User.objects.create_user(name, f'{name}@example.com', 'pw', first_name=first)
+                      for name, first in people}
+        for caption in ('Sunset over the bay', 'sunflower field', 'so upset', 'wow!!!'):
+            Post.objects.create(user=self.users['xyz'], caption=caption)
+
+    def users_for(self, query):
+        return [user.username for user in search_users(query)]
+
+    def captions_for(self, query, **kwargs):
+        return sorted(search_posts(Post.objects.all(), query, **kwargs).values_list('caption', flat=True))
+
+    def test_user_ranking(self):
+        # Exact username, username prefix, name prefix, then trigram similarity
+        self.assertEqual(self.users_for('SAM'), ['sam', 'samantha', 'xyz', 'isamu'])
+        self.assertEqual(self.users_for('  '), [])
+
+    def test_short_queries_match_prefixes_only(self):
+        self.assertEqual(self.users_for('sa'), ['sam', 'samantha', 'xyz'])  # Not isamu or lisa
+        self.assertEqual(self.users_for('el'), ['lisa'])
+
+    def test_caption_words_are_prefixes(self):
+        self.assertEqual(self.captions_for('sun'), ['Sunset over the bay', 'sunflower field'])
+        self.assertEqual(self.captions_for('sun BA'), ['Sunset over the bay'])
+        self.assertEqual(self.captions_for('set'), [])  # Prefixes of words, not substrings
+        self.assertEqual(self.captions_for('xy'), ['Sunset over the bay', 'so upset', 'sunflower field', 'wow!!!'])
+
+    def test_punctuation_only_queries(self):
+        self.assertEqual(self.captions_for('!!!'), [])
+        self.assertEqual(self.captions_for('!!!', substring_fallback=True), ['wow!!!'])
+        self.assertEqual(self.captions_for('  ', substring_fallback=True), [])
+
+        # The admin posts list keeps matching them
+        admin = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        self.client.force_login(admin)
+        rows = self.client.get(reverse('custom_admin:posts_list'), {'q': '!!!'},
+                               headers={'x-requested-with': 'XMLHttpRequest'})
+        self.assertContains(rows, 'wow!!!')
+        self.assertNotContains(rows, 'sunflower')
+
+
+class TimelineTests(TestCase):
+    """ Fan-out-on-write home timelines, with big accounts pulled in at read time """
+
+    def setUp(self):
+        cache.clear()
+        self.reader, self.author, self.star, self.fan = (
+            User.objects.create_user(name, f'{name}@example.com', 'pw') for name in ('reader', 'author', 'star', 'fan')
+        )
+        for follower, following in [(self.reader, self.author), (self.reader, self.star), (self.fan, self.star)]:
+            Follow.add(follower, following)
+        limit, timeline.FANOUT_LIMIT = timeline.FANOUT_LIMIT, 1  # `star` (2 followers) is too big to fan out
+        self.addCleanup(setattr, timeline, 'FANOUT_LIMIT', limit)
+
+    def post(self, author, minutes_ago):
+        """ A post written `minutes_ago`, fanned out the way create_post_view does """
+        post = Post.objects.create(user=author, caption='c', post_type='permanent')
+        created_at = timezone.now() - timedelta(minutes=minutes_ago)
+        Post.objects.filter(pk=post.pk).update(created_at=created_at)
+        post.created_at = created_at
+        timeline.fan_out_post(Post.objects.select_related('user').get(pk=post.pk))
+        return post
+
+    def readers_of(self, post):
+        return set(TimelineEntry.objects.filter(post=post).values_list('user__username', flat=True))
+
+    def test_fan_out_and_cutoff(self):
+        self.assertEqual(self.readers_of(self.post(self.author, 1)), {'author', 'reader'})
+        self.assertEqual(self.readers_of(self.post(self.star, 1)), {'star'})  # Followers pull it instead
+
+    def test_home_page_merges_pushed_and_pulled(self):
+        posts = [self.post(self.star, 0), self.post(self.author, 1), self.post(self.star, 2), self.post(self.author, 3)]
+        first, cursor = timeline.home_page(self.reader, page_size=3)
+        self.assertEqual(first, [p.pk for p in posts[:3]])
+        rest, cursor = timeline.home_page(self.reader, cursor, page_size=3)
+        self.assertEqual(rest, [posts[3].pk])
+        self.assertIsNone(cursor)
+
+    def test_follow_backfills_and_unfollow_removes(self):
+        posts = [self.post(self.author, minutes) for minutes in (1, 2)]
+        self.client.force_login(self.fan)
+        self.client.get(reverse('accounts:follow_user', args=['author']))
+        self.assertEqual(timeline.home_page(self.fan)[0], [p.pk for p in posts])
+        self.client.get(reverse('accounts:follow_user', args=['author']))
+        self.assertFalse(TimelineEntry.objects.filter(user=self.fan, post__user=self.author).exists())
+
+    def test_archived_posts_leave_timelines(self):
+        post = self.post(self.author, 1)
+        self.client.force_login(self.author)
+        self.client.post(reverse('posts:delete_post', args=[post.pk]))
+        self.assertEqual(self.readers_of(post), set())
+        self.assertEqual(timeline.home_page(self.reader)[0], [])
+
+
+class CounterTests(TestCase):
+    """ Like/comment/save/follow counters move with F() updates and reconcile_counters repairs drift """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        self.fan = User.objects.create_user('fan', 'fan@example.com', 'pw')
+        self.post = Post.objects.create(user=self.author, caption='c')
+        self.client.force_login(self.fan)
+
+    def counts(self):
+        post = Post.objects.get(pk=self.post.pk)
+        return post.like_count, post.comment_count, post.save_count
+
+    def test_post_counters(self):
+        self.client.post(reverse('posts:like_post', args=[self.post.pk]))
+        self.client.post(reverse('posts:save_post', args=[self.post.pk]))
+        for text in ('one', 'two'):
+            self.client.post(reverse('posts:add_comment', args=[self.post.pk]), {'comment_text': text})
+        self.assertEqual(self.counts(), (1, 2, 1))
+
+        self.client.post(reverse('posts:like_post', args=[self.post.pk]))  # Unlike
+        self.client.post(reverse('posts:save_post', args=[self.post.pk]))  # Unsave
+        self.client.post(reverse('posts:delete_comment', args=[Comment.objects.first().pk]))
+        self.assertEqual(self.counts(), (0, 1, 0))
+
+    def test_follow_counters(self):
+        self.client.get(reverse('accounts:follow_user', args=['author']))
+        self.assertEqual(User.objects.get(pk=self.author.pk).followers_count, 1)
+        self.assertEqual(User.objects.get(pk=self.fan.pk).following_count, 1)
+        self.client.get(reverse('accounts:follow_user', args=['author']))
+        self.assertEqual(User.objects.get(pk=self.author.pk).followers_count, 0)
+        self.assertEqual(User.objects.get(pk=self.fan.pk).following_count, 0)
+
+    def test_reconcile_repairs_drift(self):
+        Like.objects.create(user=self.fan, post=self.post)
+        Follow.objects.create(follower=self.fan, following=self.author)  # Behind the counters' back
+        Post.objects.filter(pk=self.post.pk).update(comment_count=7)
+        call_command('reconcile_counters', batch_size=1, stdout=io.StringIO())
+        self.assertEqual(self.counts(), (1, 0, 0))
+        self.assertEqual(User.objects.get(pk=self.author.pk).followers_count, 1)
+        self.assertEqual(User.objects.get(pk=self.fan.pk).following_count, 1)
+
+
+class ExpiryTests(TestCase):
+    """ Expired temporary posts vanish at once (live()) and are swept in batches (expire_posts) """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        self.reader = User.objects.create_user('reader', 'reader@example.com', 'pw')
+        Follow.add(self.reader, self.author)
+        self.expired = [self.post('temporary') for _ in range(5)]
+        Post.objects.filter(pk__in=[p.pk for p in self.expired]).update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.fresh, self.permanent = self.post('temporary'), self.post('permanent')
+
+    def post(self, post_type):
+        post = Post.objects.create(user=self.author, caption=post_type, post_type=post_type)
+        timeline.fan_out_post(post)
+        return post
+
+    def test_hidden_before_the_sweep(self):
+        self.assertEqual(Post.objects.filter(is_active=True).count(), 7)  # Not swept yet
+        live = {self.fresh.pk, self.permanent.pk}
+        self.assertEqual(set(Post.objects.live().values_list('pk', flat=True)), live)
+        self.assertEqual(set(timeline.home_page(self.reader)[0]), live)
+
+    def test_batched_sweep(self):
+        self.assertEqual(expiry.expire_due_posts(batch_size=2), 5)
+        self.assertFalse(Post.objects.filter(pk__in=[p.pk for p in self.expired], is_active=True).exists())
+        self.assertFalse(TimelineEntry.objects.filter(post__in=self.expired).exists())
+
+        # Unexpired posts and their timeline entries are left alone
+        self.assertEqual(set(Post.objects.filter(is_active=True).values_list('pk', flat=True)),
+                         {self.fresh.pk, self.permanent.pk})
+        self.assertEqual(TimelineEntry.objects.filter(post__in=[self.fresh, self.permanent]).count(), 4)
+        self.assertEqual(expiry.expire_due_posts(), 0)
+
+
+class ImagePipelineTests(TestCase):
+    """ Uploads are replaced by resized, metadata-free variants """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('uploader', 'uploader@example.com', 'pw')
+        self.client.force_login(self.user)
+
+    def photo(self):
+        """ A 2000x1500 JPEG shot sideways (EXIF orientation 6) with camera metadata """
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation: rotate 90 CW to display
+        exif[0x010F] = 'PhoneMaker'
+        buffer = io.BytesIO()
+        Image.new('RGB', (2000, 1500), 'orange').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('IMG_0001.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_post_upload(self):
+        self.client.post(reverse('posts:create'), {'caption': 'sunset', 'image': self.photo(),
+                                                   'post_type': 'permanent', 'media_type': 'image'})
+        post = Post.objects.get()
+
+        # The request only queues the work; the post shows as a placeholder sized from the header
+        self.assertTrue(post.media_pending)
+        self.assertEqual((post.image_width, post.image_height), (1500, 2000))
+        self.assertEqual(MediaJob.objects.get().object_id, post.pk)
+        self.assertContains(self.client.get(reverse('posts:explore')), f'data-pending-post="{post.pk}"')
+        status = self.client.get(reverse('posts:media_status'), {'ids': str(post.pk)}).json()
+        self.assertEqual(status['posts'][str(post.pk)], {'state': 'pending', 'blurhash': ''})
+
+        self.assertEqual(media_queue.work(processes=0, once=True), 1)
+        self.assertFalse(MediaJob.objects.exists())
+        post.refresh_from_db()
+
+        self.assertEqual(post.media_state, 'ready')
+        self.assertEqual(len(post.blurhash), 28)  # 4x3 components
+        self.assertEqual(set(post.image_variants), set(images.POST_VARIANTS))
+        # Upright: the sideways 2000x1500 becomes portrait
+        self.assertEqual((post.image_width, post.image_height), (810, 1080))
+        self.assertEqual(post.image_variants['thumb']['height'], 160)
+        self.assertEqual(post.image.name, post.image_variants['full']['webp'])
+        # Only the variants are stored, each once (the upload itself was released)
+        self.assertEqual(StoredFile.objects.count(), len(images.POST_VARIANTS) * (2 if images.AVIF else 1))
+        self.assertEqual(set(StoredFile.objects.values_list('refcount', flat=True)), {1})
+
+        for entry in post.image_variants.values():
+            with default_storage.open(entry['webp']) as f, Image.open(f) as image:
+                self.assertEqual(image.format, 'WEBP')
+                self.assertFalse(image.getexif())
+                self.assertEqual(image.size, (entry['width'], entry['height']))
+
+        grid_url = post.images.grid.url
+        self.assertContains(self.client.get(reverse('posts:explore')), grid_url)
+        self.assertContains(self.client.get(reverse('accounts:profile', args=['uploader'])), grid_url)
+        grid = self.client.get(reverse('posts:explore'), headers={'x-requested-with': 'XMLHttpRequest'}).json()
+        self.assertEqual(grid['posts'][0]['image_url'], grid_url)
+        detail = self.client.get(reverse('posts:post_detail_ajax', args=[post.pk])).json()
+        self.assertEqual(detail['image_url'], post.images.full.url)
+        status = self.client.get(reverse('posts:media_status'), {'ids': str(post.pk)}).json()
+        self.assertEqual(status['posts'][str(post.pk)]['grid']['url'], grid_url)
+
+    def test_failing_job_is_retried_then_marked_failed(self):
+        post = Post.objects.create(user=self.user, caption='broken', image='qwips/missing.jpg', media_state='pending')
+        media_queue.enqueue('post', post.pk)
+
+        for attempt in range(1, media_queue.MAX_ATTEMPTS + 1):
+            MediaJob.objects.update(available_at=timezone.now())  # Skip the backoff
+            media_queue.work(processes=0, once=True)
+            job = MediaJob.objects.get()
+            self.assertEqual(job.attempts, attempt)
+            self.assertIn('FileNotFoundError', job.error)
+
+        self.assertEqual(job.state, 'failed')
+        post.refresh_from_db()
+        self.assertEqual(post.media_state, 'failed')
+        self.assertEqual(post.images.grid.url, '/media/qwips/missing.jpg')
+
+    def test_unprocessed_and_missing_images_fall_back(self):
+        post = Post.objects.create(user=self.user, caption='old', image='qwips/old.jpg')
+        self.assertEqual(post.images.grid.url, '/media/qwips/old.jpg')
+        self.assertEqual(post.images.grid.avif, '')
+        self.assertEqual(self.user.avatars.thumb.url, 'https://ui-avatars.com/api/?name=uploader')
+
+
+class ContentAddressedStorageTests(TestCase):
+    """ Files are named by content hash, shared and reference counted """
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user('uploader', 'uploader@example.com', 'pw')
+
+    def test_identical_uploads_share_one_file(self):
+        first = default_storage.save('qwips/a.JPG', ContentFile(b'same bytes'))
+        second = default_storage.save('profiles/b.jpg', ContentFile(b'same bytes'))
+        other = default_storage.save('qwips/c.jpg', ContentFile(b'other bytes'))
+
+        digest = hashlib.sha256(b'same bytes').hexdigest()
+        self.assertEqual(first, f'blobs/{digest[:2]}/{digest[2:4]}/{digest}.jpg')
+        self.assertEqual(second, first)
+        self.assertNotEqual(other, first)
+        self.assertEqual(StoredFile.objects.get(name=first).refcount, 2)
+        self.assertEqual(default_storage.listdir('tmp'), ([], []))  # The duplicate's temp file is gone
+
+        default_storage.delete(first)
+        self.assertTrue(default_storage.exists(first))
+        default_storage.delete(second)
+        self.assertFalse(default_storage.exists(first))
+        self.assertFalse(StoredFile.objects.filter(name=first).exists())
+        self.assertTrue(default_storage.exists(other))
+
+    def test_same_photo_posted_twice(self):
+        photo = io.BytesIO()
+        Image.new('RGB', (800, 600), 'teal').save(photo, 'JPEG')
+        for caption in ('one', 'two'):
+            post = Post(user=self.user, caption=caption, media_state='pending')
+            post.image.save('IMG.jpg', ContentFile(photo.getvalue()))
+            media_queue.enqueue('post', post.pk)
+        media_queue.work(processes=0, once=True)
+
+        one, two = Post.objects.order_by('pk')
+        self.assertEqual(one.image_variants, two.image_variants)
+        self.assertEqual(StoredFile.objects.get(name=one.image.name).refcount, 2)
+
+        # Replacing one post's image leaves the other's intact
+        images.delete(one.image, one.image_variants)
+        for entry in two.image_variants.values():
+            self.assertTrue(default_storage.exists(entry['webp']))
+
+    def test_deleting_owners_releases_files(self):
+        photo = io.BytesIO()
+        Image.new('RGB', (800, 600), 'teal').save(photo, 'JPEG')
+        for caption in ('one', 'two'):
+            post = Post(user=self.user, caption=caption, media_state='pending')
+            post.image.save('IMG.jpg', ContentFile(photo.getvalue()))
+            media_queue.enqueue('post', post.pk)
+        self.user.profile_image.save('me.jpg', ContentFile(photo.getvalue()))
+        media_queue.enqueue('avatar', self.user.pk)
+        media_queue.work(processes=0, once=True)
+        one, two = Post.objects.order_by('pk')
+        names = {entry['webp'] for entry in one.image_variants.values()}
+
+        # A blob still used by the other post survives
+        with self.captureOnCommitCallbacks(execute=True):
+            one.delete()
+        self.assertTrue(all(default_storage.exists(name) for name in names))
+        self.assertEqual(StoredFile.objects.get(name=two.image.name).refcount, 1)
+
+        # Deleting the user takes its avatar and, by cascade, the last post with them
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.get(pk=self.user.pk).delete()
+        self.assertFalse(any(default_storage.exists(name) for name in names))
+        self.assertFalse(StoredFile.objects.exists())
+
+    def test_media_is_served_immutable(self):
+        name = default_storage.save('qwips/a.jpg', ContentFile(b'bytes'))
+        request = RequestFactory().get('/media/' + name)
+        response = media_file_view(request, name)
+        self.assertEqual(response['Cache-Control'], f'public, max-age={365 * 24 * 3600}, immutable')
+
+
+class AudienceTests(TestCase):
+    """ Private accounts and friends-only posts reach the author and their followers only """
+
+    def setUp(self):
+        cache.clear()
+        self.author, self.fan, self.stranger = (
+            User.objects.create_user(name, f'{name}@example.com', 'pw') for name in ('author', 'fan', 'stranger')
+        )
+        Follow.add(self.fan, self.author)
+        self.public = Post.objects.create(user=self.author, caption='public')
+        self.friends = Post.objects.create(user=self.author, caption='friends', visibility='private')
+
+    def visible(self, viewer):
+        return set(Post.objects.live().visible_to(viewer).values_list('caption', flat=True))
+
+    def test_friends_only_posts(self):
+        self.assertEqual(self.visible(self.stranger), {'public'})
+        self.assertEqual(self.visible(self.fan), {'public', 'friends'})
+        self.assertEqual(self.visible(self.author), {'public', 'friends'})
+        self.assertFalse(audience.can_view(self.stranger, self.friends))
+        self.assertTrue(audience.can_view(self.fan, self.friends))
+
+        self.client.force_login(self.stranger)
+        self.assertEqual(self.client.get(reverse('posts:post_detail_ajax', args=[self.friends.pk])).status_code, 404)
+        self.assertEqual(self.client.post(reverse('posts:like_post', args=[self.friends.pk])).status_code, 404)
+        self.client.force_login(self.fan)
+        self.assertEqual(self.client.get(reverse('posts:post_detail_ajax', args=[self.friends.pk])).status_code, 200)
+
+        # Unfollowing takes access away at once, even where a cached follow graph still lists the follow
+        follow_graph.following(self.fan.pk)
+        Follow.remove(self.fan, self.author)
+        self.assertEqual(self.visible(self.fan), {'public'})
+        self.assertEqual(self.client.get(reverse('posts:post_detail_ajax', args=[self.friends.pk])).status_code, 404)
+
+    def test_portal_admin_sees_every_post(self):
+        # The admin portal's post modal loads posts through post_detail_ajax
+        moderator = User.objects.create_user('moderator', 'moderator@example.com', 'pw', role='admin')
+        superuser = User.objects.create_superuser('root', 'root@example.com', 'pw')
+        User.objects.filter(pk=self.author.pk).update(is_private=True)
+        audience.sync_author(User.objects.get(pk=self.author.pk))
+        for admin in (moderator, superuser):
+            self.assertEqual(self.visible(admin), {'public', 'friends'})
+            self.assertTrue(audience.can_view(admin, self.friends))
+            self.client.force_login(admin)
+            response = self.client.get(reverse('posts:post_detail_ajax', args=[self.friends.pk]))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json()['caption'], 'friends')
+
+    def test_private_account(self):
+        self.client.force_login(self.author)
+        self.client.post(reverse('accounts:settings'), {'update_privacy': '1', 'is_private': 'on'})
+        self.assertFalse(Post.objects.filter(is_public=True).exists())
+        self.assertEqual(self.visible(self.stranger), set())
+        self.assertEqual(self.visible(self.fan), {'public', 'friends'})
+
+        # New posts by a private account start out hidden too
+        Post.objects.create(user=User.objects.get(pk=self.author.pk), caption='later')
+        self.assertEqual(self.visible(self.stranger), set())
+
+        self.client.force_login(self.stranger)
+        explore = self.client.get(reverse('posts:explore'), HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertEqual(explore['posts'], [])
+        self.assertEqual(self.client.get(reverse('accounts:followers', args=['author'])).json()['users'], [])
+
+        self.client.force_login(self.author)
+        self.client.post(reverse('accounts:settings'), {'update_privacy': '1'})
+        self.assertEqual(set(Post.objects.filter(is_public=True).values_list('caption', flat=True)), {'public', 'later'})
+
+
+class FragmentCacheTests(TestCase):
+    """ Grid tiles and profile headers are cached in two levels and invalidated by version """
+
+    def setUp(self):
+        cache.clear()
+        fragments.local.clear()
+        self.author = User.objects.create_user('author', 'author@example.com', 'pw')
+        self.fan = User.objects.create_user('fan', 'fan@example.com', 'pw')
+        self.post = Post.objects.create(user=self.author, caption='hello')
+        self.renders = []
+
+    def render(self, post):
+        self.renders.append(post.pk)
+        return f'{post.caption} {post.like_count}'
+
+    def tile(self):
+        post = Post.objects.get(pk=self.post.pk)
+        return fragments.get_many('test', 'post', [post], self.render)[post.pk]
+
+    def test_levels_and_versions(self):
+        self.assertEqual(self.tile(), 'hello 0')
+        self.assertEqual(self.tile(), 'hello 0')
+        fragments.local.clear()  # Another process: served from the shared cache
+        self.assertEqual(self.tile(), 'hello 0')
+        self.assertEqual(len(self.renders), 1)
+
+        # Likes, comments and edits bump the post's version once they commit
+        self.client.force_login(self.fan)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('posts:like_post', args=[self.post.pk]))
+        self.assertEqual(self.tile(), 'hello 1')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('posts:add_comment', args=[self.post.pk]), {'comment_text': 'nice'})
+        self.tile()
+        with self.captureOnCommitCallbacks(execute=True):
+            post = Post.objects.get(pk=self.post.pk)
+            post.caption = 'edited'
+            post.save()
+        self.assertEqual(self.tile(), 'edited 1')
+        self.assertEqual(len(self.renders), 4)
+
+    def test_pages_use_tiles_and_headers(self):
+        self.client.force_login(self.fan)
+        explore = self.client.get(reverse('posts:explore'))
+        self.assertContains(explore, f'data-post-id="{self.post.pk}"')
+        profile = self.client.get(reverse('accounts:profile', args=['author']))
+        self.assertContains(profile, 'No bio yet.')
+        self.assertContains(profile, 'Follow')  # Viewer-specific parts still render per request
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.bio = 'Photographer'
+            self.author.save()
+        self.assertContains(self.client.get(reverse('accounts:profile', args=['author'])), 'Photographer')
+
+        # Post counts come from the cached header: friends-only posts count for followers only
+        profile_url = reverse('accounts:profile', args=['author'])
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.create(user=self.author, caption='friends', visibility='private')
+        self.assertEqual(self.client.get(profile_url).context['posts_count'], 1)
+        self.client.force_login(self.author)
+        self.assertEqual(self.client.get(profile_url).context['posts_count'], 2)
+        with self.assertNumQueries(0):
+            fragments.profile_header(self.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            Post.objects.filter(caption='friends').update(expires_at=timezone.now() - timedelta(minutes=1))
+            expiry.expire_due_posts()
+        self.assertEqual(self.client.get(profile_url).context['posts_count'], 1)
+
+        # Posts still being processed are never cached
+        self.post.media_state = 'pending'
+        self.post.save()
+        fragments.tiles([self.post])
+        Post.objects.filter(pk=self.post.pk).update(media_state='ready')
+        data = fragments.tiles_data([Post.objects.get(pk=self.post.pk)])
+        self.assertFalse(data[0]['pending'])
@@ -0,0 +1,127 @@
+"""
+Materialized home timelines.
+
+Posts are pushed into their followers' timelines when they are written
+(fan-out-on-write), so reading the home feed is one bounded index scan on
+TimelineEntry instead of a query over every post on the site.
+
+Accounts with more than TIMELINE_FANOUT_LIMIT followers are not fanned out;
+their posts are pulled in at read time instead (fan-out-on-read), which keeps
+a single post from turning into hundreds of thousands of inserts.
+"""
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from accounts.models import User, Follow
+from .models import Post, TimelineEntry
+from .pagination import encode_cursor, decode_cursor, before
+
+FANOUT_LIMIT = getattr(settings, 'TIMELINE_FANOUT_LIMIT', 5000)
+BACKFILL_SIZE = getattr(settings, 'TIMELINE_BACKFILL_SIZE', 50)
+PAGE_SIZE = getattr(settings, 'TIMELINE_PAGE_SIZE', 10)
+BATCH_SIZE = 1000
+
+
+# --- Write side ---
+
+def is_fanout_account(user):
+    """ True if posts by this user are pushed to followers on write """
+    return user.followers_count <= FANOUT_LIMIT
+
+
+def _push(post_ids_by_reader):
+    entries = [
+        TimelineEntry(user_id=reader_id, post_id=post_id, created_at=created_at)
+        for reader_id, posts in post_ids_by_reader
+        for post_id, created_at in posts
+    ]
+    TimelineEntry.objects.bulk_create(entries, batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def fan_out_post(post):
+    """ Push a new (or restored) post into its author's and followers' timelines """
+    if not post.is_active:
+        return
+    item = [(post.pk, post.created_at)]
+    readers = [post.user_id]
+    if is_fanout_account(post.user):
+        readers += list(Follow.objects.filter(following_id=post.user_id).values_list('follower_id', flat=True))
+    _push((reader_id, item) for reader_id in readers)
+
+
+def remove_post(post):
+    """ Drop a post from every timeline (archive, admin delete, expiry) """
+    TimelineEntry.objects.filter(post=post).delete()
+
+
+def on_follow(follower, following):
+    """ Backfill the followed account's recent posts into the follower's timeline """
+    if not is_fanout_account(following):
+        return  # Read side pulls these in
+    recent = Post.objects.live().filter(user=following)\
+                         .order_by('-created_at')\
+                         .values_list('pk', 'created_at')[:BACKFILL_SIZE]
+    _push([(follower.pk, list(recent))])
+
+
+def on_unfollow(follower, following):
+    TimelineEntry.objects.filter(user=follower, post__user=following).delete()
+
+
+def rebuild_for_user(user):
+    """ Recompute one user's timeline from scratch (used by rebuild_timelines) """
+    TimelineEntry.objects.filter(user=user).delete()
+    authors = [user]
+    authors += list(User.objects.filter(followers__follower=user))
+    for author in authors:
+        if author == user or is_fanout_account(author):
+            recent = Post.objects.live().filter(user=author)\
+                                 .order_by('-created_at')\
+                                 .values_list('pk', 'created_at')[:BACKFILL_SIZE]
+            _push([(user.pk, list(recent))])
+
+
+# --- Read side ---
+
+def _pulled_author_ids(user):
+    """ Followed accounts that are too large to fan out, read on demand instead """
+    return list(
+        User.objects.filter(followers__follower=user, followers_count__gt=FANOUT_LIMIT)
+                    .values_list('pk', flat=True)
+    )
+
+
+def home_page(user, cursor=None, page_size=PAGE_SIZE):
+    """
+    Returns (post_ids, next_cursor) for one page of the user's home feed,
+    newest first. Reads at most page_size + 1 rows from each source.
+    """
+    position = decode_cursor(cursor)
+
+    now = timezone.now()
+    pushed = TimelineEntry.objects.filter(user=user, post__is_active=True)\
+                                  .filter(Q(post__expires_at__isnull=True) | Q(post__expires_at__gt=now))
+    if position:
+        pushed = pushed.filter(before(position, 'created_at', 'post_id'))
+    candidates = list(
+        pushed.order_by('-created_at', '-post_id').values_list('created_at', 'post_id')[:page_size + 1]
+    )
+
+    pulled_ids = _pulled_author_ids(user)
+    if pulled_ids:
+        pulled = Post.objects.live().filter(user_id__in=pulled_ids)
+        if position:
+            pulled = pulled.filter(before(position))
+        candidates += list(
+            pulled.order_by('-created_at', '-id').values_list('created_at', 'id')[:page_size + 1]
+        )
+
+    # Merge both sources on (created_at, id); a post may be in both if its
+    # author crossed the fan-out limit after it was pushed
+    merged = sorted(set(candidates), reverse=True)
+    page = merged[:page_size]
+    next_cursor = None
+    if len(merged) > page_size:
+        next_cursor = encode_cursor(*page[-1])
+    return [pk for _, pk in page], next_cursor
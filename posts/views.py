@@ -4,40 +4,59 @@ from django.views.decorators.cache import never_cache
 from django.shortcuts import get_object_or_404
 from django.http import JsonResponse
 from django.urls import reverse
-from django.db.models import Count
-from django.core.paginator import Paginator
-from django.db.models import Q
+from django.template.loader import render_to_string
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
 from django.utils.timesince import timesince
 from django.utils import timezone
+from django.utils.cache import patch_cache_control
+from django.views.static import serve
+from django.conf import settings
 from .forms import PostForm
 from accounts.models import User, Follow
+from accounts import suggestions, follow_graph
 from .models import Post, Like, Comment, SavedPost
+from . import timeline, search, images, media_queue, storage, audience, fragments
+from .pagination import paginate
 
 @never_cache
 @login_required
 def home_view(request):
-    posts = Post.objects.filter(is_active=True)\
-                .annotate(
-                    like_count=Count('likes', distinct=True),
-                    comment_count=Count('comments', distinct=True)
-                ).order_by('-created_at')
-    
-    liked_posts_ids = Like.objects.filter(user=request.user).values_list('post_id', flat=True)
-    following_ids = Follow.objects.filter(follower=request.user).values_list('following_id', flat=True)
-    saved_posts_ids = SavedPost.objects.filter(user=request.user).values_list('post_id', flat=True)
-
-    # Suggestions logic...
-    suggestions = User.objects.exclude(id=request.user.id) \
-                              .exclude(id__in=following_ids) \
-                              .exclude(is_superuser=True) \
-                              .exclude(is_staff=True) \
-                              .order_by('?')[:5]
+    # 1. Read one page of post ids from the materialized timeline
+    page_ids, next_cursor = timeline.home_page(request.user, request.GET.get('cursor'))
+
+    # (visible_to drops posts that went private since they were fanned out)
+    posts_by_id = Post.objects.visible_to(request.user).filter(pk__in=page_ids).select_related('user').in_bulk()
+    posts = [posts_by_id[pk] for pk in page_ids if pk in posts_by_id]
     
+    # 2. Viewer state, limited to the posts on this page
+    liked_posts_ids = set(Like.objects.filter(user=request.user, post_id__in=page_ids).values_list('post_id', flat=True))
+    following_ids = follow_graph.following(request.user.pk)  # Cached adjacency set
+    saved_posts_ids = set(SavedPost.objects.filter(user=request.user, post_id__in=page_ids).values_list('post_id', flat=True))
+
+    # 3. AJAX for Infinite Scroll (same contract as explore, cards pre-rendered)
+    if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+        card_context = {
+            'liked_posts_ids': liked_posts_ids,
+            'following_ids': following_ids,
+            'saved_posts_ids': saved_posts_ids,
+        }
+        posts_data = []
+        for post in posts:
+            posts_data.append({
+                'id': post.id,
+                'html': render_to_string('posts/includes/post_card.html', {**card_context, 'post': post}, request=request),
+            })
+        return JsonResponse({'posts': posts_data, 'has_next': next_cursor is not None, 'next_cursor': next_cursor})
+
+    # 4. Who to follow (cached friends-of-friends, see accounts/suggestions.py)
     context = {
         'posts': posts,
+        'next_cursor': next_cursor,
         'liked_posts_ids': liked_posts_ids,
         'following_ids': following_ids,
-        'suggestions': suggestions, 
+        'suggestions': suggestions.for_user(request.user),
         'saved_posts_ids': saved_posts_ids,
     }
     return render(request, 'posts/home.html', context)
@@ -53,7 +72,16 @@ def create_post_view(request):
             post.user = request.user
             post.media_type = 'image' # Force type
             
-            post.save()
+            # Variants and the placeholder are made by the media worker; the post
+            # shows up right away as a placeholder sized from the file header
+            if post.image:
+                post.media_state = 'pending'
+                post.image_width, post.image_height = images.probe(post.image)
+            with transaction.atomic():
+                post.save()
+                if post.image:
+                    media_queue.enqueue('post', post.pk)
+            timeline.fan_out_post(post)
             
             return redirect('posts:home')
         else:
@@ -69,35 +97,37 @@ def create_post_view(request):
 
 @login_required
 def like_post_view(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
-    
-    # Check if like exists
-    like_filter = Like.objects.filter(user=request.user, post=post)
+    post = audience.visible_post_or_404(request.user, post_id)
     
-    if like_filter.exists():
-        like_filter.delete()
-        liked = False
-    else:
-        Like.objects.create(user=request.user, post=post)
-        liked = True
+    # Toggle the like and move the counter in the same transaction
+    with transaction.atomic():
+        deleted, _ = Like.objects.filter(user=request.user, post=post).delete()
+        if deleted:
+            Post.objects.filter(pk=post.pk).update(like_count=Greatest(F('like_count') - 1, 0))
+            liked = False
+        else:
+            Like.objects.create(user=request.user, post=post)
+            Post.objects.filter(pk=post.pk).update(like_count=F('like_count') + 1)
+            liked = True
         
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        # Count likes directly from the Like model to avoid IDE errors
-        count = Like.objects.filter(post=post).count()
+        post.refresh_from_db(fields=['like_count'])
         return JsonResponse({
             'liked': liked,
-            'like_count': count
+            'like_count': post.like_count
         })
         
     return redirect(request.META.get('HTTP_REFERER', 'posts:home')) 
 
 @login_required
 def add_comment_view(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = audience.visible_post_or_404(request.user, post_id)
     if request.method == 'POST':
         text = request.POST.get('comment_text')
         if text:
-            comment = Comment.objects.create(user=request.user, post=post, text=text)
+            with transaction.atomic():
+                comment = Comment.objects.create(user=request.user, post=post, text=text)
+                Post.objects.filter(pk=post.pk).update(comment_count=F('comment_count') + 1)
             
             # This part prevents the reload!
             if request.headers.get('x-requested-with') == 'XMLHttpRequest':
@@ -114,16 +144,15 @@ def profile_view(request, username):
     # 1. Get the Profile User
     profile_user = get_object_or_404(User, username=username)
     
-    # 2. Check if I am following them
-    # We use .exists() which returns True or False
-    is_following = Follow.objects.filter(follower=request.user, following=profile_user).exists()
+    # 2. Check if I am following them (cached adjacency set, no query)
+    is_following = follow_graph.follows(request.user.pk, profile_user.pk)
     
-    # 3. Get Counts (use Follow model queries instead of relying on reverse relation names)
-    followers_count = Follow.objects.filter(following=profile_user).count()
-    following_count = Follow.objects.filter(follower=profile_user).count()
+    # 3. Get Counts (denormalized on User)
+    followers_count = profile_user.followers_count
+    following_count = profile_user.following_count
     
-    # 4. Get Posts
-    posts = Post.objects.filter(user=profile_user, is_active=True).order_by('-created_at')
+    # 4. Get Posts (the ones this viewer may see)
+    posts = Post.objects.filter(user=profile_user, is_active=True).visible_to(request.user).order_by('-created_at')
 
     context = {
         'profile_user': profile_user,
@@ -136,14 +165,14 @@ def profile_view(request, username):
 
 @login_required
 def get_comments_ajax(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = audience.visible_post_or_404(request.user, post_id)
     comments = post.comments.all().select_related('user').order_by('-created_at')
     data = []
     for c in comments:
         data.append({
             'username': c.user.username,
             'text': c.text,
-            'avatar': c.user.profile_image.url if c.user.profile_image else f"https://ui-avatars.com/api/?name={c.user.username}",
+            'avatar': c.user.avatars.thumb.url,
             'created_at': c.created_at.strftime("%b %d, %H:%M"),
             # Generate the profile URL
             'profile_url': reverse('accounts:profile', kwargs={'username': c.user.username})
@@ -152,14 +181,14 @@ def get_comments_ajax(request, post_id):
 
 @login_required
 def get_likes_ajax(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
+    post = audience.visible_post_or_404(request.user, post_id)
     likes = post.likes.all().select_related('user')
     data = []
     for l in likes:
         data.append({
             'username': l.user.username,
             'full_name': f"{l.user.first_name} {l.user.last_name}",
-            'avatar': l.user.profile_image.url if l.user.profile_image else f"https://ui-avatars.com/api/?name={l.user.username}",
+            'avatar': l.user.avatars.thumb.url,
             # Generate the profile URL
             'profile_url': reverse('accounts:profile', kwargs={'username': l.user.username})
         })
@@ -170,21 +199,25 @@ def follow_user_view(request, username):
     user_to_toggle = get_object_or_404(User, username=username)
     
     if request.user != user_to_toggle:
-        follow_record = Follow.objects.filter(follower=request.user, following=user_to_toggle).first()
-        
-        if follow_record:
-            follow_record.delete()
+        if Follow.remove(request.user, user_to_toggle):
+            follow_graph.on_unfollow(request.user, user_to_toggle)
+            timeline.on_unfollow(request.user, user_to_toggle)
+            suggestions.on_unfollow(request.user, user_to_toggle)
             status = 'unfollowed'
         else:
-            Follow.objects.create(follower=request.user, following=user_to_toggle)
+            Follow.add(request.user, user_to_toggle)
+            follow_graph.on_follow(request.user, user_to_toggle)
+            timeline.on_follow(request.user, user_to_toggle)
+            suggestions.on_follow(request.user, user_to_toggle)
             status = 'followed'
         # --- NEW: AJAX Support ---
         # If the request comes from JavaScript (fetch), return JSON data
         if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-            new_count = Follow.objects.filter(following=user_to_toggle).count()
+            # Kept exact by Follow.add/remove in the same transaction
+            user_to_toggle.refresh_from_db(fields=['followers_count'])
             return JsonResponse({
                 'status': status, 
-                'new_count': new_count
+                'new_count': user_to_toggle.followers_count
             })
             
     # Fallback for non-JS browsers (Standard Reload)
@@ -196,53 +229,37 @@ def explore_view(request):
     query = request.GET.get('q', '').strip()
     matched_users = None
     
-    # 1. Base Query for Posts (Annotate counts for speed)
-    posts_list = Post.objects.filter(visibility='public', is_active=True)\
-        .annotate(
-            like_count_attr=Count('likes', distinct=True),
-            comment_count_attr=Count('comments', distinct=True)
-        ).order_by('-created_at')
+    # 1. Base Query for Posts (counts are denormalized on Post; is_public already
+    #    excludes private accounts, see posts/audience.py)
+    posts_list = Post.objects.live().filter(is_public=True)
 
     # 2. Handle the "Search Results" (People + Posts)
     if query:
-        # Get users matching search (Excluding admins)
-        matched_users = User.objects.filter(
-            Q(username__icontains=query) | 
-            Q(first_name__icontains=query)
-        ).exclude(is_staff=True).exclude(is_superuser=True)[:8]
-
-        # Filter the posts grid by caption or the poster's username
-        posts_list = posts_list.filter(
-            Q(caption__icontains=query) | 
-            Q(user__username__icontains=query)
-        )
-
-    # 3. Pagination
-    paginator = Paginator(posts_list, 12)
-    page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
-
-    # 4. AJAX for Infinite Scroll
+        # Get ranked users matching search (Excluding admins)
+        matched_users = search.search_users(query)[:8]
+
+        # Filter the posts grid by caption (full-text) or the poster's username;
+        # the grid stays newest-first so the cursor keeps working
+        posts_list = search.search_posts(posts_list, query)
+
+    # 3. Keyset pagination (no COUNT, no OFFSET)
+    page_obj = paginate(posts_list, request.GET.get('cursor'))
+
+    # 4. AJAX for Infinite Scroll (tiles are the same for every viewer, see posts/fragments.py)
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
-        posts_data = []
-        for post in page_obj:
-            posts_data.append({
-                'id': post.id,
-                'image_url': post.image.url,
-                'like_count': post.like_count_attr,
-                'comment_count': post.comment_count_attr,
-            })
-        return JsonResponse({'posts': posts_data, 'has_next': page_obj.has_next()})
+        posts_data = fragments.tiles_data(page_obj)
+        return JsonResponse({'posts': posts_data, 'has_next': page_obj.has_next, 'next_cursor': page_obj.next_cursor})
 
     return render(request, 'posts/explore.html', {
         'posts': page_obj,
+        'tiles': fragments.tiles(page_obj),
         'matched_users': matched_users,
         'query': query
     })
 
 @login_required
 def post_detail_ajax(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = audience.visible_post_or_404(request.user, post_id)
     comments = post.comments.all().select_related('user').order_by('-created_at')
     
     comments_data = []
@@ -250,7 +267,7 @@ def post_detail_ajax(request, post_id):
         comments_data.append({
             'username': c.user.username,
             'text': c.text,
-            'avatar': c.user.profile_image.url if c.user.profile_image else f"https://ui-avatars.com/api/?name={c.user.username}",
+            'avatar': c.user.avatars.thumb.url,
             'profile_url': reverse('accounts:profile', kwargs={'username': c.user.username})
         })
 
@@ -259,17 +276,35 @@ def post_detail_ajax(request, post_id):
     return JsonResponse({
         'pk': post.pk,
         'username': post.user.username,
-        'user_avatar': post.user.profile_image.url if post.user.profile_image else f"https://ui-avatars.com/api/?name={post.user.username}",
+        'user_avatar': post.user.avatars.thumb.url,
         'profile_url': reverse('accounts:profile', kwargs={'username': post.user.username}),
-        'image_url': post.image.url,
+        'image_url': post.images.full.url,
         'caption': post.caption,
-        'likes_count': post.likes.count(),
+        'likes_count': post.like_count,
         'is_liked': post.likes.filter(user=request.user).exists(),
         'comments': comments_data,
         'created_at': timesince(post.created_at).upper(),
         'is_saved': is_saved,
     })
 
+@login_required
+def media_status_view(request):
+    """ Processing state of the pending images on a page (?ids=1,2,3), polled by includes/media.html """
+    try:
+        ids = [int(pk) for pk in request.GET.get('ids', '').split(',') if pk][:100]
+    except ValueError:
+        ids = []
+
+    posts_data = {}
+    for post in Post.objects.live().visible_to(request.user).filter(pk__in=ids):
+        entry = {'state': post.media_state, 'blurhash': post.blurhash}
+        if not post.media_pending:
+            for name in images.POST_VARIANTS:
+                variant = getattr(post.images, name)
+                entry[name] = {'url': variant.url, 'avif': variant.avif}
+        posts_data[post.pk] = entry
+    return JsonResponse({'posts': posts_data})
+
 @login_required
 def delete_post_view(request, post_id):
     """ Soft delete: User archives the post """
@@ -281,6 +316,7 @@ def delete_post_view(request, post_id):
         post.deleted_at = timezone.now()
         post.deletion_reason = 'user_deleted'
         post.save()
+        timeline.remove_post(post)
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'error', 'message': 'Unauthorized'}, status=403)
 
@@ -304,6 +340,7 @@ def restore_post_view(request, post_id):
         if not post.is_active:
              return JsonResponse({'status': 'expired', 'message': 'Post restored but has expired.'})
 
+        timeline.fan_out_post(post)
         return JsonResponse({'status': 'success'})
     
     # Post was deleted by admin, cannot restore
@@ -325,29 +362,38 @@ def update_post_caption(request, post_id):
 def delete_comment_view(request, comment_id):
     comment = get_object_or_404(Comment, pk=comment_id)
     if request.user == comment.user:
-        comment.delete()
+        with transaction.atomic():
+            comment.delete()
+            Post.objects.filter(pk=comment.post_id).update(comment_count=Greatest(F('comment_count') - 1, 0))
         return JsonResponse({'status': 'success'})
     return JsonResponse({'status': 'error'}, status=403)
 
 @login_required
 def save_post_view(request, post_id):
-    post = get_object_or_404(Post, pk=post_id)
+    post = audience.visible_post_or_404(request.user, post_id)
     
-    # Check if the saved record exists
-    saved_record = SavedPost.objects.filter(user=request.user, post=post).first()
-    
-    if saved_record:
-        # If it exists, delete it (Unsave)
-        saved_record.delete()
-        saved = False
-    else:
-        # If it doesn't exist, create it (Save)
-        SavedPost.objects.create(user=request.user, post=post)
-        saved = True
+    with transaction.atomic():
+        deleted, _ = SavedPost.objects.filter(user=request.user, post=post).delete()
+        if deleted:
+            # It existed, so this was an Unsave
+            Post.objects.filter(pk=post.pk).update(save_count=Greatest(F('save_count') - 1, 0))
+            saved = False
+        else:
+            # It didn't exist, so Save it
+            SavedPost.objects.create(user=request.user, post=post)
+            Post.objects.filter(pk=post.pk).update(save_count=F('save_count') + 1)
+            saved = True
 
     # Return JSON for AJAX
     if request.headers.get('x-requested-with') == 'XMLHttpRequest':
         return JsonResponse({'status': 'success', 'is_saved': saved})
     
     # Fallback for non-JS
-    return redirect(request.META.get('HTTP_REFERER', 'posts:home'))
\ No newline at end of file
+    return redirect(request.META.get('HTTP_REFERER', 'posts:home'))
+
+def media_file_view(request, path):
+    """ Serves MEDIA_URL when DEBUG is on. Content-addressed files never change, so they are cached for good """
+    response = serve(request, path, document_root=settings.MEDIA_ROOT)
+    if storage.is_content_addressed(path):
+        patch_cache_control(response, public=True, max_age=settings.MEDIA_CACHE_MAX_AGE, immutable=True)
+    return response
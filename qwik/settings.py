@@ -48,6 +48,7 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
     "accounts",
     "posts",
     "chats",
@@ -70,6 +71,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "chats.middleware.PresenceMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -87,6 +89,7 @@ TEMPLATES = [
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
                 'chats.context_processors.unread_messages_count',
+                'chats.context_processors.presence_ping_interval',
             ],
         },
     },
@@ -96,17 +99,37 @@ WSGI_APPLICATION = "qwik.wsgi.application"
 
 ASGI_APPLICATION = "qwik.asgi.application"
 
-# Channel Layer (Redis is required for production, In-memory for local dev)
+# Channel Layer (Redis is required for production, In-memory for local dev).
+# CHANNEL_REDIS_URL points it at another server; CHANNEL_LAYER=pubsub selects the
+# pub/sub layer (the load test uses it against its Redis stand-in, see chats/loadtest.py)
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "channels_redis.pubsub.RedisPubSubChannelLayer" if os.getenv('CHANNEL_LAYER') == 'pubsub'
+                   else "channels_redis.core.RedisChannelLayer",
         "CONFIG": {
-            "hosts": [("127.0.0.1", 6379)],
+            "hosts": [os.getenv('CHANNEL_REDIS_URL', 'redis://127.0.0.1:6379')],
         },
     },
 }
 
 
+# Cache (unread counters etc.). Set REDIS_URL to share it between workers,
+# otherwise each process gets its own local-memory cache
+if os.getenv('REDIS_URL'):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
@@ -160,6 +183,14 @@ USE_TZ = True
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Uploads are stored under their content hash (see posts/storage.py), so a
+# media URL never changes content and can be cached for good
+STORAGES = {
+    'default': {'BACKEND': 'posts.storage.ContentAddressedStorage'},
+    'staticfiles': {'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage'},
+}
+MEDIA_CACHE_MAX_AGE = 365 * 24 * 3600
+
 STATIC_URL = '/static/'
 STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
@@ -175,6 +206,8 @@ TEMPLATES = [
                 'django.template.context_processors.request',  # **Required for admin sidebar**
                 'django.contrib.auth.context_processors.auth',  # **Required for auth/admin**
                 'django.contrib.messages.context_processors.messages',  # **Required for messages/admin**
+                'chats.context_processors.unread_messages_count',  # Cached counter (chats/unread.py)
+                'chats.context_processors.presence_ping_interval',  # Heartbeat period for base.html
             ],
         },
     },
@@ -193,6 +226,44 @@ DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL')
 LOGIN_REDIRECT_URL = '/posts/home/'
 LOGOUT_REDIRECT_URL = '/accounts/login/'
 
+# Home Timeline (see posts/timeline.py)
+# Accounts with more followers than this are read on demand instead of fanned out
+TIMELINE_FANOUT_LIMIT = 5000
+TIMELINE_BACKFILL_SIZE = 50
+TIMELINE_PAGE_SIZE = 10
+
+# Follow graph adjacency cache (see accounts/follow_graph.py)
+FOLLOW_GRAPH_TIMEOUT = 10 * 60  # Bounds how long a copy that missed an update can live
+FOLLOW_GRAPH_ADJACENCY_LIMIT = 100000  # Bigger following sets are left to the database
+
+# Who to follow (see accounts/suggestions.py)
+SUGGESTIONS_PER_USER = 50  # Candidates kept per user; the sidebar samples from these
+SUGGESTIONS_CACHE_TIMEOUT = 3600
+
+# Fragment cache for grid tiles and profile headers (see posts/fragments.py)
+FRAGMENT_CACHE_TIMEOUT = 3600
+FRAGMENT_LRU_SIZE = 2000  # Fragments kept in each process in front of the shared cache
+
+# Chat write-behind (see chats/writer.py)
+CHAT_WRITE_BATCH_SIZE = 100
+CHAT_WRITE_FLUSH_INTERVAL = 0.05  # Seconds a batch may wait to fill up
+CHAT_WRITE_QUEUE_SIZE = 1000  # Queued messages per process before senders have to wait
+CHAT_SEEN_FLUSH_INTERVAL = 1.0  # Seconds of `seen` acks coalesced into one UPDATE
+CHAT_TYPING_MIN_INTERVAL = 1.0  # Least seconds between typing updates sent to a room per connection
+CHAT_TYPING_TIMEOUT = 6.0  # An unrefreshed "is typing" switches itself off after this
+# Unread counters (chats/unread.py) are updated in place, which only stays right in a
+# cache shared by every worker. A per-process cache lets them expire and be recounted.
+CHAT_UNREAD_TIMEOUT = None if os.getenv('REDIS_URL') else 30
+
+# Media processing (see posts/media_queue.py)
+MEDIA_JOB_LEASE = 300  # Seconds a claimed job is left alone before another worker may retry it
+MEDIA_JOB_MAX_ATTEMPTS = 3
+
+# Presence (see chats/presence.py)
+PRESENCE_PING_INTERVAL = 60  # Seconds between pings from an open page's socket
+PRESENCE_ONLINE_TIMEOUT = 150  # A socket silent for longer no longer counts as online
+PRESENCE_FLUSH_INTERVAL = 60  # Seconds between bulk last_seen writes (per process)
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 